@@ -0,0 +1,488 @@
+"""
+ancoragem.py - Fila persistente (outbox) de registros na blockchain
+
+Os endpoints gravam o lote e um item "pendente" em fila_ancoragem na mesma
+transação e respondem imediatamente. O despachante, em segundo plano, envia
+as transações, acompanha os recibos e grava o resultado na fila.
+
+Modos (ANCORAGEM_MODO):
+    direto - uma transação por lote, com as funções registrar* do contrato
+    merkle - os lotes de uma janela de tempo/tamanho viram folhas de uma
+             árvore de Merkle; só a raiz vai para a blockchain e cada item
+             guarda sua prova de inclusão
+
+Ciclo de vida de um item (ou de um lote Merkle):
+    pendente -> enviado -> confirmado
+                        -> pendente (recibo não chegou a tempo: reenvia)
+    pendente/enviado -> falhou (após ANCORAGEM_MAX_TENTATIVAS)
+No modo merkle o item fica "agrupado" e acompanha o status do seu grupo.
+
+Como todo o estado fica no banco, um restart apenas retoma a fila.
+Também pode rodar fora da API:  python ancoragem.py
+"""
+
+import os
+import json
+import random
+import datetime
+import threading
+from typing import Optional
+
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import Session, joinedload
+
+import logs
+import models
+import merkle
+import linhagem  # refletir_nos_lotes também atualiza linhagem_produtos (after_flush)
+import indexador
+from database import SessionLocal
+
+# ===================================
+# CONFIGURAÇÃO
+# ===================================
+
+# Modo de ancoragem dos novos lotes: 'direto' ou 'merkle'
+MODO = os.getenv("ANCORAGEM_MODO", "direto").lower()
+
+# Modo merkle: fecha um grupo ao atingir o tamanho máximo ou quando o item
+# mais antigo espera mais que a janela (segundos)
+MERKLE_TAMANHO_MAX = int(os.getenv("MERKLE_TAMANHO_MAX", "256"))
+MERKLE_JANELA_S = float(os.getenv("MERKLE_JANELA_S", "300"))
+
+# Liga/desliga o despachante dentro do processo da API
+DESPACHANTE_ATIVO = os.getenv("ANCORAGEM_DESPACHANTE_ATIVO", "true").lower() == "true"
+
+# Intervalo entre varreduras quando a fila está vazia (segundos)
+INTERVALO_VARREDURA_S = float(os.getenv("ANCORAGEM_INTERVALO_S", "2"))
+
+# Itens processados por varredura
+ITENS_POR_VARREDURA = int(os.getenv("ANCORAGEM_ITENS_POR_VARREDURA", "20"))
+
+# Retentativas com backoff exponencial: base * 2^(tentativas-1), limitado ao máximo
+MAX_TENTATIVAS = int(os.getenv("ANCORAGEM_MAX_TENTATIVAS", "8"))
+BACKOFF_BASE_S = float(os.getenv("ANCORAGEM_BACKOFF_BASE_S", "5"))
+BACKOFF_MAX_S = float(os.getenv("ANCORAGEM_BACKOFF_MAX_S", "600"))
+
+# Intervalo entre consultas de recibo e tempo máximo até considerar a transação perdida
+INTERVALO_RECIBO_S = float(os.getenv("ANCORAGEM_INTERVALO_RECIBO_S", "6"))
+TIMEOUT_RECIBO_S = float(os.getenv("ANCORAGEM_TIMEOUT_RECIBO_S", "600"))
+
+MODO_DIRETO = "direto"
+MODO_MERKLE = "merkle"
+
+STATUS_PENDENTE = "pendente"
+STATUS_AGRUPADO = "agrupado"
+STATUS_ENVIADO = "enviado"
+STATUS_CONFIRMADO = "confirmado"
+STATUS_FALHOU = "falhou"
+
+log = logs.obter_logger("ancoragem")
+
+
+def _agora() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _como_utc(momento: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    """SQLite devolve datas sem fuso; tratamos como UTC."""
+    if momento is not None and momento.tzinfo is None:
+        return momento.replace(tzinfo=datetime.timezone.utc)
+    return momento
+
+
+# ===================================
+# ENFILEIRAMENTO (chamado pelos endpoints)
+# ===================================
+
+def enfileirar(db: Session, tipo_lote: str, id_lote: int, id_lote_custom: str, dados: dict) -> models.FilaAncoragem:
+    """
+    Adiciona um registro pendente na fila, na transação corrente.
+    Quem chama é responsável pelo commit (junto com o lote).
+    """
+    item = models.FilaAncoragem(
+        tipo_lote=tipo_lote,
+        id_lote=id_lote,
+        id_lote_custom=id_lote_custom,
+        dados=json.dumps(dados, ensure_ascii=False),
+        modo=MODO_MERKLE if MODO == MODO_MERKLE else MODO_DIRETO,
+        status=STATUS_PENDENTE,
+        tentativas=0,
+        proxima_tentativa=_agora(),
+        id_requisicao=logs.id_requisicao_atual(),
+    )
+    db.add(item)
+    return item
+
+
+# Modelo de cada tipo de lote (colunas de models.AncoragemMixin)
+MODELOS_LOTE = {
+    "tora": models.LoteTora,
+    "serrado": models.LoteSerrado,
+    "produto": models.LoteProdutoAcabado,
+}
+
+
+def situacao_ancoragem(registro) -> dict:
+    """Colunas de ancoragem do lote a partir de um item da fila ou de um grupo Merkle."""
+    return {
+        "status_ancoragem": registro.status,
+        "tx_hash": registro.tx_hash,
+        "bloco_ancoragem": registro.bloco,
+        "tentativas_ancoragem": registro.tentativas,
+        "data_envio_ancoragem": registro.data_envio,
+        "data_confirmacao_ancoragem": registro.data_confirmacao,
+    }
+
+
+def refletir_nos_lotes(db: Session, lotes: list, situacao: dict):
+    """
+    Copia a situação da ancoragem para os lotes (lista de (tipo_lote, id_lote)),
+    uma consulta por tipo. Usa o ORM, e não UPDATE em massa, para que a
+    invalidação do cache do /rastrear enxergue a mudança.
+    """
+    por_tipo = {}
+    for tipo_lote, id_lote in lotes:
+        por_tipo.setdefault(tipo_lote, []).append(id_lote)
+    for tipo_lote, ids in por_tipo.items():
+        modelo = MODELOS_LOTE[tipo_lote]
+        for lote in db.query(modelo).filter(modelo.id.in_(ids)):
+            for coluna, valor in situacao.items():
+                setattr(lote, coluna, valor)
+
+
+def registro_canonico(item: models.FilaAncoragem) -> dict:
+    """Registro do lote usado como folha da árvore de Merkle."""
+    return {"tipo": item.tipo_lote, **json.loads(item.dados)}
+
+
+def obter_provas(db: Session, lotes: list) -> dict:
+    """
+    Situação da ancoragem de vários lotes numa única consulta.
+    lotes: lista de (tipo_lote, id_lote). Retorna {(tipo_lote, id_lote): dict}.
+    No modo merkle inclui o registro canônico, a folha, a prova e a raiz,
+    suficientes para verificar a inclusão sem consultar este servidor.
+    """
+    if not lotes:
+        return {}
+    itens = db.query(models.FilaAncoragem).options(
+        joinedload(models.FilaAncoragem.lote_merkle)
+    ).filter(or_(*[
+        and_(models.FilaAncoragem.tipo_lote == tipo, models.FilaAncoragem.id_lote == id_lote)
+        for tipo, id_lote in lotes
+    ])).all()
+
+    provas = {}
+    for item in itens:
+        prova = {
+            "modo": item.modo,
+            "status": item.status,
+            "tx_hash": item.tx_hash,
+            "bloco": item.bloco,
+        }
+        if item.modo == MODO_MERKLE:
+            grupo = item.lote_merkle
+            prova.update({
+                "registro": registro_canonico(item),
+                "folha": item.folha_merkle,
+                "prova": json.loads(item.prova_merkle) if item.prova_merkle else None,
+                "raiz": grupo.raiz if grupo else None,
+            })
+        provas[(item.tipo_lote, item.id_lote)] = prova
+    return provas
+
+
+# ===================================
+# DESPACHANTE (background)
+# ===================================
+
+class DespachanteAncoragem:
+    """
+    Drena a fila de ancoragem numa thread própria.
+    Vários despachantes (um por worker) podem rodar juntos: cada item é
+    travado com FOR UPDATE SKIP LOCKED enquanto é processado. Os envios não
+    esperam recibo, então vários itens ficam em voo ao mesmo tempo (os
+    nonces vêm de blockchain.gerenciador_nonce).
+    """
+
+    def __init__(self, session_factory=SessionLocal, intervalo_s: float = INTERVALO_VARREDURA_S):
+        self.session_factory = session_factory
+        self.intervalo_s = intervalo_s
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="despachante-ancoragem", daemon=True)
+        self._thread.start()
+        log.info("✅ Despachante de ancoragem iniciado")
+
+    def parar(self, timeout: float = 10):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout)
+        log.info("ℹ️ Despachante de ancoragem parado")
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                processados = self.processar_uma_vez()
+            except Exception as e:
+                log.exception("❌ Erro no despachante de ancoragem: %s", e)
+                processados = 0
+            # Fila vazia: espera; fila com itens: continua drenando
+            if processados == 0:
+                self._parar.wait(self.intervalo_s)
+
+    def processar_uma_vez(self) -> int:
+        """
+        Agrupa itens do modo merkle e processa até ITENS_POR_VARREDURA
+        registros vencidos (itens diretos e grupos Merkle). Cada registro
+        roda na sua própria transação. Retorna quantos foram processados.
+        """
+        import blockchain
+
+        # Sem contrato ou com o RPC fora do ar a fila só espera (MonitorConexao)
+        if not blockchain.disponivel():
+            return 0
+
+        processados = self._agrupar_merkle()
+        for _ in range(ITENS_POR_VARREDURA):
+            if self._parar.is_set():
+                break
+            db = self.session_factory()
+            try:
+                registro = self._proximo_registro(db)
+                if registro is None:
+                    break
+                antes = (registro.status, registro.tentativas, registro.tx_hash)
+                # Logs do envio/recibo levam o id da requisição que criou o lote
+                with logs.contexto_requisicao(getattr(registro, "id_requisicao", None)):
+                    if registro.status == STATUS_PENDENTE:
+                        self._enviar(db, registro, blockchain)
+                    else:
+                        self._verificar_recibo(db, registro, blockchain)
+                if (registro.status, registro.tentativas, registro.tx_hash) != antes:
+                    self._refletir(db, registro)
+                db.commit()
+                processados += 1
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+        return processados
+
+    def _vencidos(self, db: Session, modelo, agora: datetime.datetime):
+        consulta = db.query(modelo).filter(
+            modelo.status.in_([STATUS_PENDENTE, STATUS_ENVIADO]),
+            modelo.proxima_tentativa <= agora
+        )
+        if modelo is models.FilaAncoragem:
+            consulta = consulta.filter(models.FilaAncoragem.modo == MODO_DIRETO)
+        return consulta.order_by(modelo.proxima_tentativa)
+
+    def _proximo_registro(self, db: Session):
+        """
+        Registro vencido há mais tempo entre os itens diretos e os grupos
+        Merkle: com tráfego direto contínuo os grupos não ficam para trás.
+        Só o escolhido é travado; se outro despachante já o pegou, tenta a
+        outra tabela.
+        """
+        agora = _agora()
+        candidatos = []
+        for modelo in (models.FilaAncoragem, models.LoteMerkle):
+            vencimento = self._vencidos(db, modelo, agora).with_entities(modelo.proxima_tentativa).limit(1).scalar()
+            if vencimento is not None:
+                candidatos.append((_como_utc(vencimento), modelo))
+        for _, modelo in sorted(candidatos, key=lambda candidato: candidato[0]):
+            registro = self._vencidos(db, modelo, agora).with_for_update(skip_locked=True).first()
+            if registro is not None:
+                return registro
+        return None
+
+    # --- Modo merkle ---
+
+    def _agrupar_merkle(self) -> int:
+        """
+        Fecha um grupo Merkle com os itens pendentes, se a janela de tempo
+        ou o tamanho máximo foi atingido. Retorna quantos itens foram agrupados.
+        """
+        db = self.session_factory()
+        try:
+            itens = db.query(models.FilaAncoragem).filter(
+                models.FilaAncoragem.modo == MODO_MERKLE,
+                models.FilaAncoragem.status == STATUS_PENDENTE,
+                models.FilaAncoragem.id_lote_merkle.is_(None)
+            ).order_by(
+                models.FilaAncoragem.id
+            ).limit(MERKLE_TAMANHO_MAX).with_for_update(skip_locked=True).all()
+
+            if not itens:
+                return 0
+            mais_antigo = _como_utc(itens[0].data_criacao) or _agora()
+            janela_expirou = (_agora() - mais_antigo).total_seconds() >= MERKLE_JANELA_S
+            if len(itens) < MERKLE_TAMANHO_MAX and not janela_expirou:
+                db.rollback()
+                return 0
+
+            folhas = [merkle.hash_folha(registro_canonico(item)) for item in itens]
+            raiz, provas = merkle.construir_arvore(folhas)
+
+            grupo = models.LoteMerkle(
+                raiz="0x" + raiz.hex(),
+                quantidade=len(itens),
+                status=STATUS_PENDENTE,
+                tentativas=0,
+                proxima_tentativa=_agora(),
+            )
+            db.add(grupo)
+            db.flush()
+
+            for item, folha, prova in zip(itens, folhas, provas):
+                item.lote_merkle = grupo
+                item.status = STATUS_AGRUPADO
+                item.folha_merkle = "0x" + folha.hex()
+                item.prova_merkle = json.dumps(["0x" + irmao.hex() for irmao in prova])
+            refletir_nos_lotes(db, [(item.tipo_lote, item.id_lote) for item in itens], {"status_ancoragem": STATUS_AGRUPADO})
+            db.commit()
+            log.info("✅ Grupo Merkle %s fechado com %s lotes (raiz %s)", grupo.id, len(itens), grupo.raiz)
+            return len(itens)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _refletir(self, db: Session, registro):
+        """Atualiza as colunas de ancoragem do lote (ou dos lotes do grupo Merkle)."""
+        if isinstance(registro, models.LoteMerkle):
+            lotes = db.query(models.FilaAncoragem.tipo_lote, models.FilaAncoragem.id_lote).filter(
+                models.FilaAncoragem.id_lote_merkle == registro.id
+            ).all()
+        else:
+            lotes = [(registro.tipo_lote, registro.id_lote)]
+        refletir_nos_lotes(db, lotes, situacao_ancoragem(registro))
+
+    def _atualizar_itens_do_grupo(self, db: Session, grupo: models.LoteMerkle):
+        """Replica o resultado final do grupo (confirmado/falhou) nos seus itens."""
+        db.query(models.FilaAncoragem).filter(
+            models.FilaAncoragem.id_lote_merkle == grupo.id
+        ).update({
+            models.FilaAncoragem.status: grupo.status,
+            models.FilaAncoragem.tx_hash: grupo.tx_hash,
+            models.FilaAncoragem.bloco: grupo.bloco,
+            models.FilaAncoragem.data_confirmacao: grupo.data_confirmacao,
+            models.FilaAncoragem.ultimo_erro: grupo.ultimo_erro,
+        }, synchronize_session=False)
+
+    # --- Envio e recibos (itens diretos e grupos Merkle) ---
+
+    @staticmethod
+    def _descricao(registro) -> str:
+        if isinstance(registro, models.LoteMerkle):
+            return f"Grupo Merkle {registro.id}"
+        return f"Lote {registro.id_lote_custom}"
+
+    @staticmethod
+    def _construir_transacao(registro, blockchain) -> dict:
+        if isinstance(registro, models.LoteMerkle):
+            return blockchain.build_transaction_raiz_merkle(bytes.fromhex(registro.raiz[2:]))
+        preparar = blockchain.PREPARADORES[registro.tipo_lote]
+        function_call = preparar(**json.loads(registro.dados))
+        return blockchain.build_transaction(function_call)
+
+    def _enviar(self, db: Session, registro, blockchain):
+        """Assina, grava o hash e transmite. O hash é salvo antes do envio."""
+        registro.tentativas += 1
+        transaction = None
+        try:
+            transaction = self._construir_transacao(registro, blockchain)
+            signed_txn = blockchain.assinar_transacao(transaction)
+        except Exception as e:
+            if transaction is not None:
+                blockchain.gerenciador_nonce.liberar(transaction['nonce'])
+            self._agendar_retentativa(db, registro, f"Erro ao preparar transação: {e}")
+            return
+
+        registro.tx_hash = blockchain.Web3.to_hex(signed_txn.hash)
+        registro.status = STATUS_ENVIADO
+        registro.data_envio = _agora()
+        registro.proxima_tentativa = _agora() + datetime.timedelta(seconds=INTERVALO_RECIBO_S)
+        registro.ultimo_erro = None
+        # Persiste o hash antes de transmitir: se o processo cair entre
+        # o envio e o commit, o recibo ainda é encontrado na retomada.
+        db.commit()
+
+        try:
+            blockchain.transmitir_transacao(signed_txn, transaction['nonce'])
+            log.info("✅ %s enviado para a blockchain: %s", self._descricao(registro), registro.tx_hash,
+                     extra=logs.amostrado(tx_hash=registro.tx_hash))
+        except Exception as e:
+            self._agendar_retentativa(db, registro, f"Erro ao enviar: {e}")
+
+    def _verificar_recibo(self, db: Session, registro, blockchain):
+        """Consulta o recibo sem bloquear e atualiza o status do registro."""
+        try:
+            recibo = blockchain.obter_recibo(registro.tx_hash)
+        except Exception as e:
+            self._agendar_retentativa(db, registro, f"Erro ao consultar recibo: {e}")
+            return
+
+        if recibo is None:
+            enviado_em = _como_utc(registro.data_envio) or _agora()
+            if (_agora() - enviado_em).total_seconds() > TIMEOUT_RECIBO_S:
+                # Transação descartada da mempool: o nonce dela virou lacuna.
+                # Ressincroniza para reaproveitá-lo e reenvia o registro.
+                blockchain.gerenciador_nonce.ressincronizar()
+                self._agendar_retentativa(db, registro, "Recibo não encontrado dentro do prazo")
+            else:
+                registro.proxima_tentativa = _agora() + datetime.timedelta(seconds=INTERVALO_RECIBO_S)
+            return
+
+        registro.bloco = recibo["blockNumber"]
+        if recibo["status"] == 1:
+            self._confirmar(db, registro)
+            log.info("✅ %s confirmado no bloco %s", self._descricao(registro), registro.bloco,
+                     extra=logs.amostrado(tx_hash=registro.tx_hash, bloco=registro.bloco))
+        elif isinstance(registro, models.FilaAncoragem) and \
+                indexador.lote_existe(db, registro.id_lote_custom, registro.tipo_lote):
+            # Revertida porque o lote já estava registrado (ex.: reenvio após restart)
+            self._confirmar(db, registro, "Revertida: lote já registrado anteriormente")
+            log.info("ℹ️ %s já estava registrado na blockchain", self._descricao(registro))
+        else:
+            self._agendar_retentativa(db, registro, f"Transação revertida no bloco {registro.bloco}")
+
+    def _confirmar(self, db: Session, registro, observacao: Optional[str] = None):
+        registro.status = STATUS_CONFIRMADO
+        registro.data_confirmacao = _agora()
+        registro.ultimo_erro = observacao
+        if isinstance(registro, models.LoteMerkle):
+            self._atualizar_itens_do_grupo(db, registro)
+
+    def _agendar_retentativa(self, db: Session, registro, erro: str):
+        registro.ultimo_erro = erro
+        if registro.tentativas >= MAX_TENTATIVAS:
+            registro.status = STATUS_FALHOU
+            if isinstance(registro, models.LoteMerkle):
+                self._atualizar_itens_do_grupo(db, registro)
+            log.error("❌ %s: ancoragem falhou após %s tentativas (%s)", self._descricao(registro), registro.tentativas, erro,
+                      extra={"tx_hash": registro.tx_hash})
+            return
+
+        atraso = min(BACKOFF_BASE_S * (2 ** max(registro.tentativas - 1, 0)), BACKOFF_MAX_S)
+        atraso *= random.uniform(0.8, 1.2)  # jitter para não sincronizar workers
+        registro.status = STATUS_PENDENTE
+        registro.proxima_tentativa = _agora() + datetime.timedelta(seconds=atraso)
+        log.warning("⚠️ %s: %s. Nova tentativa em %.0fs", self._descricao(registro), erro, atraso)
+
+
+if __name__ == "__main__":
+    # Execução dedicada: python ancoragem.py
+    despachante = DespachanteAncoragem()
+    try:
+        despachante._executar()
+    except KeyboardInterrupt:
+        pass
@@ -1,10 +1,16 @@
 import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from dotenv import load_dotenv
 
+import metricas
+
 # Garante que as variáveis do .env sejam carregadas
 load_dotenv() 
 
@@ -19,6 +25,71 @@ def get_hash_senha(senha):
     """Gera o hash de uma senha plana."""
     return pwd_context.hash(senha)
 
+# --- Pool dedicado para o bcrypt ---
+# O bcrypt é CPU puro (e libera o GIL); rodá-lo num pool próprio e limitado
+# evita que uma rajada de logins ocupe o threadpool que atende as rotas.
+# Acima de BCRYPT_FILA_MAX verificações pendentes, o login é recusado (503).
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+BCRYPT_FILA_MAX = int(os.getenv("BCRYPT_FILA_MAX", "64"))
+
+_executor_senhas = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_vagas_senhas = threading.BoundedSemaphore(BCRYPT_FILA_MAX)
+
+fila_bcrypt = metricas.Medidor("auth_bcrypt_fila", "Verificações de senha na fila ou em execução")
+tempo_bcrypt = metricas.Histograma("auth_bcrypt_segundos", "Duração de cada verificação de senha")
+recusas_bcrypt = metricas.Contador("auth_bcrypt_recusados_total", "Logins recusados com a fila do bcrypt cheia")
+
+class FilaSenhasCheia(Exception):
+    pass
+
+# Hash usado quando o email não existe: o tempo de resposta fica igual ao de
+# uma senha errada (não revela quais emails estão cadastrados)
+_hash_ficticio = None
+
+def _obter_hash_ficticio() -> str:
+    global _hash_ficticio
+    if _hash_ficticio is None:
+        _hash_ficticio = pwd_context.hash("senha-ficticia-para-tempo-constante")
+    return _hash_ficticio
+
+def _verificar_e_atualizar(senha_plana: str, hash_senha: Optional[str]) -> Tuple[bool, Optional[str]]:
+    inicio = time.perf_counter()
+    try:
+        if hash_senha is None:
+            pwd_context.verify(senha_plana, _obter_hash_ficticio())
+            return False, None
+        try:
+            return pwd_context.verify_and_update(senha_plana, hash_senha)
+        except ValueError:  # hash em formato desconhecido
+            return False, None
+    finally:
+        tempo_bcrypt.observar(time.perf_counter() - inicio)
+
+def _submeter_verificacao(senha_plana: str, hash_senha: Optional[str]) -> Future:
+    if not _vagas_senhas.acquire(blocking=False):
+        recusas_bcrypt.inc()
+        raise FilaSenhasCheia()
+    fila_bcrypt.inc()
+
+    def _liberar(_):
+        fila_bcrypt.dec()
+        _vagas_senhas.release()
+
+    futuro = _executor_senhas.submit(_verificar_e_atualizar, senha_plana, hash_senha)
+    futuro.add_done_callback(_liberar)
+    return futuro
+
+async def verificar_senha_login_async(senha_plana: str, hash_senha: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """
+    Uma única verificação no pool do bcrypt, aguardada sem bloquear o event
+    loop nem uma thread de requisição. Retorna (ok, novo_hash); novo_hash
+    vem preenchido quando o hash usa parâmetros desatualizados
+    (needs_update) e deve ser regravado. hash_senha=None (usuário não
+    encontrado) faz uma verificação fictícia e retorna (False, None).
+    Levanta FilaSenhasCheia se o pool estiver saturado.
+    """
+    return await asyncio.wrap_future(_submeter_verificacao(senha_plana, hash_senha))
+
 # --- Configuração do Token JWT (Do jeito correto, via .env) ---
 
 # 1. Pega a chave do ambiente (do .env local ou do Render)
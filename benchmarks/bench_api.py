@@ -0,0 +1,298 @@
+"""
+bench_api.py - Carga e latência dos endpoints principais, sem rede externa
+
+Sobe a API num uvicorn local (mesmo processo), com o banco populado com N
+cadeias tora → serrado → produto e a blockchain substituída por uma cadeia
+eth-tester em memória (o despachante de ancoragem roda normalmente). Em
+seguida dispara cada cenário com httpx em vários níveis de concorrência e
+mede vazão e percentis de latência.
+
+O resultado vai para um JSON (com o commit atual) para comparar versões:
+
+    python benchmarks/bench_api.py [--cadeias 2000] [--concorrencia 1,8,32]
+                                   [--requisicoes 400] [--cenarios rastrear,listar_lotes_tora]
+                                   [--saida bench_api.json] [--database-url ...] [--async]
+
+Sem --database-url usa um SQLite temporário. Com ele (ex.: um Postgres
+descartável em container), as tabelas precisam estar vazias; o script não
+apaga nada fora do SQLite temporário.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+CENARIOS = (
+    "login",
+    "criar_lote_tora",
+    "listar_lotes_tora",
+    "listar_produtos",
+    "rastrear",
+    "rastrear_prova",
+    "linhagem",
+    "relatorio_volume",
+)
+SENHA = "benchmark"
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cadeias", type=int, default=2000, help="Cadeias tora → serrado → produto no banco")
+    parser.add_argument("--concorrencia", default="1,8,32", help="Níveis de concorrência, separados por vírgula")
+    parser.add_argument("--requisicoes", type=int, default=400, help="Requisições por cenário e nível")
+    parser.add_argument("--cenarios", default=",".join(CENARIOS))
+    parser.add_argument("--saida", default="bench_api.json")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--async", dest="assincrono", action="store_true", help="Rotas assíncronas (DB_ASYNC=true)")
+    parser.add_argument("--sem-despachante", action="store_true", help="Não roda a ancoragem durante a carga")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+args = _argumentos()
+if args.database_url:
+    os.environ["DATABASE_URL"] = args.database_url
+else:
+    _arquivo = os.path.join(tempfile.mkdtemp(prefix="bench_api_"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{_arquivo}"
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["DB_ASYNC"] = "true" if args.assincrono else "false"
+os.environ["ANCORAGEM_DESPACHANTE_ATIVO"] = "false" if args.sem_despachante else "true"
+os.environ.setdefault("ETHEREUM_RPC_URLS", "http://127.0.0.1:9")  # nunca usado: a cadeia é trocada abaixo
+
+import httpx
+import uvicorn
+from web3 import Web3, EthereumTesterProvider
+
+import auth
+import database
+import instrumentacao
+import models
+
+
+# ===================================
+# CADEIA LOCAL E DADOS
+# ===================================
+
+def configurar_cadeia_local():
+    """Troca o provedor do módulo blockchain por uma cadeia eth-tester."""
+    import blockchain
+    w3 = instrumentacao.instrumentar_web3(Web3(EthereumTesterProvider()))
+    blockchain.PRIVATE_KEY = "0x" + "00" * 31 + "01"  # conta 0 do eth-tester
+    blockchain.WALLET_ADDRESS = w3.eth.accounts[0]
+    blockchain.CHAIN_ID = w3.eth.chain_id
+    contrato = w3.eth.contract(address="0x000000000000000000000000000000000000dEaD", abi=blockchain.CONTRACT_ABI)
+    blockchain.configurar(w3, contrato)
+
+
+def popular(cadeias: int) -> dict:
+    """Usuários e cadeias completas; retorna IDs usados pelos cenários."""
+    database.Base.metadata.create_all(database.engine)
+    db = database.SessionLocal()
+    try:
+        hash_senha = auth.get_hash_senha(SENHA)
+        tecnico = models.TecnicoCampo(nome="bench", email="bench@tecnico.com", hash_senha=hash_senha)
+        serraria = models.EquipeSerraria(nome_responsavel="bench", email="bench@serraria.com", hash_senha=hash_senha)
+        fabrica = models.EquipeFabrica(nome_responsavel="bench", email="bench@fabrica.com", hash_senha=hash_senha)
+        db.add_all([tecnico, serraria, fabrica])
+        db.flush()
+
+        agora = datetime.datetime.now(datetime.timezone.utc)
+        ids_tora, ids_produto = [], []
+        for inicio in range(0, cadeias, 1000):
+            lote = []
+            for i in range(inicio, min(inicio + 1000, cadeias)):
+                tora = models.LoteTora(
+                    id_lote_custom=f"TORA-BENCH-{i:06d}", id_tecnico_campo=tecnico.id,
+                    coordenadas_gps_lat=-3.1, coordenadas_gps_lon=-60.0, numero_dof=f"DOF-{i % 500}",
+                    numero_licenca_ambiental="LIC", especie_madeira_popular="Ipê", volume_estimado_m3=10,
+                    volume_processado_m3=4,
+                )
+                serrado = models.LoteSerrado(
+                    id_lote_serrado_custom=f"SERR-BENCH-{i:06d}", lote_tora_origem=tora,
+                    id_equipe_serraria=serraria.id, data_recebimento_tora=agora, volume_saida_m3=4,
+                )
+                produto = models.LoteProdutoAcabado(
+                    id_lote_produto_custom=f"PROD-BENCH-{i:06d}", lote_serrado_origem=serrado,
+                    id_equipe_fabrica=fabrica.id, sku_produto=f"SKU-{i}", nome_produto="Mesa",
+                    link_qr_code="bench",
+                )
+                lote.extend([tora, serrado, produto])
+                ids_produto.append(produto.id_lote_produto_custom)
+            db.add_all(lote)
+            db.flush()
+            ids_tora.extend(obj.id for obj in lote if isinstance(obj, models.LoteTora))
+        db.commit()
+        return {"ids_tora": ids_tora, "ids_produto": ids_produto}
+    finally:
+        db.close()
+
+
+# ===================================
+# SERVIDOR LOCAL
+# ===================================
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def iniciar_servidor():
+    import main
+    porta = _porta_livre()
+    servidor = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=porta, log_level="warning"))
+    thread = threading.Thread(target=servidor.run, name="uvicorn-bench", daemon=True)
+    thread.start()
+    while not servidor.started:
+        time.sleep(0.05)
+    return servidor, thread, f"http://127.0.0.1:{porta}"
+
+
+# ===================================
+# CENÁRIOS
+# ===================================
+
+def requisicao(cenario: str, rng: random.Random, contexto: dict):
+    """(método, caminho, kwargs do httpx) de uma requisição do cenário."""
+    tokens = contexto["tokens"]
+    if cenario == "login":
+        email = rng.choice(["bench@tecnico.com", "bench@serraria.com", "bench@fabrica.com"])
+        return "POST", "/token", {"data": {"username": email, "password": SENHA}}
+    if cenario == "criar_lote_tora":
+        return "POST", "/lotes_tora/", {"headers": tokens["tecnico"], "json": {
+            "coordenadas_gps_lat": "-3.1", "coordenadas_gps_lon": "-60.0", "numero_dof": f"DOF-{rng.randrange(500)}",
+            "numero_licenca_ambiental": "LIC", "especie_madeira_popular": "Ipê", "volume_estimado_m3": "10",
+        }}
+    if cenario == "listar_lotes_tora":
+        return "GET", "/lotes_tora/", {"headers": tokens["serraria"], "params": {"limite": 50}}
+    if cenario == "listar_produtos":
+        return "GET", "/produtos_acabados/", {"headers": tokens["fabrica"], "params": {"limite": 50}}
+    if cenario == "rastrear":
+        return "GET", f"/rastrear/{rng.choice(contexto['ids_produto'])}", {}
+    if cenario == "rastrear_prova":
+        return "GET", f"/rastrear/{rng.choice(contexto['ids_produto'])}", {"params": {"incluir_prova": "true"}}
+    if cenario == "linhagem":
+        return "GET", "/linhagem/tora", {"headers": tokens["serraria"], "params": {"id_lote_tora": rng.choice(contexto["ids_tora"])}}
+    if cenario == "relatorio_volume":
+        return "GET", "/relatorios/volume", {"headers": tokens["fabrica"], "params": {"agrupar_por": rng.choice(["especie", "dof", "serraria"])}}
+    raise ValueError(cenario)
+
+
+async def executar_cenario(url: str, cenario: str, concorrencia: int, total: int, contexto: dict, seed: int) -> dict:
+    rng = random.Random(seed)
+    pedidos = [requisicao(cenario, rng, contexto) for _ in range(total)]
+    latencias, status = [], {}
+    proximo = 0
+
+    limites = httpx.Limits(max_connections=concorrencia, max_keepalive_connections=concorrencia)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as cliente:
+        async def trabalhador():
+            nonlocal proximo
+            while proximo < total:
+                metodo, caminho, kwargs = pedidos[proximo]
+                proximo += 1
+                inicio = time.perf_counter()
+                try:
+                    resposta = await cliente.request(metodo, caminho, **kwargs)
+                    codigo = str(resposta.status_code)
+                except httpx.HTTPError as e:
+                    codigo = type(e).__name__
+                latencias.append((time.perf_counter() - inicio) * 1000)
+                status[codigo] = status.get(codigo, 0) + 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabalhador() for _ in range(concorrencia)))
+        duracao = time.perf_counter() - inicio
+
+    latencias.sort()
+    def percentil(p):
+        return round(latencias[min(len(latencias) - 1, int(len(latencias) * p))], 3)
+    return {
+        "requisicoes": total,
+        "duracao_s": round(duracao, 3),
+        "vazao_rps": round(total / duracao, 1),
+        "p50_ms": percentil(0.50),
+        "p90_ms": percentil(0.90),
+        "p99_ms": percentil(0.99),
+        "max_ms": round(latencias[-1], 3),
+        "media_ms": round(statistics.fmean(latencias), 3),
+        "status": status,
+    }
+
+
+def _commit_atual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    cenarios = [c.strip() for c in args.cenarios.split(",") if c.strip()]
+    invalidos = [c for c in cenarios if c not in CENARIOS]
+    if invalidos:
+        raise SystemExit(f"Cenários inválidos: {', '.join(invalidos)}")
+    niveis = [int(n) for n in args.concorrencia.split(",")]
+
+    configurar_cadeia_local()
+    inicio = time.perf_counter()
+    contexto = popular(args.cadeias)
+    print(f"ℹ️ {args.cadeias} cadeias populadas em {time.perf_counter() - inicio:.1f}s ({database.engine.dialect.name})")
+
+    servidor, thread, url = iniciar_servidor()
+    try:
+        with httpx.Client(base_url=url) as cliente:
+            contexto["tokens"] = {}
+            for papel in ("tecnico", "serraria", "fabrica"):
+                resposta = cliente.post("/token", data={"username": f"bench@{papel}.com", "password": SENHA})
+                resposta.raise_for_status()
+                contexto["tokens"][papel] = {"Authorization": f"Bearer {resposta.json()['access_token']}"}
+
+        resultados = {}
+        for cenario in cenarios:
+            resultados[cenario] = {}
+            # Aquecimento (pool de conexões, caches, compilação do SQLAlchemy)
+            asyncio.run(executar_cenario(url, cenario, 1, 20, contexto, args.seed))
+            for nivel in niveis:
+                medida = asyncio.run(executar_cenario(url, cenario, nivel, args.requisicoes, contexto, args.seed + nivel))
+                resultados[cenario][str(nivel)] = medida
+                print(f"{cenario:<20} c={nivel:<4} {medida['vazao_rps']:>9.1f} req/s  "
+                      f"p50 {medida['p50_ms']:>8.2f} ms  p99 {medida['p99_ms']:>8.2f} ms  {medida['status']}")
+    finally:
+        servidor.should_exit = True
+        thread.join(30)
+
+    relatorio = {
+        "commit": _commit_atual(),
+        "data": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {
+            "cadeias": args.cadeias,
+            "requisicoes": args.requisicoes,
+            "concorrencia": niveis,
+            "banco": database.engine.dialect.name,
+            "async": args.assincrono,
+            "despachante": not args.sem_despachante,
+        },
+        "resultados": resultados,
+    }
+    with open(args.saida, "w", encoding="utf-8") as saida:
+        json.dump(relatorio, saida, ensure_ascii=False, indent=2)
+    print(f"✅ Resultado em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
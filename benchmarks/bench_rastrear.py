@@ -0,0 +1,168 @@
+"""
+bench_rastrear.py - Compara a resolução da cadeia do /rastrear
+
+Antes: três consultas (produto, depois lote serrado, depois lote de tora).
+Agora: uma linha do modelo de leitura linhagem_produtos, lida pelo ID
+customizado (servicos.rastrear_produto).
+
+Popula um SQLite temporário e mede p50/p99 das duas versões consultando
+produtos aleatórios. Uso (na raiz do projeto):
+
+    python benchmarks/bench_rastrear.py [--produtos 2000] [--consultas 5000]
+
+Com --database-url dá para apontar para um Postgres de teste (as tabelas
+precisam estar vazias; o script não apaga nada fora do SQLite temporário).
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--produtos", type=int, default=2000)
+    parser.add_argument("--consultas", type=int, default=5000)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+args = _argumentos()
+if args.database_url:
+    os.environ["DATABASE_URL"] = args.database_url
+else:
+    _arquivo = os.path.join(tempfile.mkdtemp(prefix="bench_rastrear_"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{_arquivo}"
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import datetime
+from fastapi import HTTPException
+
+import database
+import models
+import schemas
+import servicos
+
+
+def rastrear_antigo(db, id_produto_custom: str) -> schemas.RastreioDisplay:
+    """Implementação anterior: uma ida ao banco por nível da cadeia."""
+    produto = db.query(models.LoteProdutoAcabado).filter(
+        models.LoteProdutoAcabado.id_lote_produto_custom == id_produto_custom
+    ).first()
+    if not produto:
+        raise HTTPException(status_code=404, detail="Produto não encontrado")
+
+    lote_serrado = db.query(models.LoteSerrado).filter(
+        models.LoteSerrado.id == produto.id_lote_serrado_origem
+    ).first()
+    lote_tora = None
+    if lote_serrado:
+        lote_tora = db.query(models.LoteTora).filter(
+            models.LoteTora.id == lote_serrado.id_lote_tora_origem
+        ).first()
+
+    return schemas.RastreioDisplay(
+        produto=schemas.RastreioProduto(
+            id=produto.id, id_custom=produto.id_lote_produto_custom, nome=produto.nome_produto,
+            sku=produto.sku_produto, data_fabricacao=produto.data_fabricacao,
+            dados_acabamento=produto.dados_acabamento
+        ),
+        lote_serrado=schemas.RastreioLoteSerrado(
+            id=lote_serrado.id, id_custom=lote_serrado.id_lote_serrado_custom,
+            tipo_produto=lote_serrado.tipo_produto, dimensoes=lote_serrado.dimensoes,
+            volume_m3=float(lote_serrado.volume_saida_m3), data_processamento=lote_serrado.data_processamento
+        ) if lote_serrado else None,
+        lote_tora=schemas.RastreioLoteTora(
+            id=lote_tora.id, id_custom=lote_tora.id_lote_custom,
+            especie_popular=lote_tora.especie_madeira_popular,
+            especie_cientifica=lote_tora.especie_madeira_cientifico,
+            volume_m3=float(lote_tora.volume_estimado_m3), numero_dof=lote_tora.numero_dof,
+            numero_licenca=lote_tora.numero_licenca_ambiental,
+            coordenadas=schemas.Coordenadas(lat=float(lote_tora.coordenadas_gps_lat), lon=float(lote_tora.coordenadas_gps_lon)),
+            data_registro=lote_tora.data_hora_registro
+        ) if lote_tora else None
+    )
+
+
+def popular(quantidade: int) -> list:
+    """Cria usuários, toras, serrados e produtos; retorna os IDs de produto."""
+    database.Base.metadata.create_all(database.engine)
+    db = database.SessionLocal()
+    try:
+        tecnico = models.TecnicoCampo(nome="bench", email="bench@tecnico", hash_senha="x")
+        serraria = models.EquipeSerraria(nome_responsavel="bench", email="bench@serraria", hash_senha="x")
+        fabrica = models.EquipeFabrica(nome_responsavel="bench", email="bench@fabrica", hash_senha="x")
+        db.add_all([tecnico, serraria, fabrica])
+        db.flush()
+
+        agora = datetime.datetime.now()
+        ids = []
+        for i in range(quantidade):
+            tora = models.LoteTora(
+                id_lote_custom=f"TORA-BENCH-{i:06d}", id_tecnico_campo=tecnico.id,
+                coordenadas_gps_lat=-3.1, coordenadas_gps_lon=-60.0, numero_dof=f"DOF-{i}",
+                numero_licenca_ambiental="LIC", especie_madeira_popular="Ipê", volume_estimado_m3=10,
+            )
+            serrado = models.LoteSerrado(
+                id_lote_serrado_custom=f"SERR-BENCH-{i:06d}", lote_tora_origem=tora,
+                id_equipe_serraria=serraria.id, data_recebimento_tora=agora, volume_saida_m3=4,
+            )
+            produto = models.LoteProdutoAcabado(
+                id_lote_produto_custom=f"PROD-BENCH-{i:06d}", lote_serrado_origem=serrado,
+                id_equipe_fabrica=fabrica.id, sku_produto=f"SKU-{i}", nome_produto="Mesa",
+                link_qr_code="bench",
+            )
+            db.add_all([tora, serrado, produto])
+            ids.append(produto.id_lote_produto_custom)
+        db.commit()
+        return ids
+    finally:
+        db.close()
+
+
+def medir(funcao, ids: list, consultas: int) -> dict:
+    amostras = []
+    for id_produto in ids[:consultas]:
+        db = database.SessionLocal()
+        try:
+            inicio = time.perf_counter()
+            funcao(db, id_produto)
+            amostras.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            db.close()
+    amostras.sort()
+    return {
+        "p50_ms": statistics.median(amostras),
+        "p99_ms": amostras[min(len(amostras) - 1, int(len(amostras) * 0.99))],
+        "media_ms": statistics.fmean(amostras),
+    }
+
+
+def main():
+    random.seed(args.seed)
+    ids = popular(args.produtos)
+    consultas = [random.choice(ids) for _ in range(args.consultas)]
+
+    # Aquecimento (pool, cache de compilação do SQLAlchemy)
+    medir(rastrear_antigo, consultas, 200)
+    medir(servicos.rastrear_produto, consultas, 200)
+
+    antes = medir(rastrear_antigo, consultas, len(consultas))
+    depois = medir(servicos.rastrear_produto, consultas, len(consultas))
+
+    print(f"\n{args.consultas} consultas sobre {args.produtos} produtos ({database.engine.dialect.name})")
+    print(f"{'':<20}{'p50 (ms)':>10}{'p99 (ms)':>10}{'média (ms)':>12}")
+    for nome, r in (("3 consultas", antes), ("linhagem_produtos", depois)):
+        print(f"{nome:<20}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['media_ms']:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
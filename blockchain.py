@@ -4,10 +4,21 @@ Gerencia a comunicação entre o backend FastAPI e o Smart Contract
 """
 
 import os
+import time
+import heapq
+import threading
 from web3 import Web3
+from web3.exceptions import TransactionNotFound
 from typing import Optional, Dict
 import json
 
+import logs
+import metricas
+import provedores
+import instrumentacao
+
+log = logs.obter_logger("blockchain")
+
 # ===================================
 # CONFIGURAÇÃO
 # ===================================
@@ -19,13 +30,18 @@ INFURA_URL = os.getenv("INFURA_SEPOLIA_URL", "https://sepolia.infura.io/v3/SEU_P
 # Endereço do contrato deployado (você vai obter isso após fazer deploy no Remix)
 CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "0x...")
 
-# ABI do contrato (copie do Remix após compilar)
-CONTRACT_ABI = json.loads(os.getenv("CONTRACT_ABI", "[]"))
+# ABI do contrato: arquivo versionado junto com o código (exportado do Remix)
+ARQUIVO_ABI = os.getenv(
+    "CONTRACT_ABI_ARQUIVO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "contract_abi.json")
+)
 
 # Chave privada da conta que vai enviar transações
 # NUNCA commite isso no Git! Use variáveis de ambiente!
 PRIVATE_KEY = os.getenv("ETHEREUM_PRIVATE_KEY", "")
 
+# Chain ID da rede (Sepolia por padrão; 31337 para anvil/hardhat local)
+CHAIN_ID = int(os.getenv("ETHEREUM_CHAIN_ID", "11155111"))
+
 # Endereço da carteira
 WALLET_ADDRESS = os.getenv("ETHEREUM_WALLET_ADDRESS", "")
 
@@ -37,41 +53,165 @@ if WALLET_ADDRESS and WALLET_ADDRESS != "":
     try:
         from web3 import Web3 as Web3Check
         WALLET_ADDRESS = Web3Check.to_checksum_address(WALLET_ADDRESS)
-        print(f"✅ Wallet address convertido para checksum: {WALLET_ADDRESS}")
+        log.info("✅ Wallet address convertido para checksum: %s", WALLET_ADDRESS)
     except Exception as e:
-        print(f"⚠️ Erro ao converter wallet address: {e}")
+        log.warning("⚠️ Erro ao converter wallet address: %s", e)
 
 # Converter CONTRACT_ADDRESS para checksum também
 if CONTRACT_ADDRESS and CONTRACT_ADDRESS != "0x...":
     try:
         from web3 import Web3 as Web3Check
         CONTRACT_ADDRESS = Web3Check.to_checksum_address(CONTRACT_ADDRESS)
-        print(f"✅ Contract address convertido para checksum: {CONTRACT_ADDRESS}")
+        log.info("✅ Contract address convertido para checksum: %s", CONTRACT_ADDRESS)
     except Exception as e:
-        print(f"⚠️ Erro ao converter contract address: {e}")
+        log.warning("⚠️ Erro ao converter contract address: %s", e)
+
+# Intervalo entre sondagens do RPC quando conectado / desconectado (segundos)
+SONDAGEM_INTERVALO_S = float(os.getenv("BLOCKCHAIN_SONDAGEM_S", "30"))
+SONDAGEM_INTERVALO_FALHA_S = float(os.getenv("BLOCKCHAIN_SONDAGEM_FALHA_S", "5"))
+
+def _carregar_abi() -> list:
+    try:
+        with open(ARQUIVO_ABI, encoding="utf-8") as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError) as e:
+        log.error("❌ Erro ao carregar a ABI do contrato (%s): %s", ARQUIVO_ABI, e)
+        return []
+
+CONTRACT_ABI = _carregar_abi()
 
 # ===================================
 # INICIALIZAÇÃO WEB3
 # ===================================
+# Nada aqui faz chamada de rede: o import do módulo (e o boot do worker)
+# não depende do RPC. O Web3 e o contrato são criados no primeiro uso e o
+# MonitorConexao sonda a rede em segundo plano; enquanto o RPC não
+# responde, disponivel() é False e a ancoragem/indexação esperam.
 
-# Conectar ao provedor
-w3 = Web3(Web3.HTTPProvider(INFURA_URL))
+_lock_conexao = threading.Lock()
+_w3: Optional[Web3] = None
+_contrato = None
 
-# Verificar conexão
-if w3.is_connected():
-    print("✅ Conectado à Ethereum Sepolia!")
-else:
-    print("❌ Erro ao conectar à Ethereum")
-
-# Instanciar o contrato
-contract = None
-if CONTRACT_ADDRESS != "0x..." and len(CONTRACT_ABI) > 0:
+def _criar_contrato(w3: Web3):
+    if CONTRACT_ADDRESS == "0x..." or not CONTRACT_ABI:
+        return None
     try:
-        contract_address_checksum = w3.to_checksum_address(CONTRACT_ADDRESS)
-        contract = w3.eth.contract(address=contract_address_checksum, abi=CONTRACT_ABI)
-        print(f"✅ Contrato carregado: {contract_address_checksum}")
+        contrato = w3.eth.contract(address=Web3.to_checksum_address(CONTRACT_ADDRESS), abi=CONTRACT_ABI)
+        log.info("✅ Contrato carregado: %s", contrato.address)
+        return contrato
     except Exception as e:
-        print(f"❌ Erro ao carregar contrato: {e}")
+        log.error("❌ Erro ao carregar contrato: %s", e)
+        return None
+
+def obter_w3() -> Web3:
+    """Instância do Web3 (um ou mais endpoints, com failover: ver provedores.py)."""
+    global _w3, _contrato
+    if _w3 is None:
+        with _lock_conexao:
+            if _w3 is None:
+                w3 = instrumentacao.instrumentar_web3(Web3(provedores.criar_provedor()))
+                _contrato = _criar_contrato(w3)
+                _w3 = w3
+    return _w3
+
+def obter_contrato():
+    """Contrato configurado (CONTRACT_ADDRESS + ABI) ou None."""
+    obter_w3()
+    return _contrato
+
+def configurar(w3: Web3, contrato=None):
+    """Troca o Web3 e o contrato (testes, benchmarks, rede local)."""
+    global _w3, _contrato
+    with _lock_conexao:
+        _w3, _contrato = w3, contrato
+    monitor_conexao.reiniciar_estado()
+
+class MonitorConexao:
+    """
+    Sonda o RPC (eth_chainId) em segundo plano. A ancoragem e o indexador
+    consultam disponivel() antes de cada varredura: param quando a rede cai
+    e voltam sozinhos quando ela se recupera, sem reiniciar o worker.
+    """
+
+    def __init__(self, intervalo_s: float = SONDAGEM_INTERVALO_S, intervalo_falha_s: float = SONDAGEM_INTERVALO_FALHA_S):
+        self.intervalo_s = intervalo_s
+        self.intervalo_falha_s = intervalo_falha_s
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.reiniciar_estado()
+
+    def reiniciar_estado(self):
+        self.conectado = False
+        self.ultimo_erro: Optional[str] = None
+        self._ultima_sondagem: Optional[float] = None
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="monitor-blockchain", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(5)
+
+    def _executar(self):
+        while not self._parar.is_set():
+            conectado = self.processar_uma_vez()
+            self._parar.wait(self.intervalo_s if conectado else self.intervalo_falha_s)
+
+    def processar_uma_vez(self) -> bool:
+        """Uma sondagem; registra (e loga) as mudanças de estado."""
+        try:
+            chain_id = obter_w3().eth.chain_id
+            erro = None if chain_id == CHAIN_ID else f"chain id {chain_id} diferente do configurado ({CHAIN_ID})"
+        except Exception as e:
+            erro = str(e)
+
+        conectado = erro is None
+        primeira = self._ultima_sondagem is None
+        if conectado and (primeira or not self.conectado):
+            log.info("✅ Conectado à rede Ethereum (chain id %s)", CHAIN_ID)
+        elif not conectado and (primeira or self.conectado):
+            log.error("❌ Sem conexão com a rede Ethereum: %s. Nova sondagem a cada %.0fs", erro, self.intervalo_falha_s)
+        self.conectado = conectado
+        self.ultimo_erro = erro
+        self._ultima_sondagem = time.monotonic()
+        return conectado
+
+    def sondar_se_vencida(self):
+        """Fora da API (sem a thread), sonda na hora quando a última sondagem venceu."""
+        if self._thread and self._thread.is_alive():
+            return
+        if self._ultima_sondagem is not None:
+            intervalo = self.intervalo_s if self.conectado else self.intervalo_falha_s
+            if time.monotonic() - self._ultima_sondagem < intervalo:
+                return
+        self.processar_uma_vez()
+
+    def estado(self) -> Dict:
+        return {
+            "conectado": self.conectado,
+            "ultimo_erro": self.ultimo_erro,
+            "sondado_ha_s": round(time.monotonic() - self._ultima_sondagem, 1) if self._ultima_sondagem else None,
+        }
+
+monitor_conexao = MonitorConexao()
+
+metricas.Medidor(
+    "blockchain_conectado",
+    "1 se a última sondagem do RPC respondeu com o chain id configurado",
+    funcao=lambda: 1 if monitor_conexao.conectado else 0,
+)
+
+def disponivel() -> bool:
+    """Contrato configurado e RPC respondendo: dá para ancorar/consultar."""
+    if obter_contrato() is None:
+        return False
+    monitor_conexao.sondar_se_vencida()
+    return monitor_conexao.conectado
 
 # ===================================
 # FUNÇÕES AUXILIARES
@@ -86,11 +226,16 @@ def to_checksum_address(address: str) -> str:
             return address
         if not address.startswith("0x"):
             address = "0x" + address
-        return w3.to_checksum_address(address)
+        return Web3.to_checksum_address(address)
     except Exception as e:
-        print(f"⚠️ Erro ao converter endereço {address}: {e}")
+        log.warning("⚠️ Erro ao converter endereço %s: %s", address, e)
         return address
 
+def estado_rpc() -> Optional[list]:
+    """Saúde de cada endpoint RPC (latência média, taxa de erro, suspensão)."""
+    estado = getattr(obter_w3().provider, "estado", None)
+    return estado() if estado else None
+
 def converter_volume_para_blockchain(volume_decimal: float) -> int:
     """
     Converte volume decimal para inteiro (multiplica por 100)
@@ -105,68 +250,454 @@ def converter_coordenadas(lat: float, lon: float) -> str:
     """
     return f"{lat},{lon}"
 
+# ===================================
+# GERENCIADOR DE NONCE
+# ===================================
+
+# Mensagens de erro do nó que indicam nonce fora de sincronia com a rede
+ERROS_DE_NONCE = (
+    "nonce too low",
+    "nonce too high",
+    "replacement transaction underpriced",
+    "already known",
+    "known transaction",
+    "invalid transaction nonce",  # eth-tester/py-evm
+    "oldnonce",  # Nethermind
+)
+
+def erro_de_nonce(erro: Exception) -> bool:
+    """Indica se o erro do nó foi causado por nonce repetido/fora de ordem."""
+    mensagem = str(erro).lower()
+    return any(trecho in mensagem for trecho in ERROS_DE_NONCE)
+
+class GerenciadorNonce:
+    """
+    Reserva nonces localmente para a carteira, sem consultar a rede a cada
+    transação, permitindo várias transações em voo ao mesmo tempo.
+
+    É seguro entre threads. Pode ser chamado de código asyncio, pois o lock
+    só é mantido durante operações curtas (a rede só é consultada na
+    primeira reserva e nas ressincronizações).
+    """
+
+    # Reservas mais antigas que isso são consideradas abandonadas
+    RESERVA_MAX_S = 60
+
+    def __init__(self, obter_nonce_rede):
+        # Função que retorna o próximo nonce segundo a rede (contagem 'pending')
+        self._obter_nonce_rede = obter_nonce_rede
+        self._lock = threading.Lock()
+        self._proximo: Optional[int] = None
+        self._lacunas = []  # heap de nonces devolvidos, reutilizados primeiro
+        self._reservados = {}  # nonce -> momento da reserva (ainda não transmitido)
+
+    def reservar(self) -> int:
+        """Reserva o menor nonce livre."""
+        with self._lock:
+            if self._proximo is None:
+                self._proximo = self._obter_nonce_rede()
+            if self._lacunas:
+                nonce = heapq.heappop(self._lacunas)
+            else:
+                nonce = self._proximo
+                self._proximo += 1
+            self._reservados[nonce] = time.monotonic()
+            return nonce
+
+    def marcar_enviado(self, nonce: int):
+        """A transação com este nonce foi aceita pelo nó."""
+        with self._lock:
+            self._reservados.pop(nonce, None)
+
+    def liberar(self, nonce: int):
+        """Devolve um nonce que não chegou à rede, para ser reutilizado."""
+        with self._lock:
+            self._reservados.pop(nonce, None)
+            if self._proximo is not None and nonce < self._proximo and nonce not in self._lacunas:
+                heapq.heappush(self._lacunas, nonce)
+
+    def ressincronizar(self):
+        """
+        Realinha com a rede após 'nonce too low'/'replacement underpriced'
+        ou quando uma transação some da mempool. Nonces abaixo do valor da
+        rede são descartados; nonces entre a rede e o contador local que não
+        estão em construção (ou cuja reserva expirou) viram lacunas a preencher.
+        """
+        with self._lock:
+            limite = time.monotonic() - self.RESERVA_MAX_S
+            self._reservados = {n: t for n, t in self._reservados.items() if t >= limite}
+            nonce_rede = self._obter_nonce_rede()
+            if self._proximo is None or nonce_rede >= self._proximo:
+                self._proximo = nonce_rede
+                self._lacunas = []
+            else:
+                lacunas = {n for n in self._lacunas if n >= nonce_rede}
+                for nonce in range(nonce_rede, self._proximo):
+                    if nonce not in self._reservados:
+                        lacunas.add(nonce)
+                self._lacunas = sorted(lacunas)
+            self._reservados = {n: t for n, t in self._reservados.items() if n >= nonce_rede}
+            log.info("ℹ️ Nonce ressincronizado: rede=%s, próximo local=%s, lacunas=%s", nonce_rede, self._proximo, len(self._lacunas))
+
+def _nonce_pendente_da_rede() -> int:
+    return obter_w3().eth.get_transaction_count(Web3.to_checksum_address(WALLET_ADDRESS), "pending")
+
+gerenciador_nonce = GerenciadorNonce(_nonce_pendente_da_rede)
+
+# ===================================
+# ORÁCULO DE GAS (cache de taxas e limites)
+# ===================================
+
+# Validade das taxas em cache; a thread de atualização renova na metade do prazo
+GAS_TTL_S = float(os.getenv("GAS_TTL_S", "15"))
+
+# Usa campos EIP-1559 (maxFeePerGas/maxPriorityFeePerGas) quando a rede suporta
+GAS_USAR_EIP1559 = os.getenv("GAS_EIP1559", "true").lower() == "true"
+
+# Margem aplicada sobre a estimativa de gas memorizada
+GAS_MARGEM_LIMITE = float(os.getenv("GAS_MARGEM_LIMITE", "1.2"))
+
+GAS_LIMITE_PADRAO = 300000  # Usado quando a estimativa falha
+
+class OraculoGas:
+    """
+    Cache compartilhado de taxas de gas (com TTL e atualização em segundo
+    plano) e de limites de gas por função do contrato.
+
+    O gas das funções registrar* é estável e depende basicamente do tamanho
+    dos argumentos (strings), então o limite é memorizado por função e por
+    faixa de tamanho em palavras de 32 bytes da ABI.
+    """
+
+    def __init__(self, ttl_s: float = GAS_TTL_S, usar_eip1559: bool = GAS_USAR_EIP1559):
+        self.ttl_s = ttl_s
+        self.usar_eip1559 = usar_eip1559
+        self._lock = threading.Lock()
+        self._taxas: Optional[Dict] = None
+        self._taxas_em = 0.0
+        self._limites: Dict = {}
+        self._contadores = {
+            "taxas_hits": 0,
+            "taxas_misses": 0,
+            "limite_hits": 0,
+            "limite_misses": 0,
+        }
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Taxas ---
+
+    def _consultar_taxas(self) -> Dict:
+        w3 = obter_w3()
+        if self.usar_eip1559:
+            bloco = w3.eth.get_block("latest")
+            base_fee = bloco.get("baseFeePerGas")
+            if base_fee is not None:
+                prioridade = w3.eth.max_priority_fee
+                # 2x a base cobre várias altas seguidas enquanto o cache vale
+                return {
+                    "maxFeePerGas": 2 * base_fee + prioridade,
+                    "maxPriorityFeePerGas": prioridade,
+                }
+        return {"gasPrice": w3.eth.gas_price}
+
+    def atualizar_taxas(self) -> Dict:
+        taxas = self._consultar_taxas()
+        with self._lock:
+            self._taxas = taxas
+            self._taxas_em = time.monotonic()
+        return dict(taxas)
+
+    def taxas(self) -> Dict:
+        """Campos de taxa prontos para a transação."""
+        with self._lock:
+            if self._taxas is not None and time.monotonic() - self._taxas_em < self.ttl_s:
+                self._contadores["taxas_hits"] += 1
+                return dict(self._taxas)
+            self._contadores["taxas_misses"] += 1
+        return self.atualizar_taxas()
+
+    # --- Limites ---
+
+    @staticmethod
+    def _faixa_argumentos(args) -> int:
+        """Tamanho dos argumentos em palavras de 32 bytes (como na ABI)."""
+        total = 0
+        for arg in args:
+            if isinstance(arg, str):
+                total += (len(arg.encode("utf-8")) + 31) // 32
+        return total
+
+    def limite_gas(self, function_call, remetente: str) -> int:
+        chave = (function_call.fn_name, self._faixa_argumentos(function_call.args))
+        with self._lock:
+            limite = self._limites.get(chave)
+            if limite is not None:
+                self._contadores["limite_hits"] += 1
+                return limite
+            self._contadores["limite_misses"] += 1
+
+        try:
+            estimativa = function_call.estimate_gas({'from': remetente})
+        except Exception as e:
+            # Não memoriza: a falha pode ser específica desta chamada
+            log.warning("⚠️ Erro ao estimar gas: %s", e)
+            return GAS_LIMITE_PADRAO
+
+        limite = int(estimativa * GAS_MARGEM_LIMITE)
+        with self._lock:
+            self._limites[chave] = limite
+        return limite
+
+    # --- Atualização em segundo plano ---
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="oraculo-gas", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(5)
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                # RPC fora do ar: o MonitorConexao já avisa; renova quando voltar
+                if monitor_conexao.conectado:
+                    self.atualizar_taxas()
+            except Exception as e:
+                log.warning("⚠️ Erro ao atualizar taxas de gas: %s", e)
+            self._parar.wait(self.ttl_s / 2)
+
+    def estatisticas(self) -> Dict:
+        with self._lock:
+            return {
+                **self._contadores,
+                "limites_memorizados": len(self._limites),
+                "taxas": dict(self._taxas) if self._taxas else None,
+            }
+
+oraculo_gas = OraculoGas()
+
+metricas.Contador(
+    "blockchain_gas_cache_total",
+    "Consultas ao cache do oráculo de gas",
+    rotulos=("item", "resultado"),
+    funcao=lambda: {
+        ("taxas", "hit"): oraculo_gas._contadores["taxas_hits"],
+        ("taxas", "miss"): oraculo_gas._contadores["taxas_misses"],
+        ("limite", "hit"): oraculo_gas._contadores["limite_hits"],
+        ("limite", "miss"): oraculo_gas._contadores["limite_misses"],
+    },
+)
+
+# ===================================
+# TRANSAÇÕES
+# ===================================
+
 def build_transaction(function_call) -> dict:
     """
-    Constrói uma transação para enviar ao blockchain
+    Constrói uma transação para enviar ao blockchain.
+    Reserva um nonce local: quem constrói deve transmitir a transação
+    (transmitir_transacao) ou devolver o nonce (gerenciador_nonce.liberar).
     """
     # Garantir que WALLET_ADDRESS está em formato checksum
-    wallet_checksum = w3.to_checksum_address(WALLET_ADDRESS)
+    wallet_checksum = Web3.to_checksum_address(WALLET_ADDRESS)
     
-    nonce = w3.eth.get_transaction_count(wallet_checksum)
+    # Gas e taxas vêm do cache: com tudo preenchido, o web3 não faz
+    # nenhuma chamada RPC extra para completar a transação
+    gas_limite = oraculo_gas.limite_gas(function_call, wallet_checksum)
+    taxas = oraculo_gas.taxas()
+    nonce = gerenciador_nonce.reservar()
     
-    # Estimar gas
+    # Construir transação
     try:
-        gas_estimate = function_call.estimate_gas({'from': wallet_checksum})
-    except Exception as e:
-        print(f"⚠️ Erro ao estimar gas: {e}")
-        gas_estimate = 300000  # Valor padrão
+        transaction = function_call.build_transaction({
+            'from': wallet_checksum,
+            'nonce': nonce,
+            'gas': gas_limite,
+            'chainId': CHAIN_ID,
+            **taxas
+        })
+    except Exception:
+        gerenciador_nonce.liberar(nonce)
+        raise
     
-    # Construir transação
-    transaction = function_call.build_transaction({
+    return transaction
+
+def build_transaction_raiz_merkle(raiz: bytes) -> dict:
+    """
+    Constrói a transação de ancoragem em lote (modo merkle).
+    O contrato não tem função para raízes, então a raiz (32 bytes) vai no
+    campo data de uma transação de valor zero para a própria carteira:
+    ~21,5 mil de gas e verificável em qualquer explorador de blocos.
+    """
+    wallet_checksum = Web3.to_checksum_address(WALLET_ADDRESS)
+    
+    # Gas intrínseco: 21000 + 16 por byte não nulo e 4 por byte nulo
+    gas_limite = 21000 + sum(16 if byte else 4 for byte in raiz)
+    taxas = oraculo_gas.taxas()
+    nonce = gerenciador_nonce.reservar()
+    
+    return {
         'from': wallet_checksum,
+        'to': wallet_checksum,
+        'value': 0,
+        'data': Web3.to_hex(raiz),
         'nonce': nonce,
-        'gas': gas_estimate,
-        'gasPrice': w3.eth.gas_price,
-        'chainId': 11155111  # Sepolia chain ID
-    })
+        'gas': gas_limite,
+        'chainId': CHAIN_ID,
+        **taxas
+    }
+
+def assinar_transacao(transaction: dict):
+    """
+    Assina uma transação com a chave privada da carteira.
+    O hash já é conhecido antes do envio (signed.hash).
+    """
+    return obter_w3().eth.account.sign_transaction(transaction, PRIVATE_KEY)
+
+def transmitir_transacao(signed_txn, nonce: int) -> str:
+    """
+    Envia uma transação já assinada, sem aguardar confirmação.
+    Retorna o hash da transação em hexadecimal (0x...).
+    Em erro de nonce ressincroniza com a rede; nos demais devolve o nonce.
+    """
+    try:
+        # Tenta primeiro o atributo novo (v6+)
+        raw = signed_txn.raw_transaction
+    except AttributeError:
+        # Se não funcionar, tenta o atributo antigo (v5)
+        raw = signed_txn.rawTransaction
     
-    return transaction
+    try:
+        tx_hash = obter_w3().eth.send_raw_transaction(raw)
+    except Exception as e:
+        gerenciador_nonce.liberar(nonce)
+        if erro_de_nonce(e):
+            gerenciador_nonce.ressincronizar()
+        raise
+    
+    gerenciador_nonce.marcar_enviado(nonce)
+    return Web3.to_hex(tx_hash)
+
+def obter_recibo(tx_hash: str) -> Optional[Dict]:
+    """
+    Consulta o recibo de uma transação sem bloquear.
+    Retorna None se a transação ainda não foi minerada.
+    """
+    try:
+        return obter_w3().eth.get_transaction_receipt(tx_hash)
+    except TransactionNotFound:
+        return None
 
-def send_transaction(transaction: dict) -> Optional[str]:
+def send_transaction(transaction: dict, tentativas_nonce: int = 3) -> Optional[str]:
     """
     Assina e envia uma transação para o blockchain
     Retorna o hash da transação se bem-sucedido
     """
     try:
-        # Assinar transação
-        signed_txn = w3.eth.account.sign_transaction(transaction, PRIVATE_KEY)
-        
-        # Enviar transação
-        try:
-            # Tenta primeiro o atributo novo (v6+)
-            tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
-        except AttributeError:
-            # Se não funcionar, tenta o atributo antigo (v5)
-            tx_hash = w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+        for tentativa in range(tentativas_nonce):
+            signed_txn = assinar_transacao(transaction)
+            try:
+                tx_hash = transmitir_transacao(signed_txn, transaction['nonce'])
+                break
+            except Exception as e:
+                if not erro_de_nonce(e) or tentativa == tentativas_nonce - 1:
+                    raise
+                # Nonce já usado: reserva outro (após ressincronizar) e reassina
+                log.warning("⚠️ Conflito de nonce (%s); tentando novamente", e)
+                transaction = {**transaction, 'nonce': gerenciador_nonce.reservar()}
         
         # Aguardar confirmação
-        tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+        tx_receipt = obter_w3().eth.wait_for_transaction_receipt(tx_hash)
         
         if tx_receipt['status'] == 1:
-            print(f"✅ Transação bem-sucedida: {tx_hash.hex()}")
-            return tx_hash.hex()
+            log.info("✅ Transação bem-sucedida: %s", tx_hash, extra=logs.amostrado(tx_hash=tx_hash))
+            return tx_hash
         else:
-            print(f"❌ Transação falhou")
+            log.error("❌ Transação falhou", extra={"tx_hash": tx_hash})
             return None
             
     except Exception as e:
-        print(f"❌ Erro ao enviar transação: {e}")
+        log.error("❌ Erro ao enviar transação: %s", e)
         return None
 
 # ===================================
 # FUNÇÕES PRINCIPAIS
 # ===================================
 
+def preparar_lote_tora(
+    id_lote_custom: str,
+    coordenadas_lat: float,
+    coordenadas_lon: float,
+    numero_dof: str,
+    numero_licenca: str,
+    especie: str,
+    volume_m3: float
+):
+    """
+    Monta a chamada registrarLoteTora do contrato (sem enviar)
+    """
+    coordenadas_str = converter_coordenadas(coordenadas_lat, coordenadas_lon)
+    volume_int = converter_volume_para_blockchain(volume_m3)
+    
+    return obter_contrato().functions.registrarLoteTora(
+        id_lote_custom,
+        coordenadas_str,
+        numero_dof,
+        numero_licenca,
+        especie,
+        volume_int
+    )
+
+def preparar_lote_serrado(
+    id_lote_serrado_custom: str,
+    id_lote_tora_origem: str,
+    volume_saida_m3: float,
+    tipo_produto: str,
+    dimensoes: str
+):
+    """
+    Monta a chamada registrarLoteSerrado do contrato (sem enviar)
+    """
+    volume_int = converter_volume_para_blockchain(volume_saida_m3)
+    
+    return obter_contrato().functions.registrarLoteSerrado(
+        id_lote_serrado_custom,
+        id_lote_tora_origem,
+        volume_int,
+        tipo_produto or "",
+        dimensoes or ""
+    )
+
+def preparar_produto_acabado(
+    id_produto_custom: str,
+    id_lote_serrado_origem: str,
+    sku_produto: str,
+    nome_produto: str
+):
+    """
+    Monta a chamada registrarProdutoAcabado do contrato (sem enviar)
+    """
+    return obter_contrato().functions.registrarProdutoAcabado(
+        id_produto_custom,
+        id_lote_serrado_origem,
+        sku_produto,
+        nome_produto
+    )
+
+# Preparadores por tipo de lote (usados pela fila de ancoragem)
+PREPARADORES = {
+    "tora": preparar_lote_tora,
+    "serrado": preparar_lote_serrado,
+    "produto": preparar_produto_acabado,
+}
+
 def registrar_lote_tora_blockchain(
     id_lote_custom: str,
     coordenadas_lat: float,
@@ -180,23 +711,20 @@ def registrar_lote_tora_blockchain(
     Registra um lote de tora no blockchain
     Retorna o hash da transação se bem-sucedido
     """
+    contract = obter_contrato()
     if not contract:
-        print("⚠️ Contrato não configurado")
+        log.warning("⚠️ Contrato não configurado")
         return None
     
     try:
-        # Preparar dados
-        coordenadas_str = converter_coordenadas(coordenadas_lat, coordenadas_lon)
-        volume_int = converter_volume_para_blockchain(volume_m3)
-        
-        # Chamar função do contrato
-        function_call = contract.functions.registrarLoteTora(
+        function_call = preparar_lote_tora(
             id_lote_custom,
-            coordenadas_str,
+            coordenadas_lat,
+            coordenadas_lon,
             numero_dof,
             numero_licenca,
             especie,
-            volume_int
+            volume_m3
         )
         
         # Construir e enviar transação
@@ -206,7 +734,7 @@ def registrar_lote_tora_blockchain(
         return tx_hash
         
     except Exception as e:
-        print(f"❌ Erro ao registrar lote de tora: {e}")
+        log.error("❌ Erro ao registrar lote de tora: %s", e)
         return None
 
 def registrar_lote_serrado_blockchain(
@@ -219,19 +747,18 @@ def registrar_lote_serrado_blockchain(
     """
     Registra um lote serrado no blockchain
     """
+    contract = obter_contrato()
     if not contract:
-        print("⚠️ Contrato não configurado")
+        log.warning("⚠️ Contrato não configurado")
         return None
     
     try:
-        volume_int = converter_volume_para_blockchain(volume_saida_m3)
-        
-        function_call = contract.functions.registrarLoteSerrado(
+        function_call = preparar_lote_serrado(
             id_lote_serrado_custom,
             id_lote_tora_origem,
-            volume_int,
-            tipo_produto or "",
-            dimensoes or ""
+            volume_saida_m3,
+            tipo_produto,
+            dimensoes
         )
         
         transaction = build_transaction(function_call)
@@ -240,7 +767,7 @@ def registrar_lote_serrado_blockchain(
         return tx_hash
         
     except Exception as e:
-        print(f"❌ Erro ao registrar lote serrado: {e}")
+        log.error("❌ Erro ao registrar lote serrado: %s", e)
         return None
 
 def registrar_produto_acabado_blockchain(
@@ -252,12 +779,13 @@ def registrar_produto_acabado_blockchain(
     """
     Registra um produto acabado no blockchain
     """
+    contract = obter_contrato()
     if not contract:
-        print("⚠️ Contrato não configurado")
+        log.warning("⚠️ Contrato não configurado")
         return None
     
     try:
-        function_call = contract.functions.registrarProdutoAcabado(
+        function_call = preparar_produto_acabado(
             id_produto_custom,
             id_lote_serrado_origem,
             sku_produto,
@@ -270,15 +798,16 @@ def registrar_produto_acabado_blockchain(
         return tx_hash
         
     except Exception as e:
-        print(f"❌ Erro ao registrar produto acabado: {e}")
+        log.error("❌ Erro ao registrar produto acabado: %s", e)
         return None
 
 def obter_rastreabilidade_blockchain(id_produto: str) -> Optional[Dict]:
     """
     Obtém rastreabilidade completa de um produto do blockchain
     """
+    contract = obter_contrato()
     if not contract:
-        print("⚠️ Contrato não configurado")
+        log.warning("⚠️ Contrato não configurado")
         return None
     
     try:
@@ -318,7 +847,7 @@ def obter_rastreabilidade_blockchain(id_produto: str) -> Optional[Dict]:
         }
         
     except Exception as e:
-        print(f"❌ Erro ao obter rastreabilidade: {e}")
+        log.error("❌ Erro ao obter rastreabilidade: %s", e)
         return None
 
 def verificar_lote_existe(id_lote: str, tipo: str = "tora") -> bool:
@@ -326,6 +855,7 @@ def verificar_lote_existe(id_lote: str, tipo: str = "tora") -> bool:
     Verifica se um lote existe no blockchain
     tipo: 'tora', 'serrado', ou 'produto'
     """
+    contract = obter_contrato()
     if not contract:
         return False
     
@@ -339,5 +869,5 @@ def verificar_lote_existe(id_lote: str, tipo: str = "tora") -> bool:
         else:
             return False
     except Exception as e:
-        print(f"❌ Erro ao verificar existência: {e}")
+        log.error("❌ Erro ao verificar existência: %s", e)
         return False
\ No newline at end of file
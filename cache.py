@@ -0,0 +1,148 @@
+"""
+cache.py - Cache de leitura (LRU com TTL em memória ou Redis)
+
+Por padrão cada processo tem um LRU próprio. Com CACHE_REDIS_URL definida
+(e o pacote `redis` instalado) os workers passam a compartilhar o cache e
+as invalidações valem para todos. O backend Redis aceita qualquer cliente
+com get/set(ex=)/delete (e scan_iter/unlink para limpar()), então um
+dublê local serve para testes.
+
+Valores precisam ser serializáveis em JSON (o backend Redis guarda JSON).
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+import logs
+import metricas
+
+log = logs.obter_logger("cache")
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "")
+
+consultas_cache = metricas.Contador(
+    "cache_consultas_total",
+    "Consultas ao cache de leitura",
+    rotulos=("cache", "resultado"),
+)
+
+
+class CacheLRU:
+    """LRU em memória com TTL por entrada, seguro entre threads."""
+
+    def __init__(self, nome: str, max_itens: int = 10000, ttl_s: float = 300):
+        self.nome = nome
+        self.max_itens = max_itens
+        self.ttl_s = ttl_s
+        self._itens: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave: str) -> Optional[Any]:
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[1] > time.monotonic():
+                self._itens.move_to_end(chave)
+                consultas_cache.inc(cache=self.nome, resultado="hit")
+                return item[0]
+            if item is not None:
+                del self._itens[chave]  # expirado
+        consultas_cache.inc(cache=self.nome, resultado="miss")
+        return None
+
+    def set(self, chave: str, valor: Any, ttl_s: Optional[float] = None):
+        expira = time.monotonic() + (self.ttl_s if ttl_s is None else ttl_s)
+        with self._lock:
+            self._itens[chave] = (valor, expira)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def delete(self, *chaves: str):
+        with self._lock:
+            for chave in chaves:
+                self._itens.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+
+class CacheRedis:
+    """
+    Mesmo contrato do CacheLRU sobre um cliente Redis. Falhas do Redis viram
+    miss (com aviso): o cache nunca derruba a requisição.
+    """
+
+    def __init__(self, nome: str, cliente, ttl_s: float = 300, prefixo: Optional[str] = None):
+        self.nome = nome
+        self.cliente = cliente
+        self.ttl_s = ttl_s
+        self.prefixo = prefixo if prefixo is not None else f"rastreabilidade:{nome}:"
+
+    def get(self, chave: str) -> Optional[Any]:
+        try:
+            bruto = self.cliente.get(self.prefixo + chave)
+        except Exception as e:
+            log.warning("⚠️ Cache %s: erro ao ler do Redis: %s", self.nome, e)
+            bruto = None
+        if bruto is None:
+            consultas_cache.inc(cache=self.nome, resultado="miss")
+            return None
+        consultas_cache.inc(cache=self.nome, resultado="hit")
+        return json.loads(bruto)
+
+    def set(self, chave: str, valor: Any, ttl_s: Optional[float] = None):
+        ttl = self.ttl_s if ttl_s is None else ttl_s
+        try:
+            self.cliente.set(self.prefixo + chave, json.dumps(valor), ex=max(int(ttl), 1))
+        except Exception as e:
+            log.warning("⚠️ Cache %s: erro ao gravar no Redis: %s", self.nome, e)
+
+    def delete(self, *chaves: str):
+        if not chaves:
+            return
+        try:
+            self.cliente.delete(*(self.prefixo + chave for chave in chaves))
+        except Exception as e:
+            log.warning("⚠️ Cache %s: erro ao invalidar no Redis: %s", self.nome, e)
+
+    def limpar(self, lote: int = 500):
+        """Remove as chaves deste cache (SCAN pelo prefixo + UNLINK em lotes)."""
+        try:
+            chaves = []
+            for chave in self.cliente.scan_iter(match=self.prefixo + "*", count=lote):
+                chaves.append(chave)
+                if len(chaves) >= lote:
+                    self.cliente.unlink(*chaves)
+                    chaves = []
+            if chaves:
+                self.cliente.unlink(*chaves)
+        except Exception as e:
+            log.warning("⚠️ Cache %s: erro ao limpar no Redis: %s", self.nome, e)
+
+
+_cliente_redis = None
+
+def _obter_cliente_redis():
+    global _cliente_redis
+    if _cliente_redis is None:
+        _cliente_redis = redis.Redis.from_url(CACHE_REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _cliente_redis
+
+
+def criar_cache(nome: str, max_itens: int = 10000, ttl_s: float = 300):
+    """Redis se CACHE_REDIS_URL estiver configurada, senão LRU em memória."""
+    if CACHE_REDIS_URL:
+        if redis is not None:
+            return CacheRedis(nome, _obter_cliente_redis(), ttl_s=ttl_s)
+        log.warning("⚠️ CACHE_REDIS_URL definida mas o pacote 'redis' não está instalado; cache %s em memória", nome)
+    return CacheLRU(nome, max_itens=max_itens, ttl_s=ttl_s)
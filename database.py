@@ -1,9 +1,20 @@
 import os
-from sqlalchemy import create_engine
+import time
+import uuid
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, NullPool
 from dotenv import load_dotenv
 
+import logs
+import metricas
+import instrumentacao
+
+log = logs.obter_logger("database")
+
 # Carrega variáveis de ambiente (do .env local ou do Render)
 load_dotenv()
 
@@ -13,15 +24,167 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("Variável de ambiente DATABASE_URL não definida. Verifique seu .env ou as variáveis no Render.")
 
+# Caminho assíncrono (AsyncEngine + asyncpg). O síncrono continua disponível
+# com DB_ASYNC=false para comparar os dois lado a lado.
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+
+# --- Pool de conexões ---
+# Dimensione para que (workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW)) caiba no
+# max_connections do Postgres do Render.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))       # espera máxima por uma conexão (s)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))       # recicla conexões mais velhas que isso (s)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"  # descarta conexões mortas após ociosidade
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 = sem limite
+
+# Modo PgBouncer (pool_mode=transaction): o pool fica no PgBouncer, então a
+# aplicação usa NullPool, não depende de prepared statements nomeados e
+# aplica o statement_timeout por transação (SET LOCAL).
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+def url_assincrona(url: str):
+    """
+    Converte a DATABASE_URL síncrona para o driver assíncrono equivalente:
+    postgres(ql)[+psycopg2] -> postgresql+asyncpg, sqlite -> sqlite+aiosqlite.
+    """
+    url = make_url(url.replace("postgres://", "postgresql://", 1))
+    if url.get_backend_name() == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+        # asyncpg não entende 'sslmode' (usado pelo Render); o equivalente é 'ssl'
+        if "sslmode" in url.query:
+            url = url.update_query_dict({"ssl": url.query["sslmode"]})
+            url = url.difference_update_query(["sslmode"])
+        if DB_PGBOUNCER:
+            url = url.update_query_dict({"prepared_statement_cache_size": "0"})
+    elif url.get_backend_name() == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url
+
+# ===================================
+# MÉTRICAS DO POOL
+# ===================================
+
+latencia_checkout = metricas.Histograma(
+    "db_pool_checkout_segundos",
+    "Tempo de espera para obter uma conexão do pool",
+    rotulos=("engine",),
+)
+timeouts_checkout = metricas.Contador(
+    "db_pool_checkout_timeouts_total",
+    "Checkouts que estouraram DB_POOL_TIMEOUT (pool esgotado)",
+    rotulos=("engine",),
+)
+
+class _PoolMedido:
+    """Mede o tempo de checkout (inclui a espera quando o pool está cheio)."""
+    nome_engine = "sync"
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timeouts_checkout.inc(engine=self.nome_engine)
+            raise
+        finally:
+            latencia_checkout.observar(time.perf_counter() - inicio, engine=self.nome_engine)
+
+class PoolMedido(_PoolMedido, QueuePool):
+    nome_engine = "sync"
+
+class PoolAsyncMedido(_PoolMedido, AsyncAdaptedQueuePool):
+    nome_engine = "async"
+
+def _estado_pools() -> dict:
+    """Estado atual de cada pool: {(engine, medida): valor}."""
+    estado = {}
+    for nome, eng in (("sync", engine), ("async", async_engine)):
+        pool = eng.pool if eng is not None else None
+        if pool is None or not hasattr(pool, "checkedout"):
+            continue  # NullPool (PgBouncer) não mantém conexões
+        capacidade = pool.size() + max(pool._max_overflow, 0)
+        estado[(nome, "tamanho")] = pool.size()
+        estado[(nome, "em_uso")] = pool.checkedout()
+        estado[(nome, "ociosas")] = pool.checkedin()
+        estado[(nome, "overflow")] = max(pool.overflow(), 0)
+        estado[(nome, "saturacao")] = pool.checkedout() / capacidade if capacidade else 0
+    return estado
+
+metricas.Medidor(
+    "db_pool_conexoes",
+    "Estado do pool de conexões (saturacao = em_uso / (tamanho + max_overflow))",
+    rotulos=("engine", "medida"),
+    funcao=_estado_pools,
+)
+
+# ===================================
+# CONFIGURAÇÃO DAS ENGINES
+# ===================================
+
+def opcoes_engine(url, assincrono: bool = False) -> dict:
+    """Parâmetros de pool/conexão para create_engine/create_async_engine."""
+    url = make_url(url) if isinstance(url, str) else url
+    postgres = url.get_backend_name() == "postgresql"
+    opcoes = {"connect_args": {}}
+
+    if DB_PGBOUNCER:
+        opcoes["poolclass"] = NullPool
+        if postgres and assincrono:
+            # Nomes únicos evitam colisão de prepared statements entre clientes do PgBouncer
+            opcoes["connect_args"]["statement_cache_size"] = 0
+            opcoes["connect_args"]["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+        return opcoes
+
+    opcoes.update(
+        poolclass=PoolAsyncMedido if assincrono else PoolMedido,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    if postgres and DB_STATEMENT_TIMEOUT_MS > 0:
+        if assincrono:
+            opcoes["connect_args"]["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        else:
+            opcoes["connect_args"]["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return opcoes
+
+def _aplicar_statement_timeout_por_transacao(eng):
+    """
+    No PgBouncer em modo transaction, parâmetros de sessão não são confiáveis
+    (a conexão do servidor muda a cada transação); usamos SET LOCAL.
+    """
+    if not (DB_PGBOUNCER and DB_STATEMENT_TIMEOUT_MS > 0 and eng.dialect.name == "postgresql"):
+        return
+
+    @event.listens_for(eng, "begin")
+    def _definir_timeout(conn):
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+
+async_engine = None
+AsyncSessionLocal = None
+
 try:
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(DATABASE_URL, **opcoes_engine(DATABASE_URL))
+    _aplicar_statement_timeout_por_transacao(engine)
+    instrumentacao.instrumentar_engine(engine, "sync")
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    
+
+    if DB_ASYNC:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        url_async = url_assincrona(DATABASE_URL)
+        async_engine = create_async_engine(url_async, **opcoes_engine(url_async, assincrono=True))
+        _aplicar_statement_timeout_por_transacao(async_engine.sync_engine)
+        instrumentacao.instrumentar_engine(async_engine.sync_engine, "async")
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
     Base = declarative_base()
-    
-    print("Conexão com o banco de dados configurada com sucesso.")
+
+    log.info("Conexão com o banco de dados configurada com sucesso.")
 except Exception as e:
-    print(f"ERRO AO CONFIGURAR O BANCO DE DADOS: {e}")
+    log.error("ERRO AO CONFIGURAR O BANCO DE DADOS: %s", e)
     # Se falhar aqui, a aplicação vai quebrar, o que é bom para debug.
 
 # Helper para obter uma sessão do banco em cada requisição
@@ -30,4 +193,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Versão assíncrona do get_db (usada por rotas_async.py)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,177 @@
+"""
+exportacao.py - Exportação completa dos lotes (NDJSON ou CSV) em streaming
+
+Pensado para auditoria: percorre a tabela inteira com um cursor do lado do
+servidor (yield_per) e vai enviando as linhas à medida que chegam, com a
+origem de cada lote já resolvida por JOIN. A memória usada não depende do
+tamanho da tabela, e o cabeçalho/primeiras linhas saem imediatamente.
+
+O gerador abre a própria sessão: a resposta continua sendo enviada depois
+que a rota retorna, quando a sessão da dependência get_db já foi fechada.
+"""
+
+import io
+import csv
+import json
+import zlib
+import datetime
+from decimal import Decimal
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+
+import models
+import schemas
+from database import SessionLocal
+
+# Linhas buscadas por ida ao banco e enviadas por pedaço da resposta
+LINHAS_POR_LOTE = 1000
+
+FORMATOS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _consulta_tora():
+    T = models.LoteTora
+    return select(
+        T.id, T.id_lote_custom, T.id_tecnico_campo, T.data_hora_registro,
+        T.coordenadas_gps_lat, T.coordenadas_gps_lon, T.numero_dof,
+        T.numero_licenca_ambiental, T.especie_madeira_popular,
+        T.especie_madeira_cientifico, T.volume_estimado_m3,
+        T.status_ancoragem, T.tx_hash, T.bloco_ancoragem,
+    ), T.data_hora_registro, T.id
+
+
+def _consulta_serrado():
+    S, T = models.LoteSerrado, models.LoteTora
+    return select(
+        S.id, S.id_lote_serrado_custom, S.id_equipe_serraria,
+        S.data_recebimento_tora, S.data_processamento, S.volume_saida_m3,
+        S.tipo_produto, S.dimensoes, S.dados_tratamento,
+        T.id_lote_custom.label("id_lote_tora_origem"),
+        T.numero_dof, T.especie_madeira_popular, T.especie_madeira_cientifico,
+        S.status_ancoragem, S.tx_hash, S.bloco_ancoragem,
+    ).join(T, T.id == S.id_lote_tora_origem), S.data_processamento, S.id
+
+
+def _consulta_produto():
+    P, S, T = models.LoteProdutoAcabado, models.LoteSerrado, models.LoteTora
+    return select(
+        P.id, P.id_lote_produto_custom, P.id_equipe_fabrica, P.sku_produto,
+        P.nome_produto, P.data_fabricacao, P.dados_acabamento, P.link_qr_code,
+        S.id_lote_serrado_custom.label("id_lote_serrado_origem"),
+        T.id_lote_custom.label("id_lote_tora_origem"),
+        T.numero_dof, T.especie_madeira_popular, T.especie_madeira_cientifico,
+        P.status_ancoragem, P.tx_hash, P.bloco_ancoragem,
+    ).join(S, S.id == P.id_lote_serrado_origem).join(T, T.id == S.id_lote_tora_origem), P.data_fabricacao, P.id
+
+
+# tipo -> (construtor da consulta, coluna do responsável)
+TIPOS = {
+    "lotes_tora": (_consulta_tora, models.LoteTora.id_tecnico_campo),
+    "lotes_serrada": (_consulta_serrado, models.LoteSerrado.id_equipe_serraria),
+    "produtos_acabados": (_consulta_produto, models.LoteProdutoAcabado.id_equipe_fabrica),
+}
+
+
+def responsavel_obrigatorio(tipo: str, papel: str, id_usuario: int) -> Optional[int]:
+    """
+    Mesmas regras das listagens: técnicos exportam só as próprias toras,
+    a serraria só os próprios lotes serrados (a fábrica vê todos) e a
+    fábrica só os próprios produtos. Retorna o responsável a impor (ou None
+    para todos) e levanta PermissionError se o papel não tem acesso.
+    """
+    if tipo == "lotes_tora":
+        return id_usuario if papel == "tecnico" else None
+    if tipo == "lotes_serrada":
+        if papel == "serraria":
+            return id_usuario
+        if papel == "fabrica":
+            return None
+    if tipo == "produtos_acabados" and papel == "fabrica":
+        return id_usuario
+    raise PermissionError(tipo)
+
+
+def montar_consulta(tipo: str, filtros: schemas.FiltrosLista, responsavel: Optional[int] = None):
+    """SELECT do tipo pedido, com filtros de período/espécie/DOF/responsável/ancoragem."""
+    construtor, coluna_responsavel = TIPOS[tipo]
+    consulta, coluna_data, coluna_id = construtor()
+
+    responsavel = responsavel if responsavel is not None else filtros.responsavel
+    if responsavel is not None:
+        consulta = consulta.where(coluna_responsavel == responsavel)
+    if filtros.data_inicio is not None:
+        consulta = consulta.where(coluna_data >= filtros.data_inicio)
+    if filtros.data_fim is not None:
+        consulta = consulta.where(coluna_data <= filtros.data_fim)
+    if filtros.especie:
+        consulta = consulta.where(
+            (models.LoteTora.especie_madeira_popular == filtros.especie)
+            | (models.LoteTora.especie_madeira_cientifico == filtros.especie)
+        )
+    if filtros.numero_dof:
+        consulta = consulta.where(models.LoteTora.numero_dof == filtros.numero_dof)
+    if filtros.status_ancoragem:
+        consulta = consulta.where(coluna_responsavel.class_.status_ancoragem == filtros.status_ancoragem)
+
+    return consulta.order_by(coluna_id)
+
+
+def _valor(valor):
+    if isinstance(valor, (datetime.datetime, datetime.date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)  # mantém a precisão exata do banco
+    return valor
+
+
+def _linhas_ndjson(colunas, lote) -> str:
+    return "".join(
+        json.dumps({c: _valor(v) for c, v in zip(colunas, linha)}, ensure_ascii=False) + "\n"
+        for linha in lote
+    )
+
+
+def _linhas_csv(lote, cabecalho=None) -> str:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if cabecalho:
+        escritor.writerow(cabecalho)
+    escritor.writerows([_valor(v) for v in linha] for linha in lote)
+    return buffer.getvalue()
+
+
+def gerar_exportacao(consulta, formato: str, compactar: bool = False) -> Iterator[bytes]:
+    """
+    Gera a resposta em pedaços de até LINHAS_POR_LOTE linhas. Com
+    compactar=True, a saída é um único stream gzip (com flush a cada pedaço,
+    para o cliente receber dados desde o início).
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compactar else None
+
+    def _saida(texto: str) -> bytes:
+        dados = texto.encode("utf-8")
+        if compressor is None:
+            return dados
+        return compressor.compress(dados) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    db = SessionLocal()
+    try:
+        resultado = db.execute(consulta.execution_options(yield_per=LINHAS_POR_LOTE))
+        colunas = list(resultado.keys())
+
+        if formato == "csv":
+            yield _saida(_linhas_csv([], cabecalho=colunas))
+        for lote in resultado.partitions():
+            if formato == "csv":
+                yield _saida(_linhas_csv(lote))
+            else:
+                yield _saida(_linhas_ndjson(colunas, lote))
+
+        if compressor is not None:
+            yield compressor.flush()
+    finally:
+        db.close()
@@ -0,0 +1,81 @@
+"""
+identificadores.py - Geração dos IDs customizados dos lotes
+
+Formato: PREFIXO-YYYYMMDD-NNN (ex.: TORA-20240115-001). O número vem da
+tabela contadores_lote, incrementada com um único upsert atômico
+(INSERT ... ON CONFLICT DO UPDATE ... RETURNING): uma ida ao banco, sem
+varrer os lotes do dia e sem duas requisições receberem o mesmo número.
+
+A linha do contador fica travada até o fim da transação que alocou o
+número; se ela sofrer rollback, o número volta a ficar livre.
+Bancos sem esse upsert usam SELECT ... FOR UPDATE + UPDATE na mesma
+transação (duas idas ao banco, mesma garantia).
+Acima de 999 o número simplesmente ganha mais dígitos (TORA-...-1000).
+"""
+
+import datetime
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+
+PREFIXO_TORA = "TORA"
+PREFIXO_SERRADO = "SERR"
+PREFIXO_PRODUTO = "PROD"
+
+_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,  # ON CONFLICT/RETURNING: SQLite >= 3.35
+}
+
+
+def formatar_id(prefixo: str, dia: str, numero: int) -> str:
+    return f"{prefixo}-{dia}-{numero:03d}"
+
+
+def alocar_ids(db: Session, prefixo: str, quantidade: int = 1, dia: Optional[str] = None) -> List[str]:
+    """
+    Reserva `quantidade` números consecutivos para o prefixo no dia (hoje,
+    por padrão) e retorna os IDs formatados.
+    """
+    if quantidade < 1:
+        raise ValueError("quantidade deve ser >= 1")
+    dia = dia or datetime.date.today().strftime("%Y%m%d")
+
+    tabela = models.ContadorLote.__table__
+    insert = _INSERTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        ultimo = _incrementar_com_trava(db, tabela, prefixo, dia, quantidade)
+        return [formatar_id(prefixo, dia, numero) for numero in range(ultimo - quantidade + 1, ultimo + 1)]
+
+    comando = insert(tabela).values(prefixo=prefixo, dia=dia, ultimo=quantidade)
+    comando = comando.on_conflict_do_update(
+        index_elements=[tabela.c.prefixo, tabela.c.dia],
+        set_={"ultimo": tabela.c.ultimo + comando.excluded.ultimo},
+    ).returning(tabela.c.ultimo)
+
+    ultimo = db.execute(comando).scalar_one()
+    return [formatar_id(prefixo, dia, numero) for numero in range(ultimo - quantidade + 1, ultimo + 1)]
+
+
+def _incrementar_com_trava(db: Session, tabela, prefixo: str, dia: str, quantidade: int) -> int:
+    """Caminho sem upsert: trava a linha do contador, incrementa e retorna o novo último número."""
+    filtro = (tabela.c.prefixo == prefixo, tabela.c.dia == dia)
+    atual = db.execute(select(tabela.c.ultimo).where(*filtro).with_for_update()).scalar_one_or_none()
+    if atual is None:
+        try:
+            with db.begin_nested():
+                db.execute(tabela.insert().values(prefixo=prefixo, dia=dia, ultimo=quantidade))
+            return quantidade
+        except IntegrityError:
+            # Outra transação criou o contador do dia ao mesmo tempo
+            atual = db.execute(select(tabela.c.ultimo).where(*filtro).with_for_update()).scalar_one()
+    db.execute(tabela.update().where(*filtro).values(ultimo=atual + quantidade))
+    return atual + quantidade
+
+
+def alocar_id(db: Session, prefixo: str) -> str:
+    return alocar_ids(db, prefixo, 1)[0]
@@ -0,0 +1,366 @@
+"""
+indexador.py - Espelho local dos eventos de registro do contrato
+
+Segue os logs LoteToraRegistrado, LoteSerradoRegistrado e
+ProdutoAcabadoRegistrado em janelas de blocos e grava cada evento em
+eventos_blockchain. Com isso, verificar se um lote está registrado na
+blockchain vira uma consulta indexada ao banco, sem eth_call no Infura.
+
+- Só indexa blocos com INDEXADOR_CONFIRMACOES confirmações.
+- O último bloco indexado (e o hash dele) fica em checkpoints_indexador,
+  na mesma transação dos eventos: um restart apenas retoma.
+- Reorganização: se o hash do bloco do checkpoint mudou, os eventos dos
+  últimos INDEXADOR_RECUO_REORG blocos são apagados e reindexados (recuando
+  mais enquanto o último evento mantido também estiver fora da cadeia).
+- Vários workers podem rodar o indexador: o checkpoint é travado com
+  FOR UPDATE SKIP LOCKED e só um avança por vez.
+
+O ID do lote é um 'indexed string', então o log traz apenas keccak(id);
+as buscas usam esse hash (hash_id_lote). Quando a transação é nossa, o ID
+legível vem da fila_ancoragem.
+
+Também pode rodar fora da API:  python indexador.py
+"""
+
+import os
+import threading
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from web3 import Web3
+
+import logs
+import models
+import metricas
+from database import SessionLocal
+
+log = logs.obter_logger("indexador")
+
+# ===================================
+# CONFIGURAÇÃO
+# ===================================
+
+# Liga/desliga o indexador dentro do processo da API
+INDEXADOR_ATIVO = os.getenv("INDEXADOR_ATIVO", "false").lower() == "true"
+
+# Bloco do deploy do contrato (nada antes dele precisa ser lido)
+BLOCO_INICIAL = int(os.getenv("INDEXADOR_BLOCO_INICIAL", "0"))
+
+# Blocos de distância do topo da cadeia antes de indexar
+CONFIRMACOES = int(os.getenv("INDEXADOR_CONFIRMACOES", "12"))
+
+# Tamanho máximo da janela do eth_getLogs (reduzido automaticamente se o provedor recusar)
+BLOCOS_POR_CONSULTA = int(os.getenv("INDEXADOR_BLOCOS_POR_CONSULTA", "2000"))
+
+# Quantos blocos desfazer ao detectar uma reorganização
+RECUO_REORG = int(os.getenv("INDEXADOR_RECUO_REORG", "64"))
+
+# Intervalo entre varreduras quando já está em dia com a cadeia (segundos)
+INTERVALO_S = float(os.getenv("INDEXADOR_INTERVALO_S", "15"))
+
+NOME_CHECKPOINT = "contrato"
+
+# Evento -> tipo de lote
+EVENTOS = {
+    "LoteToraRegistrado": "tora",
+    "LoteSerradoRegistrado": "serrado",
+    "ProdutoAcabadoRegistrado": "produto",
+}
+
+# ===================================
+# MÉTRICAS
+# ===================================
+
+bloco_indexado = metricas.Medidor(
+    "indexador_ultimo_bloco",
+    "Último bloco indexado pelo indexador de eventos",
+)
+eventos_indexados = metricas.Contador(
+    "indexador_eventos_total",
+    "Eventos do contrato gravados em eventos_blockchain",
+    rotulos=("tipo",),
+)
+reorgs_detectadas = metricas.Contador(
+    "indexador_reorgs_total",
+    "Reorganizações de cadeia detectadas pelo indexador",
+)
+
+# ===================================
+# CONSULTAS (usadas pelos endpoints e pela ancoragem)
+# ===================================
+
+def hash_id_lote(id_lote_custom: str) -> str:
+    """keccak do ID, como aparece no tópico do evento (0x...)."""
+    return "0x" + bytes(Web3.keccak(text=id_lote_custom)).hex()
+
+
+def evento_do_lote(db: Session, id_lote_custom: str, tipo_lote: str) -> Optional[models.EventoBlockchain]:
+    """Primeiro registro do lote na blockchain, segundo o índice local."""
+    return db.query(models.EventoBlockchain).filter(
+        models.EventoBlockchain.tipo_lote == tipo_lote,
+        models.EventoBlockchain.id_lote_hash == hash_id_lote(id_lote_custom),
+    ).order_by(models.EventoBlockchain.bloco).first()
+
+
+def bloco_do_checkpoint(db: Session) -> Optional[int]:
+    """Até que bloco o índice está completo (None se nunca rodou)."""
+    checkpoint = db.get(models.CheckpointIndexador, NOME_CHECKPOINT)
+    return checkpoint.ultimo_bloco if checkpoint else None
+
+
+def lote_existe(db: Session, id_lote_custom: str, tipo_lote: str, consultar_rede: bool = True) -> bool:
+    """
+    Verifica o registro do lote pelo índice local. Se não estiver lá (o
+    índice só cobre blocos confirmados), consulta o contrato quando
+    consultar_rede=True.
+    """
+    if evento_do_lote(db, id_lote_custom, tipo_lote) is not None:
+        return True
+    if not consultar_rede:
+        return False
+    import blockchain
+    return blockchain.verificar_lote_existe(id_lote_custom, tipo_lote)
+
+# ===================================
+# INDEXADOR (background)
+# ===================================
+
+class IndexadorEventos:
+    """
+    Acompanha os eventos do contrato numa thread própria.
+    w3/contrato podem ser passados (ex.: cadeia local de testes); por
+    padrão usa os do módulo blockchain.
+    """
+
+    def __init__(self, session_factory=SessionLocal, w3=None, contrato=None,
+                 intervalo_s: float = INTERVALO_S, confirmacoes: int = CONFIRMACOES,
+                 bloco_inicial: int = BLOCO_INICIAL):
+        self.session_factory = session_factory
+        self.intervalo_s = intervalo_s
+        self.confirmacoes = confirmacoes
+        self.bloco_inicial = bloco_inicial
+        self.blocos_por_consulta = BLOCOS_POR_CONSULTA
+        self._w3 = w3
+        self._contrato = contrato
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Ciclo de vida ---
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="indexador-eventos", daemon=True)
+        self._thread.start()
+        log.info("✅ Indexador de eventos iniciado")
+
+    def parar(self, timeout: float = 10):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout)
+        log.info("ℹ️ Indexador de eventos parado")
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                avancou = self.processar_uma_vez()
+            except Exception as e:
+                log.exception("❌ Erro no indexador de eventos: %s", e)
+                avancou = 0
+            # Atrasado: continua lendo; em dia com a cadeia: espera
+            if avancou == 0:
+                self._parar.wait(self.intervalo_s)
+
+    # --- Acesso à cadeia ---
+
+    def _cadeia(self):
+        if self._w3 is not None and self._contrato is not None:
+            return self._w3, self._contrato
+        import blockchain
+        if not blockchain.disponivel():
+            return None, None
+        return blockchain.obter_w3(), blockchain.obter_contrato()
+
+    def _topicos(self, contrato) -> dict:
+        """topic0 (0x...) -> nome do evento."""
+        return {getattr(contrato.events, nome).topic.lower(): nome for nome in EVENTOS}
+
+    @staticmethod
+    def _hex(valor) -> str:
+        return "0x" + bytes(valor).hex()
+
+    def _hash_bloco(self, w3, numero: int) -> Optional[str]:
+        if numero < 0:
+            return None
+        return self._hex(w3.eth.get_block(numero)["hash"])
+
+    # --- Varredura ---
+
+    def processar_uma_vez(self) -> int:
+        """
+        Lê a próxima janela de blocos confirmados e grava os eventos.
+        Retorna quantos blocos avançou (0 = em dia, ocupado ou reorg).
+        """
+        w3, contrato = self._cadeia()
+        if w3 is None or contrato is None:
+            return 0
+
+        db = self.session_factory()
+        try:
+            checkpoint = self._travar_checkpoint(db)
+            if checkpoint is None:
+                return 0  # outro worker está indexando
+
+            if checkpoint.hash_ultimo_bloco and \
+                    self._hash_bloco(w3, checkpoint.ultimo_bloco) != checkpoint.hash_ultimo_bloco:
+                self._desfazer_reorg(db, w3, checkpoint)
+                db.commit()
+                return 0
+
+            topo = w3.eth.block_number - self.confirmacoes
+            inicio = checkpoint.ultimo_bloco + 1
+            if inicio > topo:
+                db.rollback()
+                return 0
+            fim = min(inicio + self.blocos_por_consulta - 1, topo)
+
+            registros_rpc, fim = self._buscar_logs(w3, contrato, inicio, fim)
+            eventos = [self._decodificar(contrato, registro) for registro in registros_rpc]
+            self._resolver_ids(db, eventos)
+            db.add_all(eventos)
+
+            checkpoint.ultimo_bloco = fim
+            checkpoint.hash_ultimo_bloco = self._hash_bloco(w3, fim)
+            db.commit()
+
+            for evento in eventos:
+                eventos_indexados.inc(tipo=evento.tipo_lote)
+            bloco_indexado.set(fim)
+            if eventos:
+                log.info("✅ Indexador: %s eventos nos blocos %s-%s", len(eventos), inicio, fim, extra=logs.amostrado())
+            return fim - inicio + 1
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _travar_checkpoint(self, db: Session) -> Optional[models.CheckpointIndexador]:
+        checkpoint = db.query(models.CheckpointIndexador).filter(
+            models.CheckpointIndexador.nome == NOME_CHECKPOINT
+        ).with_for_update(skip_locked=True).first()
+        if checkpoint is not None:
+            return checkpoint
+        if db.get(models.CheckpointIndexador, NOME_CHECKPOINT) is not None:
+            return None  # existe, mas está travado por outro worker
+        checkpoint = models.CheckpointIndexador(nome=NOME_CHECKPOINT, ultimo_bloco=self.bloco_inicial - 1)
+        db.add(checkpoint)
+        try:
+            db.flush()
+        except IntegrityError:
+            db.rollback()  # outro worker criou ao mesmo tempo
+            return None
+        return checkpoint
+
+    def _buscar_logs(self, w3, contrato, inicio: int, fim: int):
+        """
+        eth_getLogs da janela. Se o provedor recusar (limite de resultados
+        ou de intervalo), divide a janela ao meio até caber.
+        Retorna (registros do eth_getLogs, último bloco efetivamente lido).
+        """
+        filtro_topicos = [list(self._topicos(contrato))]
+        while True:
+            try:
+                registros_rpc = w3.eth.get_logs({
+                    "fromBlock": inicio,
+                    "toBlock": fim,
+                    "address": contrato.address,
+                    "topics": filtro_topicos,
+                })
+                break
+            except Exception as e:
+                if fim == inicio:
+                    raise
+                fim = inicio + (fim - inicio) // 2
+                self.blocos_por_consulta = fim - inicio + 1
+                log.warning("⚠️ Indexador: eth_getLogs recusado (%s); janela reduzida para %s blocos", e, self.blocos_por_consulta)
+
+        # Janela funcionou: volta a crescer aos poucos até o configurado
+        if self.blocos_por_consulta < BLOCOS_POR_CONSULTA:
+            self.blocos_por_consulta = min(self.blocos_por_consulta * 2, BLOCOS_POR_CONSULTA)
+        return registros_rpc, fim
+
+    def _decodificar(self, contrato, registro) -> models.EventoBlockchain:
+        nome = self._topicos(contrato)[self._hex(registro["topics"][0])]
+        args = getattr(contrato.events, nome)().process_log(registro)["args"]
+        tipo_lote = EVENTOS[nome]
+
+        if tipo_lote == "tora":
+            id_hash, origem, volume, responsavel = args["idLoteCustom"], None, args["volumeM3"], args["tecnicoResponsavel"]
+        elif tipo_lote == "serrado":
+            id_hash, origem, volume, responsavel = args["idLoteSerradoCustom"], args["idLoteToraOrigem"], args["volumeSaidaM3"], args["serrariaResponsavel"]
+        else:
+            id_hash, origem, volume, responsavel = args["idProdutoCustom"], args["idLoteSerradoOrigem"], None, args["fabricaResponsavel"]
+
+        return models.EventoBlockchain(
+            tipo_lote=tipo_lote,
+            id_lote_hash=self._hex(id_hash),
+            id_lote_origem=origem,
+            volume_m3=Decimal(volume) / 100 if volume is not None else None,  # volume vai x100 para a blockchain
+            responsavel=responsavel,
+            timestamp_bloco=args["timestamp"],
+            bloco=registro["blockNumber"],
+            hash_bloco=self._hex(registro["blockHash"]),
+            tx_hash=self._hex(registro["transactionHash"]),
+            indice_log=registro["logIndex"],
+        )
+
+    @staticmethod
+    def _resolver_ids(db: Session, eventos: list):
+        """Preenche o ID legível dos eventos enviados pela nossa fila (uma consulta)."""
+        if not eventos:
+            return
+        itens = db.query(
+            models.FilaAncoragem.tx_hash, models.FilaAncoragem.tipo_lote, models.FilaAncoragem.id_lote_custom
+        ).filter(models.FilaAncoragem.tx_hash.in_({evento.tx_hash for evento in eventos})).all()
+        por_tx = {(item.tx_hash, item.tipo_lote): item.id_lote_custom for item in itens}
+        for evento in eventos:
+            id_lote_custom = por_tx.get((evento.tx_hash, evento.tipo_lote))
+            if id_lote_custom and hash_id_lote(id_lote_custom) == evento.id_lote_hash:
+                evento.id_lote_custom = id_lote_custom
+
+    def _desfazer_reorg(self, db: Session, w3, checkpoint: models.CheckpointIndexador):
+        """
+        Volta o checkpoint RECUO_REORG blocos (e mais, enquanto o último
+        evento mantido estiver num bloco que saiu da cadeia) e apaga os
+        eventos acima dele; a próxima varredura reindexa.
+        """
+        reorgs_detectadas.inc()
+        novo = checkpoint.ultimo_bloco - RECUO_REORG
+        while True:
+            novo = max(novo, self.bloco_inicial - 1)
+            ultimo = db.query(models.EventoBlockchain).filter(
+                models.EventoBlockchain.bloco <= novo
+            ).order_by(models.EventoBlockchain.bloco.desc()).first()
+            if ultimo is None or self._hash_bloco(w3, ultimo.bloco) == ultimo.hash_bloco:
+                break
+            novo = ultimo.bloco - RECUO_REORG
+
+        db.query(models.EventoBlockchain).filter(
+            models.EventoBlockchain.bloco > novo
+        ).delete(synchronize_session=False)
+        log.warning("⚠️ Indexador: reorganização detectada no bloco %s; reindexando a partir de %s", checkpoint.ultimo_bloco, novo + 1)
+        checkpoint.ultimo_bloco = novo
+        checkpoint.hash_ultimo_bloco = self._hash_bloco(w3, novo)
+
+
+if __name__ == "__main__":
+    # Execução dedicada: python indexador.py
+    indexador = IndexadorEventos()
+    try:
+        indexador._executar()
+    except KeyboardInterrupt:
+        pass
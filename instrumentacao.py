@@ -0,0 +1,379 @@
+"""
+instrumentacao.py - Onde cada requisição gasta o seu tempo
+
+- Middleware ASGI que mede a latência por rota (o template do caminho,
+  ex. /lotes_tora/{lote_id}, nunca o caminho com IDs) e, para a mesma
+  requisição, quantas consultas SQL e chamadas RPC foram feitas e quanto
+  tempo levaram. Tudo vai para o /metrics e para o cabeçalho Server-Timing
+  da resposta (o DevTools do navegador já mostra a divisão db/rpc/app).
+- Consultas SQL medidas pelos eventos before/after_cursor_execute das
+  engines (sync e async); chamadas RPC por um middleware do web3.
+- A requisição atual fica numa ContextVar: o FastAPI copia o contexto para
+  o threadpool das rotas síncronas e o SQLAlchemy para o greenlet do
+  caminho assíncrono. Trabalho fora de requisição (despachante, indexador)
+  entra só nas métricas globais.
+- Requisições acima de REQUISICAO_LENTA_MS geram um aviso no log com a
+  divisão do tempo.
+- Opcional (PERFIL_ATIVO=true): um amostrador de pilhas roda enquanto há
+  requisições em andamento e, para as lentas, grava um perfil em formato
+  "folded" (uma pilha por linha + contagem) em PERFIL_DIRETORIO, pronto
+  para flamegraph.pl ou speedscope. Com requisições concorrentes o perfil
+  é aproximado: inclui as threads por onde a requisição passou, que podem
+  ter atendido outras no mesmo período.
+"""
+
+import os
+import re
+import sys
+import time
+import datetime
+import threading
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from web3.middleware import Web3Middleware
+
+import logs
+import metricas
+
+log = logs.obter_logger("instrumentacao")
+
+# ===================================
+# CONFIGURAÇÃO
+# ===================================
+
+REQUISICAO_LENTA_MS = float(os.getenv("REQUISICAO_LENTA_MS", "1000"))
+
+PERFIL_ATIVO = os.getenv("PERFIL_ATIVO", "false").lower() == "true"
+PERFIL_INTERVALO_MS = float(os.getenv("PERFIL_INTERVALO_MS", "5"))
+PERFIL_DIRETORIO = os.getenv("PERFIL_DIRETORIO", "perfis")
+
+# Limite de amostras guardadas por requisição (protege a memória em requisições muito longas)
+PERFIL_MAX_AMOSTRAS = 20000
+
+# Baldes para contagem de consultas/chamadas por requisição
+BALDES_CONTAGEM = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# ===================================
+# MÉTRICAS
+# ===================================
+
+latencia_http = metricas.Histograma(
+    "http_requisicao_segundos",
+    "Latência das requisições por rota",
+    rotulos=("metodo", "rota", "status"),
+)
+consultas_por_requisicao = metricas.Histograma(
+    "http_requisicao_db_consultas",
+    "Consultas SQL feitas por requisição",
+    rotulos=("metodo", "rota"),
+    baldes=BALDES_CONTAGEM,
+)
+tempo_db_por_requisicao = metricas.Histograma(
+    "http_requisicao_db_segundos",
+    "Tempo em consultas SQL por requisição",
+    rotulos=("metodo", "rota"),
+)
+chamadas_rpc_por_requisicao = metricas.Histograma(
+    "http_requisicao_rpc_chamadas",
+    "Chamadas JSON-RPC feitas por requisição",
+    rotulos=("metodo", "rota"),
+    baldes=BALDES_CONTAGEM,
+)
+tempo_rpc_por_requisicao = metricas.Histograma(
+    "http_requisicao_rpc_segundos",
+    "Tempo em chamadas JSON-RPC por requisição",
+    rotulos=("metodo", "rota"),
+)
+latencia_consulta = metricas.Histograma(
+    "db_consulta_segundos",
+    "Latência de cada consulta SQL (inclui trabalho fora de requisições)",
+    rotulos=("engine",),
+)
+latencia_chamada_rpc = metricas.Histograma(
+    "rpc_chamada_segundos",
+    "Latência de cada chamada JSON-RPC por método (inclui failover)",
+    rotulos=("metodo",),
+)
+perfis_gravados = metricas.Contador(
+    "perfis_gravados_total",
+    "Perfis de requisições lentas gravados em PERFIL_DIRETORIO",
+)
+
+
+class MedicaoRequisicao:
+    """Acumula o tempo de banco e de RPC de uma requisição."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.db_consultas = 0
+        self.db_segundos = 0.0
+        self.rpc_chamadas = 0
+        self.rpc_segundos = 0.0
+        # Threads por onde a requisição passou (filtra as amostras do perfil)
+        self.threads = {threading.get_ident()}
+        self.amostras = None
+
+    def registrar_consulta(self, duracao: float):
+        with self._lock:
+            self.db_consultas += 1
+            self.db_segundos += duracao
+        self.threads.add(threading.get_ident())
+
+    def registrar_rpc(self, chamadas: int, duracao: float):
+        with self._lock:
+            self.rpc_chamadas += chamadas
+            self.rpc_segundos += duracao
+        self.threads.add(threading.get_ident())
+
+    def server_timing(self, total: float) -> str:
+        app = max(total - self.db_segundos - self.rpc_segundos, 0)
+        return (
+            f'db;dur={self.db_segundos * 1000:.1f};desc="{self.db_consultas} consultas", '
+            f'rpc;dur={self.rpc_segundos * 1000:.1f};desc="{self.rpc_chamadas} chamadas", '
+            f"app;dur={app * 1000:.1f}"
+        )
+
+
+_medicao_atual: ContextVar[Optional[MedicaoRequisicao]] = ContextVar("medicao_requisicao", default=None)
+
+
+def medicao_atual() -> Optional[MedicaoRequisicao]:
+    return _medicao_atual.get()
+
+
+# ===================================
+# BANCO DE DADOS
+# ===================================
+
+def instrumentar_engine(eng, nome: str):
+    """Mede cada consulta da engine (síncrona; no async, passe async_engine.sync_engine)."""
+
+    @event.listens_for(eng, "before_cursor_execute")
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._inicio_instrumentacao = time.perf_counter()
+
+    @event.listens_for(eng, "after_cursor_execute")
+    def _depois(conn, cursor, statement, parameters, context, executemany):
+        inicio = getattr(context, "_inicio_instrumentacao", None)
+        if inicio is None:
+            return
+        duracao = time.perf_counter() - inicio
+        latencia_consulta.observar(duracao, engine=nome)
+        medicao = _medicao_atual.get()
+        if medicao is not None:
+            medicao.registrar_consulta(duracao)
+
+
+# ===================================
+# BLOCKCHAIN (RPC)
+# ===================================
+
+class MiddlewareRPC(Web3Middleware):
+    """Mede as chamadas que passam pelo provedor do web3."""
+
+    def wrap_make_request(self, make_request):
+        def middleware(method, params):
+            inicio = time.perf_counter()
+            try:
+                return make_request(method, params)
+            finally:
+                _registrar_rpc(method, 1, time.perf_counter() - inicio)
+        return middleware
+
+    def wrap_make_batch_request(self, make_batch_request):
+        def middleware(requests_info):
+            inicio = time.perf_counter()
+            try:
+                return make_batch_request(requests_info)
+            finally:
+                _registrar_rpc("lote", len(requests_info), time.perf_counter() - inicio)
+        return middleware
+
+
+def _registrar_rpc(metodo: str, chamadas: int, duracao: float):
+    latencia_chamada_rpc.observar(duracao, metodo=metodo)
+    medicao = _medicao_atual.get()
+    if medicao is not None:
+        medicao.registrar_rpc(chamadas, duracao)
+
+
+def instrumentar_web3(w3):
+    """Adiciona o MiddlewareRPC a uma instância do Web3 (uma vez só)."""
+    try:
+        w3.middleware_onion.add(MiddlewareRPC, "instrumentacao")
+    except ValueError:
+        pass  # já instrumentada
+    return w3
+
+
+# ===================================
+# AMOSTRADOR DE PILHAS (PERFIL)
+# ===================================
+
+def _pilha(frame) -> str:
+    """Pilha da raiz para a folha, no formato folded (quadros separados por ';')."""
+    quadros = []
+    while frame is not None:
+        codigo = frame.f_code
+        quadros.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(quadros))
+
+
+class AmostradorPilhas:
+    """
+    Thread que amostra as pilhas de todas as threads a cada intervalo,
+    enquanto houver ao menos uma requisição registrada.
+    """
+
+    def __init__(self, intervalo_s: float = PERFIL_INTERVALO_MS / 1000):
+        self.intervalo_s = intervalo_s
+        self._lock = threading.Lock()
+        self._medicoes = set()
+        self._tem_requisicoes = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        if self._thread is None:
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._executar, name="amostrador-pilhas", daemon=True)
+            self._thread.start()
+            log.info("✅ Amostrador de pilhas ativo (intervalo %.0f ms, perfis em %s/)", self.intervalo_s * 1000, PERFIL_DIRETORIO)
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        log.info("ℹ️ Amostrador de pilhas parado")
+
+    def registrar(self, medicao: MedicaoRequisicao):
+        medicao.amostras = []
+        with self._lock:
+            self._medicoes.add(medicao)
+            self._tem_requisicoes.set()
+
+    def remover(self, medicao: MedicaoRequisicao):
+        with self._lock:
+            self._medicoes.discard(medicao)
+            if not self._medicoes:
+                self._tem_requisicoes.clear()
+
+    def _executar(self):
+        propria = threading.get_ident()
+        while not self._parar.is_set():
+            if not self._tem_requisicoes.wait(timeout=0.5):
+                continue
+            with self._lock:
+                medicoes = list(self._medicoes)
+            pilhas = [(tid, _pilha(frame)) for tid, frame in sys._current_frames().items() if tid != propria]
+            for medicao in medicoes:
+                if len(medicao.amostras) < PERFIL_MAX_AMOSTRAS:
+                    medicao.amostras.append(pilhas)
+            time.sleep(self.intervalo_s)
+
+
+def gravar_perfil(medicao: MedicaoRequisicao, metodo: str, rota: str, duracao: float) -> Optional[str]:
+    """Grava as amostras das threads da requisição em formato folded."""
+    contagem = {}
+    nomes = {thread.ident: thread.name for thread in threading.enumerate()}
+    for pilhas in medicao.amostras or ():
+        for tid, pilha in pilhas:
+            if tid in medicao.threads:
+                chave = f"{nomes.get(tid, tid)};{pilha}"
+                contagem[chave] = contagem.get(chave, 0) + 1
+    if not contagem:
+        return None
+
+    os.makedirs(PERFIL_DIRETORIO, exist_ok=True)
+    nome_rota = re.sub(r"[^A-Za-z0-9_-]+", "_", rota).strip("_") or "raiz"
+    arquivo = os.path.join(
+        PERFIL_DIRETORIO,
+        f"{datetime.datetime.now():%Y%m%d_%H%M%S_%f}_{metodo}_{nome_rota}_{duracao * 1000:.0f}ms.folded",
+    )
+    with open(arquivo, "w", encoding="utf-8") as saida:
+        for pilha, vezes in sorted(contagem.items()):
+            saida.write(f"{pilha} {vezes}\n")
+    perfis_gravados.inc()
+    return arquivo
+
+
+amostrador = AmostradorPilhas() if PERFIL_ATIVO else None
+
+# ===================================
+# MIDDLEWARE
+# ===================================
+
+def _rota(scope) -> str:
+    """Template da rota atendida; evita uma série por ID na métrica."""
+    rota = scope.get("route")
+    caminho = getattr(rota, "path", None)
+    return caminho if caminho else "nao_encontrada"
+
+
+class MiddlewareInstrumentacao:
+    """Middleware ASGI: latência, consultas e chamadas RPC por requisição."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        medicao = MedicaoRequisicao()
+        token = _medicao_atual.set(medicao)
+        if amostrador is not None:
+            amostrador.registrar(medicao)
+        status_http = 500
+        inicio = time.perf_counter()
+
+        async def enviar(mensagem):
+            nonlocal status_http
+            if mensagem["type"] == "http.response.start":
+                status_http = mensagem["status"]
+                MutableHeaders(scope=mensagem).append("Server-Timing", medicao.server_timing(time.perf_counter() - inicio))
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracao = time.perf_counter() - inicio
+            _medicao_atual.reset(token)
+            if amostrador is not None:
+                amostrador.remover(medicao)
+            self._registrar(scope, medicao, status_http, duracao)
+
+    def _registrar(self, scope, medicao: MedicaoRequisicao, status_http: int, duracao: float):
+        metodo, rota = scope["method"], _rota(scope)
+        latencia_http.observar(duracao, metodo=metodo, rota=rota, status=status_http)
+        consultas_por_requisicao.observar(medicao.db_consultas, metodo=metodo, rota=rota)
+        tempo_db_por_requisicao.observar(medicao.db_segundos, metodo=metodo, rota=rota)
+        chamadas_rpc_por_requisicao.observar(medicao.rpc_chamadas, metodo=metodo, rota=rota)
+        tempo_rpc_por_requisicao.observar(medicao.rpc_segundos, metodo=metodo, rota=rota)
+
+        if duracao * 1000 < REQUISICAO_LENTA_MS:
+            return
+        log.warning(
+            "⚠️ Requisição lenta: %s %s %s em %.0f ms (db %s consultas/%.0f ms, rpc %s chamadas/%.0f ms)",
+            metodo, rota, status_http, duracao * 1000,
+            medicao.db_consultas, medicao.db_segundos * 1000, medicao.rpc_chamadas, medicao.rpc_segundos * 1000,
+            extra={
+                "rota": rota, "status": status_http, "duracao_ms": round(duracao * 1000, 1),
+                "db_consultas": medicao.db_consultas, "db_ms": round(medicao.db_segundos * 1000, 1),
+                "rpc_chamadas": medicao.rpc_chamadas, "rpc_ms": round(medicao.rpc_segundos * 1000, 1),
+            },
+        )
+        if amostrador is not None:
+            try:
+                arquivo = gravar_perfil(medicao, metodo, rota, duracao)
+                if arquivo:
+                    log.info("ℹ️ Perfil gravado: %s", arquivo)
+            except OSError as e:
+                log.warning("⚠️ Erro ao gravar perfil: %s", e)
@@ -0,0 +1,200 @@
+"""
+linhagem.py - Modelo de leitura da linhagem dos produtos (linhagem_produtos)
+
+Cada produto acabado tem uma linha com os campos dele, do lote serrado e da
+tora de origem, já copiados (models.LinhagemDesnormalizada). O /rastrear lê
+uma linha pelo ID customizado e os relatórios agregam por espécie, DOF ou
+serraria sem JOINs entre as três tabelas de lotes.
+
+A tabela é mantida no after_flush da Session, na mesma transação da escrita
+nos lotes (rollback desfaz as duas):
+- produto novo: INSERT ... SELECT com os JOINs, uma instrução por flush;
+- lote alterado pelo ORM (correções, colunas de ancoragem copiadas pelo
+  despachante): UPDATE só das colunas alteradas, nas linhas dos produtos
+  que descendem dele;
+- lote que mudou de origem (chave estrangeira): as linhas dos produtos
+  afetados são reconstruídas;
+- produto apagado: a linha é removida no before_flush, antes do DELETE
+  do produto (linhagem_produtos.id_produto é chave estrangeira para ele).
+
+UPDATE em massa (Core) nos lotes não passa por aqui; hoje só o
+volume_processado_m3 da tora é alterado assim, e ele não faz parte da linha.
+Linhas de produtos já existentes são preenchidas pela migração de dados
+0004_preencher_linhagem_produtos (migracoes.py).
+"""
+
+from sqlalchemy import event, delete, insert, inspect, select, update, func
+from sqlalchemy.orm import Session
+
+import logs
+import models
+import metricas
+
+log = logs.obter_logger("linhagem")
+
+Linhagem = models.LinhagemDesnormalizada
+Produto, Serrado, Tora = models.LoteProdutoAcabado, models.LoteSerrado, models.LoteTora
+
+# ===================================
+# MAPEAMENTO LOTE -> COLUNAS DA LINHA
+# ===================================
+
+# Colunas do AncoragemMixin; na linha ganham o sufixo do nível (_produto...)
+COLUNAS_ANCORAGEM = (
+    "status_ancoragem", "tx_hash", "bloco_ancoragem", "tentativas_ancoragem",
+    "data_envio_ancoragem", "data_confirmacao_ancoragem",
+)
+
+# Nível -> (modelo, coluna da linha que aponta para o lote, {coluna da linha: atributo do lote})
+NIVEIS = {
+    "produto": (Produto, "id_produto", {
+        "id_produto": "id",
+        "id_lote_produto_custom": "id_lote_produto_custom",
+        "id_equipe_fabrica": "id_equipe_fabrica",
+        "sku_produto": "sku_produto",
+        "nome_produto": "nome_produto",
+        "data_fabricacao": "data_fabricacao",
+        "dados_acabamento": "dados_acabamento",
+    }),
+    "serrado": (Serrado, "id_lote_serrado", {
+        "id_lote_serrado": "id",
+        "id_lote_serrado_custom": "id_lote_serrado_custom",
+        "id_equipe_serraria": "id_equipe_serraria",
+        "tipo_produto": "tipo_produto",
+        "dimensoes": "dimensoes",
+        "volume_saida_m3": "volume_saida_m3",
+        "data_processamento": "data_processamento",
+    }),
+    "tora": (Tora, "id_lote_tora", {
+        "id_lote_tora": "id",
+        "id_lote_tora_custom": "id_lote_custom",
+        "id_tecnico_campo": "id_tecnico_campo",
+        "numero_dof": "numero_dof",
+        "numero_licenca_ambiental": "numero_licenca_ambiental",
+        "especie_madeira_popular": "especie_madeira_popular",
+        "especie_madeira_cientifico": "especie_madeira_cientifico",
+        "volume_estimado_m3": "volume_estimado_m3",
+        "coordenadas_gps_lat": "coordenadas_gps_lat",
+        "coordenadas_gps_lon": "coordenadas_gps_lon",
+        "data_hora_registro": "data_hora_registro",
+    }),
+}
+for _nivel, (_modelo, _chave, _campos) in NIVEIS.items():
+    _campos.update({f"{coluna}_{_nivel}": coluna for coluna in COLUNAS_ANCORAGEM})
+
+# Chave estrangeira para o nível de cima: se mudar, a linha é reconstruída
+ORIGEM = {"produto": "id_lote_serrado_origem", "serrado": "id_lote_tora_origem"}
+
+NIVEL_DO_MODELO = {modelo: nivel for nivel, (modelo, _, _) in NIVEIS.items()}
+
+# ===================================
+# MÉTRICAS
+# ===================================
+
+linhas_escritas = metricas.Contador(
+    "linhagem_linhas_total",
+    "Linhas de linhagem_produtos escritas, por operação",
+    rotulos=("operacao",),
+)
+
+# ===================================
+# CONSULTA DE ORIGEM
+# ===================================
+
+def consulta_origem():
+    """SELECT das linhas a partir das tabelas de lotes (colunas na ordem de colunas_origem())."""
+    colunas = [
+        getattr(modelo, atributo).label(coluna)
+        for modelo, _, campos in NIVEIS.values()
+        for coluna, atributo in campos.items()
+    ]
+    return (
+        select(*colunas)
+        .select_from(Produto)
+        .join(Serrado, Serrado.id == Produto.id_lote_serrado_origem)
+        .join(Tora, Tora.id == Serrado.id_lote_tora_origem)
+    )
+
+def colunas_origem() -> list:
+    return [coluna for _, _, campos in NIVEIS.values() for coluna in campos]
+
+def inserir(conn, ids_produto=None) -> int:
+    """Insere as linhas dos produtos (todos os que ainda não têm linha, se ids_produto=None)."""
+    consulta = consulta_origem()
+    if ids_produto is None:
+        consulta = consulta.where(~select(Linhagem.id_produto).where(Linhagem.id_produto == Produto.id).exists())
+    else:
+        consulta = consulta.where(Produto.id.in_(ids_produto))
+    return conn.execute(insert(Linhagem).from_select(colunas_origem(), consulta)).rowcount
+
+# ===================================
+# MANUTENÇÃO NO FLUSH
+# ===================================
+
+def _alterados(obj, campos: dict) -> set:
+    """Atributos mapeados para a linha (ou a chave de origem) alterados neste flush."""
+    estado = inspect(obj)
+    atributos = set(campos.values())
+    origem = ORIGEM.get(NIVEL_DO_MODELO[type(obj)])
+    if origem:
+        atributos.add(origem)
+    return {a for a in atributos if estado.attrs[a].history.has_changes()}
+
+def _produtos_removidos(session: Session) -> set:
+    return {obj.id for obj in session.deleted if isinstance(obj, Produto) and obj.id is not None}
+
+@event.listens_for(Session, "before_flush")
+def _remover_linhagem(session: Session, flush_context, instancias):
+    # Antes do flush: o DELETE do produto falharia na chave estrangeira da linha
+    removidos = _produtos_removidos(session)
+    if removidos:
+        session.connection().execute(delete(Linhagem).where(Linhagem.id_produto.in_(removidos)))
+        linhas_escritas.inc(len(removidos), operacao="remover")
+
+@event.listens_for(Session, "after_flush")
+def _manter_linhagem(session: Session, flush_context):
+    novos, reconstruir = set(), {}
+    atualizacoes = []
+    removidos = _produtos_removidos(session)
+    for obj in session.new:
+        if isinstance(obj, Produto):
+            novos.add(obj.id)
+    for obj in session.dirty:
+        nivel = NIVEL_DO_MODELO.get(type(obj))
+        if nivel is None or obj in session.deleted:
+            continue
+        _, chave, campos = NIVEIS[nivel]
+        alterados = _alterados(obj, campos)
+        if not alterados:
+            continue
+        if ORIGEM.get(nivel) in alterados:
+            reconstruir.setdefault(chave, set()).add(obj.id)
+            continue
+        valores = {coluna: getattr(obj, atributo) for coluna, atributo in campos.items() if atributo in alterados}
+        atualizacoes.append((chave, obj.id, valores))
+
+    if not (novos or reconstruir or atualizacoes):
+        return
+
+    conn = session.connection()
+    for chave, id_lote, valores in atualizacoes:
+        linhas = conn.execute(
+            update(Linhagem).where(getattr(Linhagem, chave) == id_lote).values(**valores, data_atualizacao=func.now())
+        ).rowcount
+        linhas_escritas.inc(max(linhas, 0), operacao="atualizar")
+    if reconstruir:
+        ids = set()
+        for chave, ids_lote in reconstruir.items():
+            if chave == "id_produto":
+                ids |= ids_lote
+            else:
+                ids |= set(conn.execute(select(Linhagem.id_produto).where(getattr(Linhagem, chave).in_(ids_lote))).scalars())
+        ids -= removidos
+        if ids:
+            conn.execute(delete(Linhagem).where(Linhagem.id_produto.in_(ids)))
+            inserir(conn, ids)
+            linhas_escritas.inc(len(ids), operacao="reconstruir")
+    novos -= removidos
+    if novos:
+        inserir(conn, novos)
+        linhas_escritas.inc(len(novos), operacao="inserir")
@@ -0,0 +1,300 @@
+"""
+logs.py - Logging estruturado (JSON lines) e não bloqueante
+
+- Quem loga só coloca o registro numa fila em memória (QueueHandler); uma
+  thread (QueueListener) formata e escreve no stdout. Com a fila cheia
+  (LOG_FILA_MAX) o registro é descartado e contado em
+  logs_descartados_total: log nunca segura a requisição.
+- Cada linha é um objeto JSON com momento, nível, logger, mensagem, thread,
+  o id da requisição e os campos passados em `extra`. LOG_FORMATO=texto
+  volta para linhas legíveis (desenvolvimento local).
+- Id da requisição: vem do cabeçalho X-Request-ID (ou é gerado), volta na
+  resposta e fica numa ContextVar. Ao enfileirar um lote ele é gravado no
+  item da fila_ancoragem, e o despachante o restaura ao processar o item:
+  os logs do envio e do recibo na blockchain carregam o id da requisição
+  que criou o lote.
+- Níveis: LOG_NIVEL para todos e LOG_NIVEIS para ajustes por módulo
+  (ex.: "blockchain=DEBUG,indexador=WARNING").
+- Mensagens de sucesso de alto volume são marcadas com `extra=amostrado()`
+  e limitadas a LOG_SUCESSOS_POR_S por logger; a primeira mensagem de cada
+  segundo informa quantas foram suprimidas no anterior. Avisos e erros
+  nunca são amostrados, então o volume acompanha os erros, não o tráfego.
+
+Uso:
+    log = logs.obter_logger("ancoragem")
+    log.info("✅ Lote %s enviado", id_lote, extra=logs.amostrado(tx_hash=tx))
+"""
+
+import os
+import re
+import sys
+import json
+import uuid
+import queue
+import atexit
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from starlette.datastructures import MutableHeaders
+
+import metricas
+
+# ===================================
+# CONFIGURAÇÃO
+# ===================================
+
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+LOG_NIVEIS = os.getenv("LOG_NIVEIS", "")
+LOG_FORMATO = os.getenv("LOG_FORMATO", "json").lower()  # json ou texto
+
+# Mensagens amostradas emitidas por logger a cada segundo (0 = sem limite)
+LOG_SUCESSOS_POR_S = float(os.getenv("LOG_SUCESSOS_POR_S", "5"))
+
+# Registros aguardando escrita; acima disso são descartados
+LOG_FILA_MAX = int(os.getenv("LOG_FILA_MAX", "10000"))
+
+# Bibliotecas que logam cada requisição em INFO (LOG_NIVEIS sobrepõe). Os
+# pools de database.py logam com o nome da classe ("database.PoolMedido")
+# e herdariam o INFO de "database" ("Pool disposed", "Pool recreating"...).
+NIVEIS_PADRAO = {
+    "httpx": "WARNING", "httpcore": "WARNING", "urllib3": "WARNING", "web3": "WARNING",
+    "sqlalchemy": "WARNING", "database.PoolMedido": "WARNING", "database.PoolAsyncMedido": "WARNING",
+}
+
+# Id de requisição aceito do cliente (o resto é substituído por um gerado)
+_ID_VALIDO = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+# ===================================
+# MÉTRICAS
+# ===================================
+
+descartados = metricas.Contador(
+    "logs_descartados_total",
+    "Registros de log descartados com a fila cheia (LOG_FILA_MAX)",
+)
+suprimidos = metricas.Contador(
+    "logs_suprimidos_total",
+    "Mensagens de sucesso suprimidas pela amostragem (LOG_SUCESSOS_POR_S)",
+    rotulos=("logger",),
+)
+
+# ===================================
+# ID DA REQUISIÇÃO
+# ===================================
+
+_id_requisicao: ContextVar[Optional[str]] = ContextVar("id_requisicao", default=None)
+
+
+def id_requisicao_atual() -> Optional[str]:
+    return _id_requisicao.get()
+
+
+@contextmanager
+def contexto_requisicao(id_requisicao: Optional[str]):
+    """Associa os logs do bloco a um id de requisição (ex.: item da fila)."""
+    token = _id_requisicao.set(id_requisicao)
+    try:
+        yield
+    finally:
+        _id_requisicao.reset(token)
+
+
+class MiddlewareIdRequisicao:
+    """Middleware ASGI: lê ou gera o X-Request-ID e o devolve na resposta."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        recebido = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        id_requisicao = recebido if _ID_VALIDO.match(recebido) else uuid.uuid4().hex
+
+        async def enviar(mensagem):
+            if mensagem["type"] == "http.response.start":
+                MutableHeaders(scope=mensagem).append("X-Request-ID", id_requisicao)
+            await send(mensagem)
+
+        with contexto_requisicao(id_requisicao):
+            await self.app(scope, receive, enviar)
+
+
+# ===================================
+# FILTROS E FORMATOS
+# ===================================
+
+def amostrado(**campos) -> dict:
+    """`extra` de uma mensagem de sucesso de alto volume (sujeita à amostragem)."""
+    campos["amostrado"] = True
+    return campos
+
+
+class _FiltroContexto(logging.Filter):
+    """Roda na thread de quem loga: captura o id da requisição antes da fila."""
+
+    def filter(self, record):
+        record.id_requisicao = _id_requisicao.get()
+        return True
+
+
+class _FiltroAmostragem(logging.Filter):
+    """Limita as mensagens amostradas a `por_segundo` por logger."""
+
+    def __init__(self, por_segundo: float):
+        super().__init__()
+        self.por_segundo = por_segundo
+        self._lock = threading.Lock()
+        self._janelas = {}  # logger -> [segundo, emitidas, suprimidas]
+
+    def filter(self, record):
+        if self.por_segundo <= 0 or record.levelno > logging.INFO or not getattr(record, "amostrado", False):
+            return True
+        segundo = int(record.created)
+        with self._lock:
+            janela = self._janelas.get(record.name)
+            if janela is None or janela[0] != segundo:
+                if janela is not None and janela[2]:
+                    record.suprimidas_antes = janela[2]
+                janela = self._janelas[record.name] = [segundo, 0, 0]
+            if janela[1] >= self.por_segundo:
+                janela[2] += 1
+                suprimido = True
+            else:
+                janela[1] += 1
+                suprimido = False
+        if suprimido:
+            suprimidos.inc(logger=record.name)
+        return not suprimido
+
+
+class _FiltroAcessoUvicorn(logging.Filter):
+    """Log de acesso do uvicorn: respostas 2xx/3xx entram na amostragem."""
+
+    def filter(self, record):
+        args = record.args if isinstance(record.args, tuple) else ()
+        if len(args) >= 5 and isinstance(args[4], int) and args[4] < 400:
+            record.amostrado = True
+        return True
+
+
+# Atributos que todo LogRecord tem; o resto veio de `extra`
+_CAMPOS_PADRAO = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "amostrado", "id_requisicao", "taskName",
+}
+
+
+class FormatadorJSON(logging.Formatter):
+    def format(self, record):
+        dados = {
+            "momento": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensagem": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if getattr(record, "id_requisicao", None):
+            dados["id_requisicao"] = record.id_requisicao
+        for chave, valor in vars(record).items():
+            if chave not in _CAMPOS_PADRAO:
+                dados[chave] = valor
+        if record.exc_text:
+            dados["excecao"] = record.exc_text
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class FormatadorTexto(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s %(message)s")
+
+    def format(self, record):
+        texto = super().format(record)
+        if getattr(record, "id_requisicao", None):
+            texto += f" [req {record.id_requisicao}]"
+        if getattr(record, "suprimidas_antes", None):
+            texto += f" (+{record.suprimidas_antes} suprimidas)"
+        return texto
+
+
+class _HandlerFila(QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            descartados.inc()
+
+    def prepare(self, record):
+        # Resolve a mensagem e a exceção aqui (os args podem mudar depois);
+        # o JSON é montado na thread do QueueListener.
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+# ===================================
+# CONFIGURAÇÃO DO LOGGING
+# ===================================
+
+_listener: Optional[QueueListener] = None
+_lock_configuracao = threading.Lock()
+
+
+def configurar():
+    """Liga a fila de logs no logger raiz (idempotente)."""
+    global _listener
+    with _lock_configuracao:
+        if _listener is not None:
+            return
+
+        fila = queue.Queue(LOG_FILA_MAX)
+        saida = logging.StreamHandler(sys.stdout)
+        saida.setFormatter(FormatadorTexto() if LOG_FORMATO == "texto" else FormatadorJSON())
+
+        handler = _HandlerFila(fila)
+        handler.addFilter(_FiltroContexto())
+        handler.addFilter(_FiltroAmostragem(LOG_SUCESSOS_POR_S))
+
+        raiz = logging.getLogger()
+        raiz.handlers[:] = [handler]
+        raiz.setLevel(LOG_NIVEL)
+        niveis = dict(NIVEIS_PADRAO)
+        for par in LOG_NIVEIS.split(","):
+            nome, _, nivel = par.partition("=")
+            if nome.strip() and nivel.strip():
+                niveis[nome.strip()] = nivel.strip().upper()
+        for nome, nivel in niveis.items():
+            logging.getLogger(nome).setLevel(nivel)
+
+        # O uvicorn escreve direto no stdout; passa a usar a mesma fila
+        for nome in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+            logger = logging.getLogger(nome)
+            logger.handlers[:] = []
+            logger.propagate = True
+        logging.getLogger("uvicorn.access").addFilter(_FiltroAcessoUvicorn())
+
+        _listener = QueueListener(fila, saida)
+        _listener.start()
+        atexit.register(parar)
+
+
+def parar():
+    """Escreve o que ainda está na fila e para a thread de escrita."""
+    global _listener
+    with _lock_configuracao:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def obter_logger(nome: str) -> logging.Logger:
+    configurar()
+    return logging.getLogger(nome)
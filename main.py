@@ -1,35 +1,83 @@
 import os
-import datetime
-from fastapi import FastAPI, Depends, HTTPException, status, Form
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, status, Form, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List
-from jose import jwt, JWTError
+from typing import List, Literal, Optional
 
 # Importa de todos os nossos outros arquivos
-from database import get_db
-import models
+from database import get_db, engine, async_engine, DB_ASYNC
+import ancoragem
+import indexador
+import migracoes
 import schemas
+import servicos
+import exportacao
+import logs
+import metricas
+import instrumentacao
 import auth
-from auth import SECRET_KEY, ALGORITHM
+
+log = logs.obter_logger("main")
 
 # Importa módulo blockchain
 try:
     import blockchain
     BLOCKCHAIN_ENABLED = True
-    print("✅ Módulo blockchain carregado com sucesso!")
+    log.info("✅ Módulo blockchain carregado com sucesso!")
 except Exception as e:
     BLOCKCHAIN_ENABLED = False
-    print(f"⚠️ Blockchain desabilitada: {e}")
+    log.warning("⚠️ Blockchain desabilitada: %s", e)
 
 # Importa o CORS
 from fastapi.middleware.cors import CORSMiddleware
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Inicialização: aplica migrações, liga a sondagem da conexão com a
+    blockchain, a atualização de taxas de gas, o despachante da fila de
+    ancoragem e (opcional) o indexador de eventos. Nada disso espera a rede.
+    """
+    migracoes.aplicar_migracoes(engine)
+    if instrumentacao.amostrador:
+        instrumentacao.amostrador.iniciar()
+    
+    despachante = None
+    indexador_eventos = None
+    if BLOCKCHAIN_ENABLED:
+        # Conexão em segundo plano: o worker sobe mesmo com o RPC lento ou fora do ar
+        blockchain.monitor_conexao.iniciar()
+        blockchain.oraculo_gas.iniciar()
+        if ancoragem.DESPACHANTE_ATIVO:
+            despachante = ancoragem.DespachanteAncoragem()
+            despachante.iniciar()
+        if indexador.INDEXADOR_ATIVO:
+            indexador_eventos = indexador.IndexadorEventos()
+            indexador_eventos.iniciar()
+    
+    yield
+    
+    if despachante:
+        despachante.parar()
+    if indexador_eventos:
+        indexador_eventos.parar()
+    if BLOCKCHAIN_ENABLED:
+        blockchain.oraculo_gas.parar()
+        blockchain.monitor_conexao.parar()
+    if instrumentacao.amostrador:
+        instrumentacao.amostrador.parar()
+    if async_engine is not None:
+        await async_engine.dispose()
+
 app = FastAPI(
     title="API Rastreabilidade com Blockchain",
     description="Sistema completo de rastreamento desde a extração até o produto final",
-    version="3.0.0"
+    version="3.0.0",
+    lifespan=lifespan
 )
 
 # --- Configuração do CORS ---
@@ -49,49 +97,40 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Proximo-Cursor", "ETag", "Server-Timing", "X-Request-ID"],
 )
 
+# Latência, consultas SQL e chamadas RPC por rota (ver instrumentacao.py)
+app.add_middleware(instrumentacao.MiddlewareInstrumentacao)
+# X-Request-ID por requisição; adicionado por último para envolver os demais
+app.add_middleware(logs.MiddlewareIdRequisicao)
+
 # --- Dependências de Segurança ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> schemas.UsuarioAutenticado:
     """
-    Função genérica: Decodifica o token e retorna o objeto do usuário
+    Função genérica: Decodifica o token e retorna o usuário
     de QUALQUER tabela (Técnico, Serraria ou Fábrica).
+    O id e o papel vêm do próprio token; com o token em cache, não há
+    nenhuma consulta ao banco.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Não foi possível validar as credenciais",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(email=email)
-    except JWTError:
+    user = servicos.autenticar(db, token)
+    if user is None:
         raise credentials_exception
-    
-    # Procura o usuário em todas as 3 tabelas
-    user = db.query(models.TecnicoCampo).filter(models.TecnicoCampo.email == token_data.email).first()
-    if user:
-        return user
-    user = db.query(models.EquipeSerraria).filter(models.EquipeSerraria.email == token_data.email).first()
-    if user:
-        return user
-    user = db.query(models.EquipeFabrica).filter(models.EquipeFabrica.email == token_data.email).first()
-    if user:
-        return user
-    
-    raise credentials_exception
+    return user
 
 # ===================================
 # ENDPOINTS - AUTENTICAÇÃO
 # ===================================
 
 @app.post("/token", response_model=schemas.Token)
-def login_for_access_token(
+async def login_for_access_token(
     username: str = Form(...),  # OAuth2 usa 'username', mas vamos aceitar email
     password: str = Form(...),
     db: Session = Depends(get_db)
@@ -99,36 +138,33 @@ def login_for_access_token(
     """
     Endpoint de login que autentica usuários de qualquer tipo (técnico, serraria, fábrica).
     Retorna um token JWT válido.
+
+    Assíncrono: as consultas ao banco vão para o threadpool e a espera pelo
+    bcrypt (pool próprio, auth.py) não prende uma thread de requisição.
     """
-    user = None
-    
-    # 1. Tenta como Técnico
-    user_tecnico = db.query(models.TecnicoCampo).filter(models.TecnicoCampo.email == username).first()
-    if user_tecnico and auth.verificar_senha(password, user_tecnico.hash_senha):
-        user = user_tecnico
-
-    # 2. Tenta como Serraria
-    if not user:
-        user_serraria = db.query(models.EquipeSerraria).filter(models.EquipeSerraria.email == username).first()
-        if user_serraria and auth.verificar_senha(password, user_serraria.hash_senha):
-            user = user_serraria
-            
-    # 3. Tenta como Fábrica
-    if not user:
-        user_fabrica = db.query(models.EquipeFabrica).filter(models.EquipeFabrica.email == username).first()
-        if user_fabrica and auth.verificar_senha(password, user_fabrica.hash_senha):
-            user = user_fabrica
-
-    # 4. Se não encontrou em nenhuma
-    if not user:
+    # Uma consulta nas 3 tabelas e no máximo uma verificação de bcrypt
+    conta = await run_in_threadpool(servicos.buscar_conta_login, db, username)
+    try:
+        senha_ok, novo_hash = await auth.verificar_senha_login_async(password, conta.hash_senha if conta else None)
+    except auth.FilaSenhasCheia:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Muitos logins simultâneos, tente novamente",
+            headers={"Retry-After": "1"},
+        )
+
+    if not senha_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email ou senha incorretos",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
-    # 5. Se encontrou, cria o token
-    access_token = auth.criar_access_token(data={"sub": user.email})
+
+    if novo_hash:
+        await run_in_threadpool(servicos.atualizar_hash_senha, db, conta.papel, conta.id, novo_hash)
+
+    user = schemas.UsuarioAutenticado(id=conta.id, email=conta.email, role=conta.papel)
+    access_token = servicos.criar_token_usuario(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -137,76 +173,39 @@ def read_users_me(current_user = Depends(get_current_user)):
     """
     Retorna id, email e ROLE do usuário logado.
     """
-    role = "desconhecido"
-    
-    if isinstance(current_user, models.TecnicoCampo):
-        role = "tecnico"
-    elif isinstance(current_user, models.EquipeSerraria):
-        role = "serraria"
-    elif isinstance(current_user, models.EquipeFabrica):
-        role = "fabrica"
-    
+    role = servicos.papel_do_usuario(current_user)
     return {"id": current_user.id, "email": current_user.email, "role": role}
 
 # ===================================
 # DEPENDÊNCIAS - VERIFICAÇÃO DE ROLE
 # ===================================
 
-def get_current_tecnico(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.TecnicoCampo:
-    credentials_exception = HTTPException(
-        status_code=401, 
-        detail="Não autorizado: Apenas Técnicos de Campo podem acessar esta rota."
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(models.TecnicoCampo).filter(models.TecnicoCampo.email == email).first()
-    if user is None:
-        raise credentials_exception
+def _usuario_do_papel(token: str, db: Session, papel: str, detail: str) -> schemas.UsuarioAutenticado:
+    user = servicos.autenticar(db, token, papel)
+    if user is None or user.role != papel:
+        raise HTTPException(status_code=401, detail=detail)
     return user
 
 
-def get_current_serraria(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.EquipeSerraria:
-    credentials_exception = HTTPException(
-        status_code=401, 
-        detail="Não autorizado: Apenas a Equipe da Serraria pode acessar esta rota."
+def get_current_tecnico(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> schemas.UsuarioAutenticado:
+    return _usuario_do_papel(
+        token, db, "tecnico",
+        "Não autorizado: Apenas Técnicos de Campo podem acessar esta rota."
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(models.EquipeSerraria).filter(models.EquipeSerraria.email == email).first()
-    if user is None:
-        raise credentials_exception
-    return user
 
 
-def get_current_fabrica(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.EquipeFabrica:
-    credentials_exception = HTTPException(
-        status_code=401, 
-        detail="Não autorizado: Apenas a Equipe da Fábrica pode acessar esta rota."
+def get_current_serraria(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> schemas.UsuarioAutenticado:
+    return _usuario_do_papel(
+        token, db, "serraria",
+        "Não autorizado: Apenas a Equipe da Serraria pode acessar esta rota."
+    )
+
+
+def get_current_fabrica(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> schemas.UsuarioAutenticado:
+    return _usuario_do_papel(
+        token, db, "fabrica",
+        "Não autorizado: Apenas a Equipe da Fábrica pode acessar esta rota."
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(models.EquipeFabrica).filter(models.EquipeFabrica.email == email).first()
-    if user is None:
-        raise credentials_exception
-    return user
 
 # ===================================
 # ENDPOINTS - TÉCNICO (LOTES DE TORA)
@@ -216,78 +215,59 @@ def get_current_fabrica(token: str = Depends(oauth2_scheme), db: Session = Depen
 def create_lote_tora(
     lote: schemas.LoteToraCreate, 
     db: Session = Depends(get_db), 
-    current_user: models.TecnicoCampo = Depends(get_current_tecnico)
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_tecnico)
 ):
     """
     Cria um novo Lote de Tora. Requer login de Técnico de Campo.
-    REGISTRA NA BLOCKCHAIN automaticamente.
-    """
-    today_str = datetime.date.today().strftime("%Y%m%d")
-    count_today = db.query(models.LoteTora).filter(
-        models.LoteTora.id_lote_custom.like(f"TORA-{today_str}-%")
-    ).count()
-    new_id_custom = f"TORA-{today_str}-{str(count_today + 1).zfill(3)}"
-
-    db_lote = models.LoteTora(
-        **lote.model_dump(),
-        id_lote_custom=new_id_custom,
-        id_tecnico_campo=current_user.id
-    )
-    
-    try:
-        # 1. Salvar no banco de dados centralizado
-        db.add(db_lote)
-        db.commit()
-        db.refresh(db_lote)
-        
-        print(f"✅ Lote {new_id_custom} salvo no banco de dados")
-        
-        # 2. Registrar na blockchain
-        if BLOCKCHAIN_ENABLED:
-            try:
-                tx_hash = blockchain.registrar_lote_tora_blockchain(
-                    id_lote_custom=db_lote.id_lote_custom,
-                    coordenadas_lat=float(lote.coordenadas_gps_lat),
-                    coordenadas_lon=float(lote.coordenadas_gps_lon),
-                    numero_dof=lote.numero_dof,
-                    numero_licenca=lote.numero_licenca_ambiental,
-                    especie=lote.especie_madeira_popular or "Não informada",
-                    volume_m3=float(lote.volume_estimado_m3)
-                )
-                
-                if tx_hash:
-                    print(f"✅ Lote {new_id_custom} registrado na blockchain: {tx_hash}")
-                else:
-                    print(f"⚠️ Lote {new_id_custom} salvo no BD, mas falhou na blockchain")
-                    
-            except Exception as blockchain_error:
-                print(f"⚠️ Erro ao registrar na blockchain: {blockchain_error}")
-                # Não falha o endpoint se blockchain der erro
-        
-        return db_lote
-        
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=f"Erro ao salvar no banco: {e}")
+    O registro na blockchain é enfileirado e feito em segundo plano.
+    """
+    return servicos.criar_lote_tora(db, lote, current_user.id)
+
+
+@app.post("/lotes_tora/em_lote", response_model=schemas.LotesToraEmLoteResultado)
+def create_lotes_tora_em_lote(
+    envio: schemas.LotesToraEmLoteCreate,
+    db: Session = Depends(get_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_tecnico)
+):
+    """
+    Sincronização do app de campo: cria vários Lotes de Tora de uma vez.
+    Cada item é validado separadamente e o resultado vem por item (criado,
+    existente ou invalido). Reenviar itens com a mesma chave_idempotencia
+    devolve os lotes já criados em vez de duplicá-los.
+    """
+    return servicos.criar_lotes_tora_em_lote(db, envio.itens, current_user.id)
 
 
 @app.get("/lotes_tora/", response_model=List[schemas.LoteToraDisplay])
 def listar_lotes_tora(
+    response: Response,
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """
-    Lista todos os lotes de tora.
+    Lista os lotes de tora, do mais recente para o mais antigo, em páginas.
     Técnicos veem apenas os seus. Serraria e Fábrica veem todos.
+    Se houver mais resultados, o header X-Proximo-Cursor traz o valor do
+    parâmetro `cursor` da próxima página.
     """
-    if isinstance(current_user, models.TecnicoCampo):
-        lotes = db.query(models.LoteTora).filter(
-            models.LoteTora.id_tecnico_campo == current_user.id
-        ).all()
-    else:
-        lotes = db.query(models.LoteTora).all()
-    
-    return lotes
+    itens, proximo = servicos.listar_lotes_tora(db, current_user, filtros)
+    return servicos.com_cursor(response, itens, proximo)
+
+
+# Precisa vir antes de /lotes_tora/{lote_id}
+@app.get("/lotes_tora/volume_disponivel", response_model=List[schemas.VolumeDisponivel])
+def volume_disponivel_lotes_tora(
+    ids: List[int] = Query(..., min_length=1, max_length=500),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Volume ainda disponível de vários lotes de tora (?ids=1&ids=2...),
+    lido da coluna mantida a cada lote serrado criado.
+    """
+    return servicos.volumes_disponiveis(db, ids, current_user)
 
 
 @app.get("/lotes_tora/{lote_id}", response_model=schemas.LoteToraDisplay)
@@ -299,15 +279,7 @@ def obter_lote_tora(
     """
     Obtém detalhes de um lote de tora específico.
     """
-    lote = db.query(models.LoteTora).filter(models.LoteTora.id == lote_id).first()
-    
-    if not lote:
-        raise HTTPException(status_code=404, detail="Lote de tora não encontrado")
-    
-    if isinstance(current_user, models.TecnicoCampo) and lote.id_tecnico_campo != current_user.id:
-        raise HTTPException(status_code=403, detail="Acesso negado a este lote")
-    
-    return lote
+    return servicos.obter_lote_tora(db, lote_id, current_user)
 
 # ===================================
 # ENDPOINTS - SERRARIA (LOTES SERRADOS)
@@ -317,121 +289,41 @@ def obter_lote_tora(
 def create_lote_serrado(
     lote: schemas.LoteSerradaCreate,
     db: Session = Depends(get_db),
-    current_user: models.EquipeSerraria = Depends(get_current_serraria)
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_serraria)
 ):
     """
     Cria um novo lote serrado a partir de um lote de tora.
-    REGISTRA NA BLOCKCHAIN automaticamente.
+    O registro na blockchain é enfileirado e feito em segundo plano.
     """
-    # 1. Verificar se o lote de tora existe
-    lote_tora = db.query(models.LoteTora).filter(
-        models.LoteTora.id == lote.id_lote_tora_origem
-    ).first()
-    
-    if not lote_tora:
-        raise HTTPException(
-            status_code=404,
-            detail=f"Lote de tora com ID {lote.id_lote_tora_origem} não encontrado"
-        )
-    
-    # 2. Calcular volume já processado
-    lotes_ja_processados = db.query(models.LoteSerrado).filter(
-        models.LoteSerrado.id_lote_tora_origem == lote.id_lote_tora_origem
-    ).all()
-    
-    volume_processado = sum(float(ls.volume_saida_m3) for ls in lotes_ja_processados)
-    volume_disponivel = float(lote_tora.volume_estimado_m3) - volume_processado
-    
-    # 3. Validar volume
-    if float(lote.volume_saida_m3) > volume_disponivel:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Volume de saída ({lote.volume_saida_m3} m³) excede o volume disponível ({volume_disponivel:.2f} m³)"
-        )
-    
-    # 4. Gerar ID customizado
-    hoje = datetime.date.today().strftime("%Y%m%d")
-    ultimo_lote = db.query(models.LoteSerrado).filter(
-        models.LoteSerrado.id_lote_serrado_custom.like(f"SERR-{hoje}-%")
-    ).order_by(models.LoteSerrado.id.desc()).first()
-    
-    if ultimo_lote:
-        ultimo_numero = int(ultimo_lote.id_lote_serrado_custom.split("-")[-1])
-        novo_numero = ultimo_numero + 1
-    else:
-        novo_numero = 1
-    
-    id_lote_serrado_custom = f"SERR-{hoje}-{novo_numero:03d}"
-    
-    # 5. Criar o lote serrado
-    db_lote_serrado = models.LoteSerrado(
-        **lote.model_dump(),
-        id_lote_serrado_custom=id_lote_serrado_custom,
-        id_equipe_serraria=current_user.id
-    )
-    
-    try:
-        # Salvar no banco
-        db.add(db_lote_serrado)
-        db.commit()
-        db.refresh(db_lote_serrado)
-        
-        print(f"✅ Lote serrado {id_lote_serrado_custom} salvo no banco de dados")
-        
-        # Registrar na blockchain
-        if BLOCKCHAIN_ENABLED:
-            try:
-                tx_hash = blockchain.registrar_lote_serrado_blockchain(
-                    id_lote_serrado_custom=db_lote_serrado.id_lote_serrado_custom,
-                    id_lote_tora_origem=lote_tora.id_lote_custom,
-                    volume_saida_m3=float(lote.volume_saida_m3),
-                    tipo_produto=lote.tipo_produto or "",
-                    dimensoes=lote.dimensoes or ""
-                )
-                
-                if tx_hash:
-                    print(f"✅ Lote serrado registrado na blockchain: {tx_hash}")
-                else:
-                    print(f"⚠️ Lote serrado salvo no BD, mas falhou na blockchain")
-                    
-            except Exception as blockchain_error:
-                print(f"⚠️ Erro blockchain: {blockchain_error}")
-        
-        return db_lote_serrado
-        
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=f"Erro ao salvar lote serrado: {e}")
+    return servicos.criar_lote_serrado(db, lote, current_user.id)
 
 
 @app.get("/lotes_serrada/", response_model=List[schemas.LoteSerradaDisplay])
 def listar_lotes_serrados(
+    response: Response,
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
     db: Session = Depends(get_db),
-    current_user: models.EquipeSerraria = Depends(get_current_serraria)
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_serraria)
 ):
     """
-    Lista todos os lotes serrados processados pelo usuário atual.
+    Lista os lotes serrados processados pelo usuário atual (paginado, ver X-Proximo-Cursor).
     """
-    lotes = db.query(models.LoteSerrado).filter(
-        models.LoteSerrado.id_equipe_serraria == current_user.id
-    ).order_by(models.LoteSerrado.data_processamento.desc()).all()
-    
-    return lotes
+    itens, proximo = servicos.listar_lotes_serrados(db, filtros, current_user.id)
+    return servicos.com_cursor(response, itens, proximo)
 
 
 @app.get("/lotes_serrado/", response_model=List[schemas.LoteSerradaDisplay])
 def listar_lotes_serrados_para_fabrica(
+    response: Response,
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
     db: Session = Depends(get_db),
-    current_user: models.EquipeFabrica = Depends(get_current_fabrica)
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_fabrica)
 ):
     """
-    Lista todos os lotes serrados disponíveis para fabricação.
+    Lista os lotes serrados disponíveis para fabricação (paginado, ver X-Proximo-Cursor).
     """
-    lotes = db.query(models.LoteSerrado).order_by(
-        models.LoteSerrado.data_processamento.desc()
-    ).all()
-    
-    return lotes
+    itens, proximo = servicos.listar_lotes_serrados(db, filtros)
+    return servicos.com_cursor(response, itens, proximo)
 
 # ===================================
 # ENDPOINTS - FÁBRICA (PRODUTOS ACABADOS)
@@ -441,166 +333,139 @@ def listar_lotes_serrados_para_fabrica(
 def create_produto_acabado(
     produto: schemas.LoteProdutoAcabadoCreate,
     db: Session = Depends(get_db),
-    current_user: models.EquipeFabrica = Depends(get_current_fabrica)
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_fabrica)
 ):
     """
     Cria um novo produto acabado a partir de um lote serrado.
-    REGISTRA NA BLOCKCHAIN automaticamente.
+    O registro na blockchain é enfileirado e feito em segundo plano.
     """
-    # 1. Verificar se o lote serrado existe
-    lote_serrado = db.query(models.LoteSerrado).filter(
-        models.LoteSerrado.id == produto.id_lote_serrado_origem
-    ).first()
-    
-    if not lote_serrado:
-        raise HTTPException(
-            status_code=404,
-            detail=f"Lote serrado com ID {produto.id_lote_serrado_origem} não encontrado"
-        )
-    
-    # 2. Gerar ID customizado
-    hoje = datetime.date.today().strftime("%Y%m%d")
-    ultimo_produto = db.query(models.LoteProdutoAcabado).filter(
-        models.LoteProdutoAcabado.id_lote_produto_custom.like(f"PROD-{hoje}-%")
-    ).order_by(models.LoteProdutoAcabado.id.desc()).first()
-    
-    if ultimo_produto:
-        ultimo_numero = int(ultimo_produto.id_lote_produto_custom.split("-")[-1])
-        novo_numero = ultimo_numero + 1
-    else:
-        novo_numero = 1
-    
-    id_lote_produto_custom = f"PROD-{hoje}-{novo_numero:03d}"
-    
-    # 3. Gerar link de rastreabilidade
-    link_qr_code = f"https://app-rastreabilidade.onrender.com/rastrear.html?id={id_lote_produto_custom}"
-    
-    # 4. Criar o produto
-    db_produto = models.LoteProdutoAcabado(
-        **produto.model_dump(exclude={'link_qr_code'}),
-        id_lote_produto_custom=id_lote_produto_custom,
-        id_equipe_fabrica=current_user.id,
-        link_qr_code=link_qr_code
-    )
-    
-    try:
-        # Salvar no banco
-        db.add(db_produto)
-        db.commit()
-        db.refresh(db_produto)
-        
-        print(f"✅ Produto {id_lote_produto_custom} salvo no banco de dados")
-        
-        # Registrar na blockchain
-        if BLOCKCHAIN_ENABLED:
-            try:
-                # Buscar o lote serrado para pegar o ID customizado
-                lote_serrado_origem = db.query(models.LoteSerrado).filter(
-                    models.LoteSerrado.id == produto.id_lote_serrado_origem
-                ).first()
-                
-                if not lote_serrado_origem:
-                    print("⚠️ Lote serrado origem não encontrado para blockchain")
-                else:
-                    tx_hash = blockchain.registrar_produto_acabado_blockchain(
-                        id_produto_custom=db_produto.id_lote_produto_custom,
-                        id_lote_serrado_origem=lote_serrado_origem.id_lote_serrado_custom,  # ID customizado!
-                        sku_produto=produto.sku_produto,
-                        nome_produto=produto.nome_produto
-                    )
-                    
-                    if tx_hash:
-                        print(f"✅ Produto registrado na blockchain: {tx_hash}")
-                        print(f"🔗 Etherscan: https://sepolia.etherscan.io/tx/{tx_hash}")
-                    else:
-                        print(f"⚠️ Produto salvo no BD, mas falhou na blockchain")
-                    
-            except Exception as blockchain_error:
-                print(f"⚠️ Erro blockchain: {blockchain_error}")
-        
-        return db_produto
-        
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=f"Erro ao salvar produto acabado: {e}")
+    return servicos.criar_produto_acabado(db, produto, current_user.id)
 
 
 @app.get("/produtos_acabados/", response_model=List[schemas.LoteProdutoAcabadoDisplay])
 def listar_produtos_acabados(
+    response: Response,
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
     db: Session = Depends(get_db),
-    current_user: models.EquipeFabrica = Depends(get_current_fabrica)
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_fabrica)
 ):
     """
-    Lista todos os produtos acabados fabricados pelo usuário atual.
+    Lista os produtos acabados fabricados pelo usuário atual (paginado, ver X-Proximo-Cursor).
     """
-    produtos = db.query(models.LoteProdutoAcabado).filter(
-        models.LoteProdutoAcabado.id_equipe_fabrica == current_user.id
-    ).order_by(models.LoteProdutoAcabado.data_fabricacao.desc()).all()
-    
-    return produtos
+    itens, proximo = servicos.listar_produtos_acabados(db, current_user.id, filtros)
+    return servicos.com_cursor(response, itens, proximo)
+
+# ===================================
+# ENDPOINT - EXPORTAÇÃO (AUDITORIA)
+# ===================================
+
+@app.get("/exportar/{tipo}")
+def exportar_lotes(
+    tipo: Literal["lotes_tora", "lotes_serrada", "produtos_acabados"],
+    formato: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_user)
+):
+    """
+    Exporta todos os lotes do tipo (com a origem de cada um) em NDJSON ou
+    CSV, enviados em streaming. Aceita os mesmos filtros das listagens
+    (cursor e limite são ignorados). Com gzip=true, o arquivo vem compactado.
+    """
+    try:
+        responsavel = exportacao.responsavel_obrigatorio(tipo, current_user.role, current_user.id)
+    except PermissionError:
+        raise HTTPException(status_code=403, detail="Acesso negado a esta exportação")
+
+    consulta = exportacao.montar_consulta(tipo, filtros, responsavel)
+    nome_arquivo = f"{tipo}.{formato}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        exportacao.gerar_exportacao(consulta, formato, compactar=gzip),
+        media_type="application/gzip" if gzip else exportacao.FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nome_arquivo}"'},
+    )
+
+# ===================================
+# ENDPOINT - LINHAGEM (PARA ONDE FOI A TORA)
+# ===================================
+
+@app.get("/linhagem/tora", response_model=schemas.LinhagemDisplay)
+def linhagem_da_tora(
+    response: Response,
+    id_lote_tora: Optional[int] = None,
+    numero_dof: Optional[str] = None,
+    profundidade: int = Query(2, ge=1, le=2, description="1 = só lotes serrados, 2 = também produtos"),
+    cursor: Optional[str] = Query(None, description="Valor do header X-Proximo-Cursor da página anterior"),
+    limite: int = Query(servicos.LIMITE_PADRAO, ge=1, le=servicos.LIMITE_MAXIMO),
+    db: Session = Depends(get_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_user)
+):
+    """
+    Descendentes de um lote de tora (ou de todas as toras de um DOF):
+    lotes serrados e produtos acabados, para recall e auditoria.
+    O nível mais fundo pedido vem paginado (ver X-Proximo-Cursor); com
+    profundidade 2 os lotes serrados vêm limitados a `limite`. Os totais
+    só são calculados na primeira página.
+    """
+    filtros = schemas.FiltrosLista(cursor=cursor, limite=limite)
+    linhagem, proximo = servicos.linhagem_da_tora(db, current_user, id_lote_tora, numero_dof, profundidade, filtros)
+    return servicos.com_cursor(response, linhagem, proximo)
+
+# ===================================
+# ENDPOINT - RELATÓRIOS (MODELO DE LEITURA)
+# ===================================
+
+@app.get("/relatorios/volume", response_model=schemas.RelatorioVolume)
+def relatorio_volume(
+    agrupar_por: Literal["especie", "dof", "serraria", "fabrica"] = "especie",
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
+    db: Session = Depends(get_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_user)
+):
+    """
+    Volume de madeira que virou produto acabado, por espécie, DOF,
+    serraria ou fábrica, a partir de linhagem_produtos. Cada usuário vê só
+    o que passou por ele. Aceita período (data de fabricação), espécie e
+    DOF; os demais filtros das listagens são ignorados.
+    """
+    return servicos.relatorio_volume(db, current_user, agrupar_por, filtros)
 
 # ===================================
 # ENDPOINT PÚBLICO - RASTREABILIDADE
 # ===================================
 
-@app.get("/rastrear/{id_produto_custom}")
-def rastrear_produto(id_produto_custom: str, db: Session = Depends(get_db)):
+@app.get("/rastrear/{id_produto_custom}", response_model=schemas.RastreioDisplay, response_model_exclude_unset=True)
+def rastrear_produto(
+    id_produto_custom: str,
+    incluir_prova: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
     """
     Endpoint PÚBLICO para rastrear um produto.
     Retorna toda a cadeia: Produto → Serrado → Tora.
+    A resposta sem prova vem do cache e leva ETag/Cache-Control (304 se o
+    cliente enviar If-None-Match com a versão atual).
+    Com incluir_prova=true, inclui a situação da ancoragem de cada lote e,
+    no modo merkle, a prova de inclusão para verificação independente.
     """
-    # Buscar produto
-    produto = db.query(models.LoteProdutoAcabado).filter(
-        models.LoteProdutoAcabado.id_lote_produto_custom == id_produto_custom
-    ).first()
-    
-    if not produto:
-        raise HTTPException(status_code=404, detail="Produto não encontrado")
-    
-    # Buscar lote serrado
-    lote_serrado = db.query(models.LoteSerrado).filter(
-        models.LoteSerrado.id == produto.id_lote_serrado_origem
-    ).first()
-    
-    # Buscar lote de tora
-    lote_tora = None
-    if lote_serrado:
-        lote_tora = db.query(models.LoteTora).filter(
-            models.LoteTora.id == lote_serrado.id_lote_tora_origem
-        ).first()
-    
-    return {
-        "produto": {
-            "id": produto.id,
-            "id_custom": produto.id_lote_produto_custom,
-            "nome": produto.nome_produto,
-            "sku": produto.sku_produto,
-            "data_fabricacao": produto.data_fabricacao.isoformat(),
-            "dados_acabamento": produto.dados_acabamento
-        },
-        "lote_serrado": {
-            "id": lote_serrado.id,
-            "id_custom": lote_serrado.id_lote_serrado_custom,
-            "tipo_produto": lote_serrado.tipo_produto,
-            "dimensoes": lote_serrado.dimensoes,
-            "volume_m3": float(lote_serrado.volume_saida_m3),
-            "data_processamento": lote_serrado.data_processamento.isoformat()
-        } if lote_serrado else None,
-        "lote_tora": {
-            "id": lote_tora.id,
-            "id_custom": lote_tora.id_lote_custom,
-            "especie_popular": lote_tora.especie_madeira_popular,
-            "especie_cientifica": lote_tora.especie_madeira_cientifico,
-            "volume_m3": float(lote_tora.volume_estimado_m3),
-            "numero_dof": lote_tora.numero_dof,
-            "numero_licenca": lote_tora.numero_licenca_ambiental,
-            "coordenadas": {
-                "lat": float(lote_tora.coordenadas_gps_lat),
-                "lon": float(lote_tora.coordenadas_gps_lon)
-            },
-            "data_registro": lote_tora.data_hora_registro.isoformat()
-        } if lote_tora else None
-    }
+    if incluir_prova:
+        return servicos.rastrear_produto(db, id_produto_custom, incluir_prova)
+    entrada = servicos.rastrear_produto_cacheado(db, id_produto_custom)
+    return servicos.resposta_rastreio(entrada, if_none_match)
+
+
+@app.get("/verificar/{tipo_lote}/{id_lote_custom}", response_model=schemas.VerificacaoBlockchain)
+def verificar_registro_blockchain(
+    tipo_lote: Literal["tora", "serrado", "produto"],
+    id_lote_custom: str,
+    db: Session = Depends(get_db)
+):
+    """
+    Endpoint PÚBLICO: o lote está registrado no contrato? Responde pelo
+    índice local de eventos (indexador.py), sem consultar a rede.
+    """
+    return servicos.verificar_registro(db, tipo_lote, id_lote_custom)
 
 
 # ===================================
@@ -615,10 +480,22 @@ def health_check():
     return {
         "status": "healthy",
         "version": "3.0.0",
-        "blockchain_enabled": BLOCKCHAIN_ENABLED
+        "blockchain_enabled": BLOCKCHAIN_ENABLED,
+        "blockchain_conexao": blockchain.monitor_conexao.estado() if BLOCKCHAIN_ENABLED else None,
+        "gas": blockchain.oraculo_gas.estatisticas() if BLOCKCHAIN_ENABLED else None,
+        "rpc": blockchain.estado_rpc() if BLOCKCHAIN_ENABLED else None
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Métricas no formato do Prometheus (latência por rota, banco e RPC por
+    requisição, pool de conexões, cache de gas...).
+    """
+    return PlainTextResponse(metricas.exportar(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 def root():
     """
@@ -629,4 +506,26 @@ def root():
         "version": "3.0.0",
         "blockchain": "enabled" if BLOCKCHAIN_ENABLED else "disabled",
         "docs": "/docs"
-    }
\ No newline at end of file
+    }
+
+
+# ===================================
+# CAMINHO ASSÍNCRONO (DB_ASYNC=true)
+# ===================================
+
+if DB_ASYNC:
+    # As rotas de rotas_async substituem as síncronas de mesmo caminho/método.
+    # Com DB_ASYNC=false (padrão) tudo continua no caminho síncrono.
+    import rotas_async
+    
+    substituidas = {
+        (rota.path, metodo)
+        for rota in rotas_async.router.routes
+        for metodo in rota.methods
+    }
+    app.router.routes = [
+        rota for rota in app.router.routes
+        if not (isinstance(rota, APIRoute) and any((rota.path, m) in substituidas for m in rota.methods))
+    ]
+    app.include_router(rotas_async.router)
+    log.info("✅ Rotas assíncronas (AsyncSession/asyncpg) ativadas")
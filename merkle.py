@@ -0,0 +1,61 @@
+"""
+merkle.py - Árvore de Merkle para ancoragem de lotes em grupo
+
+Cada folha é o keccak256 do JSON canônico do registro do lote (chaves
+ordenadas, sem espaços). Os pares são ordenados antes do hash, no mesmo
+formato do MerkleProof da OpenZeppelin, então a prova é só a lista de
+irmãos (sem bits de direção). Em níveis ímpares o último nó sobe sem hash.
+"""
+
+import json
+from typing import List, Tuple
+from eth_utils import keccak
+
+
+def serializar_registro(registro: dict) -> bytes:
+    """JSON canônico do registro: é exatamente o que vira a folha."""
+    return json.dumps(registro, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def hash_folha(registro: dict) -> bytes:
+    return keccak(serializar_registro(registro))
+
+
+def hash_par(a: bytes, b: bytes) -> bytes:
+    return keccak(a + b) if a <= b else keccak(b + a)
+
+
+def construir_arvore(folhas: List[bytes]) -> Tuple[bytes, List[List[bytes]]]:
+    """
+    Retorna a raiz e a prova de cada folha (na mesma ordem de entrada).
+    """
+    if not folhas:
+        raise ValueError("A árvore de Merkle precisa de pelo menos uma folha")
+
+    provas: List[List[bytes]] = [[] for _ in folhas]
+    posicoes = list(range(len(folhas)))  # posição de cada folha no nível atual
+    nivel = list(folhas)
+
+    while len(nivel) > 1:
+        for indice, posicao in enumerate(posicoes):
+            irmao = posicao ^ 1
+            if irmao < len(nivel):
+                provas[indice].append(nivel[irmao])
+            posicoes[indice] = posicao // 2
+
+        proximo = []
+        for i in range(0, len(nivel), 2):
+            if i + 1 < len(nivel):
+                proximo.append(hash_par(nivel[i], nivel[i + 1]))
+            else:
+                proximo.append(nivel[i])
+        nivel = proximo
+
+    return nivel[0], provas
+
+
+def verificar_prova(folha: bytes, prova: List[bytes], raiz: bytes) -> bool:
+    atual = folha
+    for irmao in prova:
+        atual = hash_par(atual, irmao)
+    return atual == raiz
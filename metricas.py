@@ -0,0 +1,147 @@
+"""
+metricas.py - Registro simples de métricas no formato texto do Prometheus
+
+Contadores, medidores e histogramas com rótulos, seguros entre threads.
+Qualquer métrica pode ser calculada na hora da coleta passando `funcao`
+(útil para estado que já existe em outro lugar, como o pool de conexões).
+Cada processo (worker) tem o seu registro; o /metrics expõe o do worker
+que atendeu a requisição.
+"""
+
+import math
+import threading
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Baldes padrão de latência (segundos)
+BALDES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registro = []
+_lock_registro = threading.Lock()
+
+
+def _formatar_valor(valor: float) -> str:
+    if math.isinf(valor):
+        return "+Inf" if valor > 0 else "-Inf"
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formatar_rotulos(nomes: Sequence[str], valores: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class Metrica:
+    tipo = "untyped"
+
+    def __init__(self, nome: str, descricao: str, rotulos: Sequence[str] = (), funcao: Optional[Callable] = None):
+        """
+        funcao: opcional, chamada na coleta. Retorna um número (métrica sem
+        rótulos) ou um dict {tupla_de_rotulos: número}.
+        """
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self.funcao = funcao
+        self._valores: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        with _lock_registro:
+            _registro.append(self)
+
+    def _chave(self, rotulos: dict) -> tuple:
+        return tuple(str(rotulos.get(nome, "")) for nome in self.rotulos)
+
+    def _amostras(self) -> Dict[tuple, float]:
+        if self.funcao is not None:
+            valor = self.funcao()
+            return valor if isinstance(valor, dict) else {(): valor}
+        with self._lock:
+            return dict(self._valores)
+
+    def exportar(self) -> list:
+        linhas = [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} {self.tipo}"]
+        for chave, valor in sorted(self._amostras().items()):
+            linhas.append(f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_valor(valor)}")
+        return linhas
+
+
+class Contador(Metrica):
+    tipo = "counter"
+
+    def inc(self, valor: float = 1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+
+class Medidor(Metrica):
+    tipo = "gauge"
+
+    def set(self, valor: float, **rotulos):
+        with self._lock:
+            self._valores[self._chave(rotulos)] = valor
+
+    def inc(self, valor: float = 1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def dec(self, valor: float = 1, **rotulos):
+        self.inc(-valor, **rotulos)
+
+
+class Histograma(Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome: str, descricao: str, rotulos: Sequence[str] = (), baldes: Sequence[float] = BALDES_LATENCIA):
+        super().__init__(nome, descricao, rotulos)
+        self.baldes = tuple(sorted(baldes))
+        # chave -> [contagens por balde..., soma, total]
+        self._series: Dict[tuple, list] = {}
+
+    def observar(self, valor: float, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [0] * len(self.baldes) + [0.0, 0]
+            for i, limite in enumerate(self.baldes):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exportar(self) -> list:
+        linhas = [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            series = {chave: list(serie) for chave, serie in self._series.items()}
+        for chave, serie in sorted(series.items()):
+            for limite, contagem in zip(self.baldes, serie):
+                rotulos = _formatar_rotulos(self.rotulos, chave, ("le", _formatar_valor(limite)))
+                linhas.append(f"{self.nome}_bucket{rotulos} {contagem}")
+            rotulos_inf = _formatar_rotulos(self.rotulos, chave, ("le", "+Inf"))
+            linhas.append(f"{self.nome}_bucket{rotulos_inf} {serie[-1]}")
+            rotulos = _formatar_rotulos(self.rotulos, chave)
+            linhas.append(f"{self.nome}_sum{rotulos} {_formatar_valor(serie[-2])}")
+            linhas.append(f"{self.nome}_count{rotulos} {serie[-1]}")
+        return linhas
+
+
+def exportar() -> str:
+    """Todas as métricas registradas, no formato de exposição do Prometheus."""
+    with _lock_registro:
+        metricas = list(_registro)
+    linhas = []
+    for metrica in metricas:
+        try:
+            linhas.extend(metrica.exportar())
+        except Exception as e:
+            linhas.append(f"# ERRO ao coletar {metrica.nome}: {e}")
+    return "\n".join(linhas) + "\n"
@@ -0,0 +1,164 @@
+"""
+migracoes.py - Atualização incremental do esquema do banco
+
+O esquema original foi criado à mão no Postgres. Este módulo cria apenas o
+que falta (tabelas, colunas e índices novos declarados em models.py), de
+forma idempotente, quando a API inicia.
+
+Migrações de dados (preencher/converter o que já existe) ficam registradas
+por nome com @migracao_dados e rodam uma única vez, na ordem de registro,
+depois do esquema; as aplicadas ficam em migracoes_aplicadas.
+"""
+
+import os
+from sqlalchemy import inspect, text, select, func
+from sqlalchemy.schema import CreateColumn
+
+import logs
+import linhagem
+import models  # Registra todos os modelos no Base.metadata
+from database import Base
+
+log = logs.obter_logger("migracoes")
+
+# Desative em ambientes onde o esquema é gerenciado externamente
+DB_AUTO_MIGRAR = os.getenv("DB_AUTO_MIGRAR", "true").lower() == "true"
+
+# Chave do advisory lock: evita que vários workers migrem ao mesmo tempo
+CHAVE_LOCK_MIGRACAO = 7262001
+
+# Migrações de dados, em ordem: (nome, função(conn))
+MIGRACOES_DADOS = []
+
+
+def migracao_dados(nome: str):
+    """Registra uma migração de dados; o nome não pode mudar depois de publicado."""
+    def registrar(funcao):
+        MIGRACOES_DADOS.append((nome, funcao))
+        return funcao
+    return registrar
+
+
+def aplicar_migracoes(engine):
+    """
+    Cria tabelas, colunas e índices que ainda não existem no banco.
+    Nunca remove nem altera o que já existe.
+    """
+    if not DB_AUTO_MIGRAR:
+        log.info("ℹ️ Migrações automáticas desativadas (DB_AUTO_MIGRAR=false)")
+        return
+
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {"chave": CHAVE_LOCK_MIGRACAO})
+
+        # 1. Tabelas novas (já com seus índices)
+        Base.metadata.create_all(bind=conn)
+
+        inspetor = inspect(conn)
+        for tabela in Base.metadata.sorted_tables:
+            # 2. Colunas novas em tabelas existentes
+            colunas_existentes = {c["name"] for c in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name not in colunas_existentes:
+                    definicao = CreateColumn(coluna).compile(dialect=conn.dialect)
+                    conn.execute(text(f"ALTER TABLE {tabela.name} ADD COLUMN {definicao}"))
+                    log.info("✅ Coluna %s.%s criada", tabela.name, coluna.name)
+
+            # 3. Índices novos em tabelas existentes
+            indices_existentes = {i["name"] for i in inspetor.get_indexes(tabela.name)}
+            for indice in tabela.indexes:
+                if indice.name not in indices_existentes:
+                    indice.create(bind=conn)
+                    log.info("✅ Índice %s criado", indice.name)
+
+        # 4. Migrações de dados ainda não aplicadas
+        tabela_controle = models.MigracaoAplicada.__table__
+        aplicadas = set(conn.execute(select(tabela_controle.c.nome)).scalars())
+        for nome, funcao in MIGRACOES_DADOS:
+            if nome in aplicadas:
+                continue
+            funcao(conn)
+            conn.execute(tabela_controle.insert().values(nome=nome))
+            log.info("✅ Migração de dados %s aplicada", nome)
+
+# ===================================
+# MIGRAÇÕES DE DADOS
+# ===================================
+
+@migracao_dados("0001_semear_contadores_lote")
+def semear_contadores_lote(conn):
+    """
+    Inicializa contadores_lote com o maior número já usado em cada
+    prefixo/dia, para que os novos IDs continuem a sequência existente.
+    """
+    colunas = (
+        models.LoteTora.__table__.c.id_lote_custom,
+        models.LoteSerrado.__table__.c.id_lote_serrado_custom,
+        models.LoteProdutoAcabado.__table__.c.id_lote_produto_custom,
+    )
+    maiores = {}
+    for coluna in colunas:
+        for id_custom in conn.execute(select(coluna)).scalars():
+            partes = id_custom.split("-")
+            if len(partes) != 3 or not partes[2].isdigit():
+                continue  # fora do padrão PREFIXO-YYYYMMDD-NNN
+            chave = (partes[0], partes[1])
+            maiores[chave] = max(maiores.get(chave, 0), int(partes[2]))
+
+    tabela = models.ContadorLote.__table__
+    existentes = {
+        (linha.prefixo, linha.dia): linha.ultimo
+        for linha in conn.execute(select(tabela.c.prefixo, tabela.c.dia, tabela.c.ultimo))
+    }
+    for (prefixo, dia), ultimo in maiores.items():
+        if (prefixo, dia) not in existentes:
+            conn.execute(tabela.insert().values(prefixo=prefixo, dia=dia, ultimo=ultimo))
+        elif existentes[(prefixo, dia)] < ultimo:
+            conn.execute(
+                tabela.update()
+                .where(tabela.c.prefixo == prefixo, tabela.c.dia == dia)
+                .values(ultimo=ultimo)
+            )
+
+
+@migracao_dados("0002_preencher_volume_processado")
+def preencher_volume_processado(conn):
+    """Calcula volume_processado_m3 das toras a partir dos lotes serrados existentes."""
+    tora = models.LoteTora.__table__
+    serrado = models.LoteSerrado.__table__
+    soma = (
+        select(func.coalesce(func.sum(serrado.c.volume_saida_m3), 0))
+        .where(serrado.c.id_lote_tora_origem == tora.c.id)
+        .scalar_subquery()
+    )
+    conn.execute(tora.update().values(volume_processado_m3=soma))
+
+
+@migracao_dados("0003_preencher_ancoragem_lotes")
+def preencher_ancoragem_lotes(conn):
+    """Copia a situação da fila_ancoragem para as colunas de ancoragem dos lotes existentes."""
+    fila = models.FilaAncoragem.__table__
+    colunas = {
+        "status_ancoragem": fila.c.status,
+        "tx_hash": fila.c.tx_hash,
+        "bloco_ancoragem": fila.c.bloco,
+        "tentativas_ancoragem": fila.c.tentativas,
+        "data_envio_ancoragem": fila.c.data_envio,
+        "data_confirmacao_ancoragem": fila.c.data_confirmacao,
+    }
+    for tipo_lote, modelo in (("tora", models.LoteTora), ("serrado", models.LoteSerrado), ("produto", models.LoteProdutoAcabado)):
+        lote = modelo.__table__
+        def da_fila(coluna):
+            return select(coluna).where(fila.c.tipo_lote == tipo_lote, fila.c.id_lote == lote.c.id).scalar_subquery()
+        tem_item = select(fila.c.id).where(fila.c.tipo_lote == tipo_lote, fila.c.id_lote == lote.c.id).exists()
+        conn.execute(
+            lote.update().where(tem_item).values({nome: da_fila(coluna) for nome, coluna in colunas.items()})
+        )
+
+
+@migracao_dados("0004_preencher_linhagem_produtos")
+def preencher_linhagem_produtos(conn):
+    """Cria a linha de linhagem_produtos de cada produto acabado existente (INSERT ... SELECT)."""
+    linhas = linhagem.inserir(conn)
+    log.info("ℹ️ linhagem_produtos: %s linhas preenchidas", linhas)
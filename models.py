@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, DECIMAL, ForeignKey, TEXT, func
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, DECIMAL, ForeignKey, TEXT, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from database import Base # Importa o 'Base' do nosso database.py
 
@@ -45,7 +45,20 @@ class EquipeFabrica(Base):
 
 # --- MODELOS DE LOTES (PRODUTOS) ---
 
-class LoteTora(Base):
+class AncoragemMixin:
+    """
+    Situação do registro do lote na blockchain. A fonte é a fila_ancoragem;
+    o despachante copia cada mudança para cá, para que listagens, /rastrear
+    e buscas por status não precisem da fila nem da rede.
+    """
+    status_ancoragem = Column(String, default="pendente", index=True) # pendente, agrupado, enviado, confirmado, falhou
+    tx_hash = Column(String)
+    bloco_ancoragem = Column(Integer)
+    tentativas_ancoragem = Column(Integer, nullable=False, default=0, server_default="0")
+    data_envio_ancoragem = Column(DateTime(timezone=True))
+    data_confirmacao_ancoragem = Column(DateTime(timezone=True))
+
+class LoteTora(AncoragemMixin, Base):
     __tablename__ = "lotes_tora"
     id = Column(Integer, primary_key=True, index=True)
     id_lote_custom = Column(String, unique=True, index=True, nullable=False)
@@ -58,13 +71,25 @@ class LoteTora(Base):
     especie_madeira_popular = Column(String)
     especie_madeira_cientifico = Column(String)
     volume_estimado_m3 = Column(DECIMAL(10, 2), nullable=False)
+    volume_processado_m3 = Column(DECIMAL(10, 2), nullable=False, default=0, server_default="0") # Soma dos lotes serrados
     fotos_evidencia = Column(TEXT) # No SQL, é TEXT[]
+    chave_idempotencia = Column(String) # Enviada pelo app na sincronização em lote
 
     # Relacionamentos
     tecnico = relationship("TecnicoCampo", back_populates="lotes_criados")
     lotes_serrados_gerados = relationship("LoteSerrado", back_populates="lote_tora_origem")
 
-class LoteSerrado(Base):
+    # Listagens paginadas por (data, id), com ou sem filtro
+    __table_args__ = (
+        Index("ix_lotes_tora_data_id", "data_hora_registro", "id"),
+        Index("ix_lotes_tora_tecnico_data_id", "id_tecnico_campo", "data_hora_registro", "id"),
+        Index("ix_lotes_tora_dof", "numero_dof"),
+        Index("ix_lotes_tora_especie_data_id", "especie_madeira_popular", "data_hora_registro", "id"),
+        # Reenvio da mesma sincronização não duplica lotes
+        Index("uq_lotes_tora_tecnico_chave", "id_tecnico_campo", "chave_idempotencia", unique=True),
+    )
+
+class LoteSerrado(AncoragemMixin, Base):
     __tablename__ = "lotes_serrada"
     id = Column(Integer, primary_key=True, index=True)
     id_lote_serrado_custom = Column(String, unique=True, index=True, nullable=False)
@@ -82,7 +107,13 @@ class LoteSerrado(Base):
     equipe_serraria = relationship("EquipeSerraria", back_populates="lotes_processados")
     produtos_acabados_gerados = relationship("LoteProdutoAcabado", back_populates="lote_serrado_origem")
 
-class LoteProdutoAcabado(Base):
+    __table_args__ = (
+        Index("ix_lotes_serrada_data_id", "data_processamento", "id"),
+        Index("ix_lotes_serrada_equipe_data_id", "id_equipe_serraria", "data_processamento", "id"),
+        Index("ix_lotes_serrada_tora_origem", "id_lote_tora_origem"),
+    )
+
+class LoteProdutoAcabado(AncoragemMixin, Base):
     __tablename__ = "lotes_produto_acabado"
     id = Column(Integer, primary_key=True, index=True)
     id_lote_produto_custom = Column(String, unique=True, index=True, nullable=False)
@@ -96,4 +127,179 @@ class LoteProdutoAcabado(Base):
 
     # Relacionamentos
     lote_serrado_origem = relationship("LoteSerrado", back_populates="produtos_acabados_gerados")
-    equipe_fabrica = relationship("EquipeFabrica", back_populates="produtos_fabricados")
\ No newline at end of file
+    equipe_fabrica = relationship("EquipeFabrica", back_populates="produtos_fabricados")
+
+    __table_args__ = (
+        Index("ix_lotes_produto_equipe_data_id", "id_equipe_fabrica", "data_fabricacao", "id"),
+        Index("ix_lotes_produto_serrado_origem", "id_lote_serrado_origem"),
+    )
+
+
+# --- MODELO DE LEITURA: LINHAGEM DESNORMALIZADA DOS PRODUTOS ---
+
+class LinhagemDesnormalizada(Base):
+    """
+    Uma linha por produto acabado com os campos do produto, do lote serrado
+    e da tora de origem (inclusive a situação da ancoragem de cada um).
+    Mantida por linhagem.py na mesma transação que altera os lotes; serve o
+    /rastrear e os relatórios sem JOINs.
+    """
+    __tablename__ = "linhagem_produtos"
+    id_produto = Column(Integer, ForeignKey("lotes_produto_acabado.id"), primary_key=True)
+    id_lote_produto_custom = Column(String, unique=True, index=True, nullable=False)
+    id_equipe_fabrica = Column(Integer, nullable=False, index=True)
+    sku_produto = Column(String, nullable=False)
+    nome_produto = Column(String, nullable=False)
+    data_fabricacao = Column(DateTime(timezone=True))
+    dados_acabamento = Column(TEXT)
+    status_ancoragem_produto = Column(String)
+    tx_hash_produto = Column(String)
+    bloco_ancoragem_produto = Column(Integer)
+    tentativas_ancoragem_produto = Column(Integer)
+    data_envio_ancoragem_produto = Column(DateTime(timezone=True))
+    data_confirmacao_ancoragem_produto = Column(DateTime(timezone=True))
+
+    # Lote serrado de origem
+    id_lote_serrado = Column(Integer, nullable=False, index=True)
+    id_lote_serrado_custom = Column(String, nullable=False)
+    id_equipe_serraria = Column(Integer, nullable=False, index=True)
+    tipo_produto = Column(String)
+    dimensoes = Column(String)
+    volume_saida_m3 = Column(DECIMAL(10, 2), nullable=False)
+    data_processamento = Column(DateTime(timezone=True))
+    status_ancoragem_serrado = Column(String)
+    tx_hash_serrado = Column(String)
+    bloco_ancoragem_serrado = Column(Integer)
+    tentativas_ancoragem_serrado = Column(Integer)
+    data_envio_ancoragem_serrado = Column(DateTime(timezone=True))
+    data_confirmacao_ancoragem_serrado = Column(DateTime(timezone=True))
+
+    # Tora de origem
+    id_lote_tora = Column(Integer, nullable=False, index=True)
+    id_lote_tora_custom = Column(String, nullable=False)
+    id_tecnico_campo = Column(Integer, nullable=False, index=True)
+    numero_dof = Column(String, nullable=False, index=True)
+    numero_licenca_ambiental = Column(String, nullable=False)
+    especie_madeira_popular = Column(String, index=True)
+    especie_madeira_cientifico = Column(String)
+    volume_estimado_m3 = Column(DECIMAL(10, 2), nullable=False)
+    coordenadas_gps_lat = Column(DECIMAL(10, 8), nullable=False)
+    coordenadas_gps_lon = Column(DECIMAL(11, 8), nullable=False)
+    data_hora_registro = Column(DateTime(timezone=True))
+    status_ancoragem_tora = Column(String)
+    tx_hash_tora = Column(String)
+    bloco_ancoragem_tora = Column(Integer)
+    tentativas_ancoragem_tora = Column(Integer)
+    data_envio_ancoragem_tora = Column(DateTime(timezone=True))
+    data_confirmacao_ancoragem_tora = Column(DateTime(timezone=True))
+
+    data_atualizacao = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+# --- FILA DE ANCORAGEM NA BLOCKCHAIN (OUTBOX) ---
+
+class FilaAncoragem(Base):
+    __tablename__ = "fila_ancoragem"
+    id = Column(Integer, primary_key=True, index=True)
+    tipo_lote = Column(String, nullable=False) # 'tora', 'serrado' ou 'produto'
+    id_lote = Column(Integer, nullable=False)
+    id_lote_custom = Column(String, nullable=False, index=True)
+    dados = Column(TEXT, nullable=False) # JSON com os argumentos do registro
+    modo = Column(String, nullable=False, server_default="direto") # 'direto' ou 'merkle'
+    status = Column(String, nullable=False, default="pendente") # pendente, agrupado, enviado, confirmado, falhou
+    tentativas = Column(Integer, nullable=False, default=0)
+    proxima_tentativa = Column(DateTime(timezone=True), nullable=False)
+    tx_hash = Column(String)
+    bloco = Column(Integer)
+    ultimo_erro = Column(TEXT)
+    data_criacao = Column(DateTime(timezone=True), server_default=func.now())
+    data_envio = Column(DateTime(timezone=True))
+    data_confirmacao = Column(DateTime(timezone=True))
+    id_requisicao = Column(String) # X-Request-ID de quem criou o lote (correlaciona os logs do envio)
+
+    # Modo merkle: grupo em que o lote foi ancorado e sua prova de inclusão
+    id_lote_merkle = Column(Integer, ForeignKey("lotes_merkle.id"), index=True)
+    folha_merkle = Column(String)
+    prova_merkle = Column(TEXT) # JSON: lista de hashes irmãos
+
+    lote_merkle = relationship("LoteMerkle", back_populates="itens")
+
+    __table_args__ = (
+        UniqueConstraint("tipo_lote", "id_lote", name="uq_fila_ancoragem_lote"),
+        # O despachante busca sempre por status + horário da próxima tentativa
+        Index("ix_fila_ancoragem_status_proxima", "status", "proxima_tentativa"),
+    )
+
+class LoteMerkle(Base):
+    __tablename__ = "lotes_merkle"
+    id = Column(Integer, primary_key=True, index=True)
+    raiz = Column(String, nullable=False, index=True)
+    quantidade = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="pendente") # pendente, enviado, confirmado, falhou
+    tentativas = Column(Integer, nullable=False, default=0)
+    proxima_tentativa = Column(DateTime(timezone=True), nullable=False)
+    tx_hash = Column(String)
+    bloco = Column(Integer)
+    ultimo_erro = Column(TEXT)
+    data_criacao = Column(DateTime(timezone=True), server_default=func.now())
+    data_envio = Column(DateTime(timezone=True))
+    data_confirmacao = Column(DateTime(timezone=True))
+
+    itens = relationship("FilaAncoragem", back_populates="lote_merkle")
+
+    __table_args__ = (
+        Index("ix_lotes_merkle_status_proxima", "status", "proxima_tentativa"),
+    )
+
+
+# --- CONTADORES DOS IDs CUSTOMIZADOS ---
+
+class ContadorLote(Base):
+    """Último número usado por prefixo e dia (TORA-20240101-NNN...)."""
+    __tablename__ = "contadores_lote"
+    prefixo = Column(String, primary_key=True) # 'TORA', 'SERR' ou 'PROD'
+    dia = Column(String, primary_key=True) # YYYYMMDD
+    ultimo = Column(Integer, nullable=False, default=0)
+
+
+# --- CONTROLE DE MIGRAÇÕES DE DADOS ---
+
+class MigracaoAplicada(Base):
+    __tablename__ = "migracoes_aplicadas"
+    nome = Column(String, primary_key=True)
+    data_aplicacao = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# --- ÍNDICE LOCAL DOS EVENTOS DO CONTRATO ---
+
+class EventoBlockchain(Base):
+    """Eventos *Registrado do contrato, espelhados pelo indexador.py."""
+    __tablename__ = "eventos_blockchain"
+    id = Column(Integer, primary_key=True, index=True)
+    tipo_lote = Column(String, nullable=False) # 'tora', 'serrado' ou 'produto'
+    # O ID do lote é um parâmetro 'indexed string': no log só vem o keccak dele
+    id_lote_hash = Column(String, nullable=False)
+    id_lote_custom = Column(String, index=True) # preenchido quando a transação é nossa (fila_ancoragem)
+    id_lote_origem = Column(String) # tora de origem (serrado) ou lote serrado de origem (produto)
+    volume_m3 = Column(DECIMAL(10, 2))
+    responsavel = Column(String) # endereço que registrou
+    timestamp_bloco = Column(Integer)
+    bloco = Column(Integer, nullable=False)
+    hash_bloco = Column(String, nullable=False)
+    tx_hash = Column(String, nullable=False)
+    indice_log = Column(Integer, nullable=False)
+    data_indexacao = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("tx_hash", "indice_log", name="uq_eventos_blockchain_log"),
+        Index("ix_eventos_blockchain_tipo_hash", "tipo_lote", "id_lote_hash"),
+        Index("ix_eventos_blockchain_bloco", "bloco"),
+    )
+
+class CheckpointIndexador(Base):
+    """Último bloco já indexado (e seu hash, para detectar reorganizações)."""
+    __tablename__ = "checkpoints_indexador"
+    nome = Column(String, primary_key=True)
+    ultimo_bloco = Column(Integer, nullable=False)
+    hash_ultimo_bloco = Column(String)
+    data_atualizacao = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
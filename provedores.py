@@ -0,0 +1,221 @@
+"""
+provedores.py - Provedor JSON-RPC com vários endpoints e failover
+
+Substitui o Web3.HTTPProvider único do blockchain.py:
+
+- Cada endpoint tem a sua sessão HTTP persistente (pool de conexões
+  keep-alive) e timeout por chamada (RPC_TIMEOUT_S).
+- As chamadas vão para o endpoint mais saudável: menor latência média,
+  penalizada pela taxa de erro recente (médias móveis exponenciais).
+- Timeout, erro de conexão, HTTP 5xx ou limite de requisições (HTTP 429 /
+  erro -32005) passam a chamada para o próximo endpoint e suspendem o que
+  falhou por um tempo que dobra a cada falha seguida (RPC_BACKOFF_*).
+  Se todos estiverem suspensos, tenta mesmo assim, do que volta primeiro.
+- Erros do próprio JSON-RPC (revert, nonce, etc.) são respostas válidas
+  e voltam para quem chamou, sem failover.
+- Suporta requisições em lote (w3.batch_requests()).
+
+Endpoints em ETHEREUM_RPC_URLS (separados por vírgula, em ordem de
+preferência); sem ela, usa INFURA_SEPOLIA_URL.
+"""
+
+import os
+import time
+import threading
+from typing import Any, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3.providers import JSONBaseProvider
+from web3.providers.rpc import HTTPProvider
+
+import logs
+import metricas
+
+log = logs.obter_logger("provedores")
+
+# ===================================
+# CONFIGURAÇÃO
+# ===================================
+
+RPC_TIMEOUT_S = float(os.getenv("RPC_TIMEOUT_S", "10"))
+RPC_BACKOFF_BASE_S = float(os.getenv("RPC_BACKOFF_BASE_S", "1"))
+RPC_BACKOFF_MAX_S = float(os.getenv("RPC_BACKOFF_MAX_S", "60"))
+
+# Conexões keep-alive por endpoint (workers, despachante e reconciliação compartilham)
+RPC_CONEXOES_POR_ENDPOINT = int(os.getenv("RPC_CONEXOES_POR_ENDPOINT", "20"))
+
+# Peso das observações novas nas médias móveis de latência e erro
+PESO_MEDIA = 0.2
+
+# Códigos/mensagens de erro JSON-RPC que significam "limite de requisições"
+CODIGOS_LIMITE = (-32005, 429)
+MENSAGENS_LIMITE = ("rate limit", "too many requests", "request limit")
+
+# ===================================
+# MÉTRICAS
+# ===================================
+
+latencia_rpc = metricas.Histograma(
+    "rpc_latencia_segundos",
+    "Latência das chamadas JSON-RPC por endpoint",
+    rotulos=("endpoint",),
+)
+erros_rpc = metricas.Contador(
+    "rpc_erros_total",
+    "Falhas de chamadas JSON-RPC por endpoint (timeout, conexao, limite, http)",
+    rotulos=("endpoint", "tipo"),
+)
+
+
+class ErroLimiteRPC(Exception):
+    """O endpoint recusou a chamada por limite de requisições."""
+
+
+def _nome_endpoint(url: str, indice: int) -> str:
+    """Rótulo seguro para métricas/logs: só o host (a URL costuma ter a chave de API)."""
+    return f"{indice}:{urlparse(url).hostname or 'desconhecido'}"
+
+
+def _resposta_de_limite(resposta) -> bool:
+    """Resposta JSON-RPC (ou lote) com erro de limite de requisições."""
+    respostas = resposta if isinstance(resposta, list) else [resposta]
+    for item in respostas:
+        erro = item.get("error") if isinstance(item, dict) else None
+        if not isinstance(erro, dict):
+            continue
+        mensagem = str(erro.get("message", "")).lower()
+        if erro.get("code") in CODIGOS_LIMITE or any(trecho in mensagem for trecho in MENSAGENS_LIMITE):
+            return True
+    return False
+
+
+class EndpointRPC:
+    """Um endpoint com sessão HTTP própria e estado de saúde."""
+
+    def __init__(self, url: str, indice: int, timeout_s: float = RPC_TIMEOUT_S):
+        self.nome = _nome_endpoint(url, indice)
+        sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=RPC_CONEXOES_POR_ENDPOINT)
+        sessao.mount("http://", adaptador)
+        sessao.mount("https://", adaptador)
+        # Sem retentativa interna do web3: o failover decide o que fazer
+        self.provider = HTTPProvider(
+            url, request_kwargs={"timeout": timeout_s}, session=sessao, exception_retry_configuration=None
+        )
+        self._lock = threading.Lock()
+        self.latencia_media: Optional[float] = None
+        self.taxa_erro = 0.0
+        self.falhas_seguidas = 0
+        self.suspenso_ate = 0.0
+
+    def pontuacao(self) -> float:
+        """Menor é melhor. Endpoint ainda sem medições vai na frente."""
+        with self._lock:
+            if self.latencia_media is None:
+                return 0.0
+            return self.latencia_media * (1 + 10 * self.taxa_erro)
+
+    def disponivel(self, agora: float) -> bool:
+        return self.suspenso_ate <= agora
+
+    def _media_latencia(self, duracao: float):
+        self.latencia_media = duracao if self.latencia_media is None else \
+            (1 - PESO_MEDIA) * self.latencia_media + PESO_MEDIA * duracao
+
+    def registrar_sucesso(self, duracao: float):
+        latencia_rpc.observar(duracao, endpoint=self.nome)
+        with self._lock:
+            self._media_latencia(duracao)
+            self.taxa_erro *= (1 - PESO_MEDIA)
+            self.falhas_seguidas = 0
+            self.suspenso_ate = 0.0
+
+    def registrar_falha(self, tipo: str, duracao: float):
+        latencia_rpc.observar(duracao, endpoint=self.nome)
+        erros_rpc.inc(endpoint=self.nome, tipo=tipo)
+        with self._lock:
+            self._media_latencia(duracao)
+            self.taxa_erro = (1 - PESO_MEDIA) * self.taxa_erro + PESO_MEDIA
+            self.falhas_seguidas += 1
+            atraso = min(RPC_BACKOFF_BASE_S * (2 ** (self.falhas_seguidas - 1)), RPC_BACKOFF_MAX_S)
+            self.suspenso_ate = time.monotonic() + atraso
+        log.warning("⚠️ RPC %s: falha (%s); suspenso por %.1fs", self.nome, tipo, atraso)
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {
+                "endpoint": self.nome,
+                "latencia_media_ms": round(self.latencia_media * 1000, 1) if self.latencia_media is not None else None,
+                "taxa_erro": round(self.taxa_erro, 3),
+                "falhas_seguidas": self.falhas_seguidas,
+                "suspenso_por_s": round(max(self.suspenso_ate - time.monotonic(), 0), 1),
+            }
+
+
+class ProvedorFailover(JSONBaseProvider):
+    """Provedor web3 que distribui as chamadas entre vários EndpointRPC."""
+
+    def __init__(self, urls: List[str], timeout_s: float = RPC_TIMEOUT_S, **kwargs: Any):
+        super().__init__(**kwargs)
+        if not urls:
+            raise ValueError("Nenhum endpoint RPC configurado")
+        self.endpoints = [EndpointRPC(url, indice, timeout_s) for indice, url in enumerate(urls)]
+
+    def __str__(self) -> str:
+        return f"Failover RPC ({', '.join(e.nome for e in self.endpoints)})"
+
+    def _ordem(self) -> List[EndpointRPC]:
+        """Disponíveis do mais saudável ao menos; suspensos no fim, do que volta primeiro."""
+        agora = time.monotonic()
+        disponiveis = sorted((e for e in self.endpoints if e.disponivel(agora)), key=EndpointRPC.pontuacao)
+        suspensos = sorted((e for e in self.endpoints if not e.disponivel(agora)), key=lambda e: e.suspenso_ate)
+        return disponiveis + suspensos
+
+    def _chamar(self, funcao_do_endpoint):
+        ultimo_erro: Optional[Exception] = None
+        for endpoint in self._ordem():
+            inicio = time.perf_counter()
+            try:
+                resposta = funcao_do_endpoint(endpoint.provider)
+                if _resposta_de_limite(resposta):
+                    raise ErroLimiteRPC(f"{endpoint.nome}: limite de requisições")
+            except requests.Timeout as e:
+                endpoint.registrar_falha("timeout", time.perf_counter() - inicio)
+                ultimo_erro = e
+            except requests.ConnectionError as e:
+                endpoint.registrar_falha("conexao", time.perf_counter() - inicio)
+                ultimo_erro = e
+            except ErroLimiteRPC as e:
+                endpoint.registrar_falha("limite", time.perf_counter() - inicio)
+                ultimo_erro = e
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                endpoint.registrar_falha("limite" if status == 429 else "http", time.perf_counter() - inicio)
+                ultimo_erro = e
+            else:
+                endpoint.registrar_sucesso(time.perf_counter() - inicio)
+                return resposta
+        raise ultimo_erro
+
+    def make_request(self, method, params):
+        return self._chamar(lambda provider: provider.make_request(method, params))
+
+    def make_batch_request(self, batch_requests):
+        return self._chamar(lambda provider: provider.make_batch_request(batch_requests))
+
+    def estado(self) -> list:
+        return [endpoint.estado() for endpoint in self.endpoints]
+
+
+def urls_configuradas() -> List[str]:
+    """ETHEREUM_RPC_URLS (vírgulas) ou, na falta dela, INFURA_SEPOLIA_URL."""
+    urls = [url.strip() for url in os.getenv("ETHEREUM_RPC_URLS", "").split(",") if url.strip()]
+    if not urls:
+        urls = [os.getenv("INFURA_SEPOLIA_URL", "https://sepolia.infura.io/v3/SEU_PROJECT_ID")]
+    return urls
+
+
+def criar_provedor(urls: Optional[List[str]] = None) -> ProvedorFailover:
+    return ProvedorFailover(urls or urls_configuradas())
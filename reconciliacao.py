@@ -0,0 +1,249 @@
+"""
+reconciliacao.py - Conferência banco x blockchain
+
+Percorre todos os lotes (tora, serrado, produto) em páginas por id e
+confere se cada um está registrado no contrato. Lotes ausentes voltam para
+a fila de ancoragem e o resultado vai para um relatório JSON.
+
+Para cada página de lotes:
+    1. busca os itens da fila_ancoragem numa consulta: itens em andamento
+       (pendente/agrupado/enviado) e lotes ancorados por raiz Merkle não
+       são conferidos no contrato (o contrato não conhece esses registros)
+    2. consulta o índice local de eventos (indexador.py) numa consulta
+    3. só o que sobrou vai para a rede: chamadas *Existe em paralelo,
+       com no máximo RECONCILIACAO_CONCORRENCIA ao mesmo tempo
+
+Uso (na raiz do projeto):
+
+    python reconciliacao.py [--tipos tora,serrado,produto] [--simular]
+                            [--concorrencia 16] [--relatorio arquivo.json]
+
+Com --simular nada é reenfileirado; o relatório mostra o que seria feito.
+"""
+
+import os
+import json
+import time
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from sqlalchemy import select
+
+import logs
+import models
+import ancoragem
+import indexador
+import servicos
+from database import SessionLocal
+
+log = logs.obter_logger("reconciliacao")
+
+# ===================================
+# CONFIGURAÇÃO
+# ===================================
+
+# Lotes lidos do banco por página
+PAGINA = int(os.getenv("RECONCILIACAO_PAGINA", "1000"))
+
+# Chamadas eth_call simultâneas (respeite o limite de requisições do provedor)
+CONCORRENCIA = int(os.getenv("RECONCILIACAO_CONCORRENCIA", "16"))
+
+# Função de existência do contrato por tipo de lote
+FUNCOES_EXISTE = {
+    "tora": "lotesToraExiste",
+    "serrado": "loteSerradoExiste",
+    "produto": "produtoExiste",
+}
+
+STATUS_EM_ANDAMENTO = (ancoragem.STATUS_PENDENTE, ancoragem.STATUS_AGRUPADO, ancoragem.STATUS_ENVIADO)
+
+
+def _consulta_pagina(tipo_lote: str, ultimo_id: int):
+    """Próxima página de (lote, id customizado, id customizado da origem)."""
+    T, S, P = models.LoteTora, models.LoteSerrado, models.LoteProdutoAcabado
+    if tipo_lote == "tora":
+        consulta = select(T, T.id_lote_custom, T.id_lote_custom)
+        modelo = T
+    elif tipo_lote == "serrado":
+        consulta = select(S, S.id_lote_serrado_custom, T.id_lote_custom).join(T, T.id == S.id_lote_tora_origem)
+        modelo = S
+    else:
+        consulta = select(P, P.id_lote_produto_custom, S.id_lote_serrado_custom).join(S, S.id == P.id_lote_serrado_origem)
+        modelo = P
+    return consulta.where(modelo.id > ultimo_id).order_by(modelo.id).limit(PAGINA)
+
+
+def _registro(tipo_lote: str, lote, id_custom: str, id_origem: str) -> dict:
+    """Mesmos dados que os endpoints enfileiram ao criar o lote."""
+    if tipo_lote == "tora":
+        return servicos._registro_tora(id_custom, lote)
+    if tipo_lote == "serrado":
+        return servicos._registro_serrado(id_custom, lote, id_origem)
+    return servicos._registro_produto(id_custom, lote, id_origem)
+
+
+class Reconciliacao:
+    def __init__(self, contrato, session_factory=SessionLocal, concorrencia: int = CONCORRENCIA, simular: bool = False):
+        self.contrato = contrato
+        self.session_factory = session_factory
+        self.concorrencia = concorrencia
+        self.simular = simular
+        self.ausentes = []
+        self.resumo = {}
+
+    def _existe_na_rede(self, tipo_lote: str, id_custom: str) -> Optional[bool]:
+        """True/False segundo o contrato; None se a chamada falhou."""
+        try:
+            return bool(getattr(self.contrato.functions, FUNCOES_EXISTE[tipo_lote])(id_custom).call())
+        except Exception as e:
+            log.warning("⚠️ Reconciliação: erro ao consultar %s na blockchain: %s", id_custom, e)
+            return None
+
+    def _reenfileirar(self, db, tipo_lote: str, lote, id_custom: str, id_origem: str, item) -> str:
+        if item is None:
+            ancoragem.enfileirar(db, tipo_lote, lote.id, id_custom, _registro(tipo_lote, lote, id_custom, id_origem))
+            return "enfileirado"
+        # Item falhou (ou foi confirmado e sumiu da cadeia): volta para o início do ciclo
+        item.modo = ancoragem.MODO_MERKLE if ancoragem.MODO == ancoragem.MODO_MERKLE else ancoragem.MODO_DIRETO
+        item.status = ancoragem.STATUS_PENDENTE
+        item.tentativas = 0
+        item.proxima_tentativa = ancoragem._agora()
+        item.tx_hash = None
+        item.bloco = None
+        item.id_lote_merkle = None
+        item.folha_merkle = None
+        item.prova_merkle = None
+        item.ultimo_erro = "Reenfileirado pela reconciliação: ausente na blockchain"
+        return "reenfileirado"
+
+    def reconciliar_tipo(self, tipo_lote: str, executor: ThreadPoolExecutor):
+        contagem = dict.fromkeys(
+            ("verificados", "registrados", "em_andamento", "merkle", "ausentes", "reenfileirados", "erros"), 0
+        )
+        self.resumo[tipo_lote] = contagem
+        ultimo_id = 0
+
+        while True:
+            db = self.session_factory()
+            try:
+                linhas = db.execute(_consulta_pagina(tipo_lote, ultimo_id)).all()
+                if not linhas:
+                    break
+                ultimo_id = linhas[-1][0].id
+
+                itens = {
+                    item.id_lote: item
+                    for item in db.query(models.FilaAncoragem).filter(
+                        models.FilaAncoragem.tipo_lote == tipo_lote,
+                        models.FilaAncoragem.id_lote.in_([lote.id for lote, _, _ in linhas]),
+                    )
+                }
+                hashes = {indexador.hash_id_lote(id_custom): id_custom for _, id_custom, _ in linhas}
+                indexados = {
+                    hashes[id_hash] for (id_hash,) in db.query(models.EventoBlockchain.id_lote_hash).filter(
+                        models.EventoBlockchain.tipo_lote == tipo_lote,
+                        models.EventoBlockchain.id_lote_hash.in_(list(hashes)),
+                    )
+                }
+
+                conferir = []
+                for lote, id_custom, id_origem in linhas:
+                    contagem["verificados"] += 1
+                    item = itens.get(lote.id)
+                    if item is not None and item.status in STATUS_EM_ANDAMENTO:
+                        contagem["em_andamento"] += 1
+                    elif item is not None and item.modo == ancoragem.MODO_MERKLE and item.status == ancoragem.STATUS_CONFIRMADO:
+                        contagem["merkle"] += 1
+                    elif id_custom in indexados:
+                        contagem["registrados"] += 1
+                    else:
+                        conferir.append((lote, id_custom, id_origem, item))
+
+                existentes = executor.map(lambda linha: self._existe_na_rede(tipo_lote, linha[1]), conferir)
+                for (lote, id_custom, id_origem, item), existe in zip(conferir, existentes):
+                    if existe is None:
+                        contagem["erros"] += 1
+                        continue
+                    if existe:
+                        contagem["registrados"] += 1
+                        continue
+                    contagem["ausentes"] += 1
+                    status_fila = item.status if item is not None else None
+                    acao = "nenhuma (simulação)"
+                    if not self.simular:
+                        acao = self._reenfileirar(db, tipo_lote, lote, id_custom, id_origem, item)
+                        ancoragem.refletir_nos_lotes(db, [(tipo_lote, lote.id)], {
+                            "status_ancoragem": ancoragem.STATUS_PENDENTE, "tx_hash": None, "bloco_ancoragem": None,
+                            "tentativas_ancoragem": 0, "data_envio_ancoragem": None, "data_confirmacao_ancoragem": None,
+                        })
+                        contagem["reenfileirados"] += 1
+                    self.ausentes.append({
+                        "tipo_lote": tipo_lote,
+                        "id_lote": lote.id,
+                        "id_lote_custom": id_custom,
+                        "status_fila": status_fila,
+                        "acao": acao,
+                    })
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+            log.info("ℹ️ Reconciliação %s: %s verificados, %s ausentes", tipo_lote, contagem['verificados'], contagem['ausentes'])
+
+    def executar(self, tipos) -> dict:
+        inicio = time.monotonic()
+        iniciado_em = datetime.datetime.now(datetime.timezone.utc)
+        with ThreadPoolExecutor(max_workers=self.concorrencia, thread_name_prefix="reconciliacao") as executor:
+            for tipo_lote in tipos:
+                self.reconciliar_tipo(tipo_lote, executor)
+        return {
+            "iniciado_em": iniciado_em.isoformat(),
+            "duracao_s": round(time.monotonic() - inicio, 3),
+            "simulacao": self.simular,
+            "concorrencia": self.concorrencia,
+            "por_tipo": self.resumo,
+            "ausentes": self.ausentes,
+        }
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tipos", default="tora,serrado,produto")
+    parser.add_argument("--simular", action="store_true", help="Não reenfileira, só relata")
+    parser.add_argument("--concorrencia", type=int, default=CONCORRENCIA)
+    parser.add_argument("--relatorio", default=None, help="Arquivo JSON (padrão: reconciliacao_<data>.json)")
+    return parser.parse_args()
+
+
+def main():
+    args = _argumentos()
+    tipos = [tipo.strip() for tipo in args.tipos.split(",") if tipo.strip()]
+    invalidos = [tipo for tipo in tipos if tipo not in FUNCOES_EXISTE]
+    if invalidos:
+        raise SystemExit(f"Tipos inválidos: {', '.join(invalidos)}")
+
+    import blockchain
+    contrato = blockchain.obter_contrato()
+    if contrato is None:
+        raise SystemExit("❌ Contrato não configurado (CONTRACT_ADDRESS e contract_abi.json)")
+    if not blockchain.disponivel():
+        raise SystemExit(f"❌ RPC indisponível: {blockchain.monitor_conexao.ultimo_erro}")
+
+    # Itens reenfileirados guardam este id: os logs do reenvio apontam para esta execução
+    with logs.contexto_requisicao(f"reconciliacao-{datetime.datetime.now():%Y%m%d%H%M%S}"):
+        relatorio = Reconciliacao(contrato, concorrencia=args.concorrencia, simular=args.simular).executar(tipos)
+    arquivo = args.relatorio or f"reconciliacao_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(arquivo, "w", encoding="utf-8") as saida:
+        json.dump(relatorio, saida, ensure_ascii=False, indent=2)
+
+    total_ausentes = sum(c["ausentes"] for c in relatorio["por_tipo"].values())
+    log.info("✅ Reconciliação concluída em %ss: %s ausentes. Relatório: %s", relatorio['duracao_s'], total_ausentes, arquivo)
+
+
+if __name__ == "__main__":
+    main()
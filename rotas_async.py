@@ -0,0 +1,282 @@
+"""
+rotas_async.py - Versão assíncrona das rotas de autenticação e de lotes
+
+Ativada com DB_ASYNC=true (ver main.py). Usa AsyncSession (asyncpg), então
+as requisições não ocupam uma thread do pool do anyio durante o acesso ao
+banco. As regras de negócio são as mesmas do caminho síncrono: cada
+endpoint executa a função de servicos.py com AsyncSession.run_sync.
+
+Trabalho de CPU (bcrypt) roda fora do event loop, no pool dedicado de auth.py.
+"""
+
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Form, Header, Query, Response
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db
+import schemas
+import servicos
+import auth
+
+router = APIRouter()
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+# ===================================
+# DEPENDÊNCIAS DE SEGURANÇA
+# ===================================
+
+async def _autenticar(token: str, db: AsyncSession, papel: Optional[str] = None):
+    # Token em cache: resolve sem sair do event loop
+    user = servicos.principal_em_cache(token)
+    if user is None:
+        user = await db.run_sync(servicos.autenticar, token, papel)
+    return user
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> schemas.UsuarioAutenticado:
+    """
+    Decodifica o token e retorna o usuário de QUALQUER tabela
+    (Técnico, Serraria ou Fábrica).
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Não foi possível validar as credenciais",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    user = await _autenticar(token, db)
+    if user is None:
+        raise credentials_exception
+    return user
+
+
+async def _usuario_do_papel(token: str, db: AsyncSession, papel: str, detail: str) -> schemas.UsuarioAutenticado:
+    user = await _autenticar(token, db, papel)
+    if user is None or user.role != papel:
+        raise HTTPException(status_code=401, detail=detail)
+    return user
+
+
+async def get_current_tecnico(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> schemas.UsuarioAutenticado:
+    return await _usuario_do_papel(
+        token, db, "tecnico",
+        "Não autorizado: Apenas Técnicos de Campo podem acessar esta rota."
+    )
+
+
+async def get_current_serraria(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> schemas.UsuarioAutenticado:
+    return await _usuario_do_papel(
+        token, db, "serraria",
+        "Não autorizado: Apenas a Equipe da Serraria pode acessar esta rota."
+    )
+
+
+async def get_current_fabrica(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> schemas.UsuarioAutenticado:
+    return await _usuario_do_papel(
+        token, db, "fabrica",
+        "Não autorizado: Apenas a Equipe da Fábrica pode acessar esta rota."
+    )
+
+# ===================================
+# ENDPOINTS - AUTENTICAÇÃO
+# ===================================
+
+@router.post("/token", response_model=schemas.Token)
+async def login_for_access_token(
+    username: str = Form(...),
+    password: str = Form(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    conta = await db.run_sync(servicos.buscar_conta_login, username)
+    try:
+        senha_ok, novo_hash = await auth.verificar_senha_login_async(password, conta.hash_senha if conta else None)
+    except auth.FilaSenhasCheia:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Muitos logins simultâneos, tente novamente",
+            headers={"Retry-After": "1"},
+        )
+
+    if not senha_ok:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Email ou senha incorretos",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if novo_hash:
+        await db.run_sync(servicos.atualizar_hash_senha, conta.papel, conta.id, novo_hash)
+
+    user = schemas.UsuarioAutenticado(id=conta.id, email=conta.email, role=conta.papel)
+    access_token = servicos.criar_token_usuario(user)
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+@router.get("/users/me", response_model=schemas.UserDisplay)
+async def read_users_me(current_user = Depends(get_current_user)):
+    role = servicos.papel_do_usuario(current_user)
+    return {"id": current_user.id, "email": current_user.email, "role": role}
+
+# ===================================
+# ENDPOINTS - LOTES
+# ===================================
+
+@router.post("/lotes_tora/", response_model=schemas.LoteToraDisplay, status_code=status.HTTP_201_CREATED)
+async def create_lote_tora(
+    lote: schemas.LoteToraCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_tecnico)
+):
+    return await db.run_sync(servicos.criar_lote_tora, lote, current_user.id)
+
+
+@router.post("/lotes_tora/em_lote", response_model=schemas.LotesToraEmLoteResultado)
+async def create_lotes_tora_em_lote(
+    envio: schemas.LotesToraEmLoteCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_tecnico)
+):
+    return await db.run_sync(servicos.criar_lotes_tora_em_lote, envio.itens, current_user.id)
+
+
+@router.get("/lotes_tora/", response_model=List[schemas.LoteToraDisplay])
+async def listar_lotes_tora(
+    response: Response,
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_current_user)
+):
+    itens, proximo = await db.run_sync(servicos.listar_lotes_tora, current_user, filtros)
+    return servicos.com_cursor(response, itens, proximo)
+
+
+@router.get("/lotes_tora/volume_disponivel", response_model=List[schemas.VolumeDisponivel])
+async def volume_disponivel_lotes_tora(
+    ids: List[int] = Query(..., min_length=1, max_length=500),
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_current_user)
+):
+    return await db.run_sync(servicos.volumes_disponiveis, ids, current_user)
+
+
+@router.get("/lotes_tora/{lote_id}", response_model=schemas.LoteToraDisplay)
+async def obter_lote_tora(
+    lote_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_current_user)
+):
+    return await db.run_sync(servicos.obter_lote_tora, lote_id, current_user)
+
+
+@router.post("/lotes_serrada/", response_model=schemas.LoteSerradaDisplay, status_code=status.HTTP_201_CREATED)
+async def create_lote_serrado(
+    lote: schemas.LoteSerradaCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_serraria)
+):
+    return await db.run_sync(servicos.criar_lote_serrado, lote, current_user.id)
+
+
+@router.get("/lotes_serrada/", response_model=List[schemas.LoteSerradaDisplay])
+async def listar_lotes_serrados(
+    response: Response,
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_serraria)
+):
+    itens, proximo = await db.run_sync(servicos.listar_lotes_serrados, filtros, current_user.id)
+    return servicos.com_cursor(response, itens, proximo)
+
+
+@router.get("/lotes_serrado/", response_model=List[schemas.LoteSerradaDisplay])
+async def listar_lotes_serrados_para_fabrica(
+    response: Response,
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_fabrica)
+):
+    itens, proximo = await db.run_sync(servicos.listar_lotes_serrados, filtros)
+    return servicos.com_cursor(response, itens, proximo)
+
+
+@router.post("/produtos_acabados/", response_model=schemas.LoteProdutoAcabadoDisplay, status_code=status.HTTP_201_CREATED)
+async def create_produto_acabado(
+    produto: schemas.LoteProdutoAcabadoCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_fabrica)
+):
+    return await db.run_sync(servicos.criar_produto_acabado, produto, current_user.id)
+
+
+@router.get("/produtos_acabados/", response_model=List[schemas.LoteProdutoAcabadoDisplay])
+async def listar_produtos_acabados(
+    response: Response,
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_fabrica)
+):
+    itens, proximo = await db.run_sync(servicos.listar_produtos_acabados, current_user.id, filtros)
+    return servicos.com_cursor(response, itens, proximo)
+
+# ===================================
+# ENDPOINT - LINHAGEM (PARA ONDE FOI A TORA)
+# ===================================
+
+@router.get("/linhagem/tora", response_model=schemas.LinhagemDisplay)
+async def linhagem_da_tora(
+    response: Response,
+    id_lote_tora: Optional[int] = None,
+    numero_dof: Optional[str] = None,
+    profundidade: int = Query(2, ge=1, le=2, description="1 = só lotes serrados, 2 = também produtos"),
+    cursor: Optional[str] = Query(None, description="Valor do header X-Proximo-Cursor da página anterior"),
+    limite: int = Query(servicos.LIMITE_PADRAO, ge=1, le=servicos.LIMITE_MAXIMO),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_user)
+):
+    filtros = schemas.FiltrosLista(cursor=cursor, limite=limite)
+    linhagem, proximo = await db.run_sync(
+        servicos.linhagem_da_tora, current_user, id_lote_tora, numero_dof, profundidade, filtros
+    )
+    return servicos.com_cursor(response, linhagem, proximo)
+
+# ===================================
+# ENDPOINT - RELATÓRIOS (MODELO DE LEITURA)
+# ===================================
+
+@router.get("/relatorios/volume", response_model=schemas.RelatorioVolume)
+async def relatorio_volume(
+    agrupar_por: Literal["especie", "dof", "serraria", "fabrica"] = "especie",
+    filtros: schemas.FiltrosLista = Depends(servicos.parametros_lista),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UsuarioAutenticado = Depends(get_current_user)
+):
+    return await db.run_sync(servicos.relatorio_volume, current_user, agrupar_por, filtros)
+
+# ===================================
+# ENDPOINT PÚBLICO - RASTREABILIDADE
+# ===================================
+
+@router.get("/rastrear/{id_produto_custom}", response_model=schemas.RastreioDisplay, response_model_exclude_unset=True)
+async def rastrear_produto(
+    id_produto_custom: str,
+    incluir_prova: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if incluir_prova:
+        return await db.run_sync(servicos.rastrear_produto, id_produto_custom, incluir_prova)
+    # Acerto no cache responde sem passar pelo threadpool nem pelo banco
+    entrada = servicos.rastreio_em_cache(id_produto_custom)
+    if entrada is None:
+        entrada = await db.run_sync(servicos.rastrear_produto_cacheado, id_produto_custom)
+    return servicos.resposta_rastreio(entrada, if_none_match)
+
+
+@router.get("/verificar/{tipo_lote}/{id_lote_custom}", response_model=schemas.VerificacaoBlockchain)
+async def verificar_registro_blockchain(
+    tipo_lote: Literal["tora", "serrado", "produto"],
+    id_lote_custom: str,
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await db.run_sync(servicos.verificar_registro, tipo_lote, id_lote_custom)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Literal
+from pydantic import BaseModel, EmailStr, Field
+from typing import Any, Dict, List, Optional, Literal
 from decimal import Decimal
 import datetime
 
@@ -13,6 +13,15 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+    uid: Optional[int] = None
+    role: Optional[str] = None
+    exp: Optional[int] = None
+
+class UsuarioAutenticado(BaseModel):
+    """Usuário resolvido a partir do token (o que as rotas precisam saber)"""
+    id: int
+    email: str
+    role: Literal["tecnico", "serraria", "fabrica"]
 
 class UserDisplay(BaseModel):
     id: int
@@ -22,6 +31,34 @@ class UserDisplay(BaseModel):
     class Config:
         from_attributes = True
 
+# ===================================
+# LISTAGENS (PAGINAÇÃO E FILTROS)
+# ===================================
+
+class FiltrosLista(BaseModel):
+    """Parâmetros comuns das listagens (ver servicos.parametros_lista)"""
+    cursor: Optional[str] = None
+    limite: int = 100
+    data_inicio: Optional[datetime.datetime] = None
+    data_fim: Optional[datetime.datetime] = None
+    especie: Optional[str] = None
+    numero_dof: Optional[str] = None
+    responsavel: Optional[int] = None
+    status_ancoragem: Optional[str] = None
+
+# ===================================
+# SITUAÇÃO DA ANCORAGEM NA BLOCKCHAIN
+# ===================================
+
+class SituacaoAncoragem(BaseModel):
+    """Colunas de ancoragem comuns aos lotes (models.AncoragemMixin)"""
+    status_ancoragem: Optional[str] = None
+    tx_hash: Optional[str] = None
+    bloco_ancoragem: Optional[int] = None
+    tentativas_ancoragem: Optional[int] = None
+    data_envio_ancoragem: Optional[datetime.datetime] = None
+    data_confirmacao_ancoragem: Optional[datetime.datetime] = None
+
 # ===================================
 # ESQUEMAS DO LOTE DE TORA
 # ===================================
@@ -36,7 +73,7 @@ class LoteToraCreate(BaseModel):
     volume_estimado_m3: Decimal
     fotos_evidencia: Optional[List[str]] = None
 
-class LoteToraDisplay(BaseModel):
+class LoteToraDisplay(SituacaoAncoragem):
     id: int
     id_lote_custom: str
     id_tecnico_campo: int
@@ -53,6 +90,35 @@ class LoteToraDisplay(BaseModel):
     class Config:
         from_attributes = True
 
+class LoteToraCreateEmLote(LoteToraCreate):
+    """Item da sincronização em lote; a chave torna o reenvio seguro"""
+    chave_idempotencia: Optional[str] = Field(None, min_length=1, max_length=100)
+
+class LotesToraEmLoteCreate(BaseModel):
+    """Itens são validados um a um (um item inválido não derruba os outros)"""
+    itens: List[Dict[str, Any]] = Field(..., min_length=1, max_length=1000)
+
+class ResultadoItemLote(BaseModel):
+    indice: int
+    status: Literal["criado", "existente", "invalido"]
+    chave_idempotencia: Optional[str] = None
+    id: Optional[int] = None
+    id_lote_custom: Optional[str] = None
+    erros: Optional[List[str]] = None
+
+class LotesToraEmLoteResultado(BaseModel):
+    criados: int
+    existentes: int
+    invalidos: int
+    resultados: List[ResultadoItemLote]
+
+class VolumeDisponivel(BaseModel):
+    id: int
+    id_lote_custom: str
+    volume_estimado_m3: Decimal
+    volume_processado_m3: Decimal
+    volume_disponivel_m3: Decimal
+
 # ===================================
 # ESQUEMAS DO LOTE SERRADO (NOVO)
 # ===================================
@@ -66,7 +132,7 @@ class LoteSerradaCreate(BaseModel):
     dimensoes: Optional[str] = None
     dados_tratamento: Optional[str] = None
 
-class LoteSerradaDisplay(BaseModel):
+class LoteSerradaDisplay(SituacaoAncoragem):
     """Schema para exibir um lote serrado"""
     id: int
     id_lote_serrado_custom: str
@@ -94,7 +160,7 @@ class LoteProdutoAcabadoCreate(BaseModel):
     dados_acabamento: Optional[str] = None
     link_qr_code: str
 
-class LoteProdutoAcabadoDisplay(BaseModel):
+class LoteProdutoAcabadoDisplay(SituacaoAncoragem):
     """Schema para exibir um produto acabado"""
     id: int
     id_lote_produto_custom: str
@@ -107,4 +173,116 @@ class LoteProdutoAcabadoDisplay(BaseModel):
     link_qr_code: str
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# ===================================
+# LINHAGEM PARA FRENTE (RECALL / AUDITORIA)
+# ===================================
+
+class LinhagemTora(BaseModel):
+    id: int
+    id_lote_custom: str
+    numero_dof: str
+    especie_madeira_popular: Optional[str] = None
+    volume_estimado_m3: Decimal
+    data_hora_registro: Optional[datetime.datetime] = None
+
+class LinhagemSerrado(BaseModel):
+    id: int
+    id_lote_serrado_custom: str
+    id_lote_tora_origem: int
+    id_equipe_serraria: int
+    volume_saida_m3: Decimal
+    data_processamento: Optional[datetime.datetime] = None
+
+class LinhagemProduto(BaseModel):
+    id: int
+    id_lote_produto_custom: str
+    id_lote_serrado_origem: int
+    id_equipe_fabrica: int
+    sku_produto: str
+    nome_produto: str
+    data_fabricacao: Optional[datetime.datetime] = None
+
+class LinhagemDisplay(BaseModel):
+    """Descendentes de uma tora (ou de todas as toras de um DOF)"""
+    toras: List[LinhagemTora]
+    lotes_serrados: List[LinhagemSerrado]  # no máximo `limite`; paginados só com profundidade 1
+    produtos: List[LinhagemProduto]  # página atual (ver X-Proximo-Cursor)
+    total_lotes_serrados: Optional[int] = None
+    total_produtos: Optional[int] = None
+
+# ===================================
+# ESQUEMAS DA RASTREABILIDADE (PÚBLICO)
+# ===================================
+
+class RastreioProduto(SituacaoAncoragem):
+    id: int
+    id_custom: str
+    nome: str
+    sku: str
+    data_fabricacao: datetime.datetime
+    dados_acabamento: Optional[str] = None
+
+class RastreioLoteSerrado(SituacaoAncoragem):
+    id: int
+    id_custom: str
+    tipo_produto: Optional[str] = None
+    dimensoes: Optional[str] = None
+    volume_m3: float
+    data_processamento: datetime.datetime
+
+class Coordenadas(BaseModel):
+    lat: float
+    lon: float
+
+class RastreioLoteTora(SituacaoAncoragem):
+    id: int
+    id_custom: str
+    especie_popular: Optional[str] = None
+    especie_cientifica: Optional[str] = None
+    volume_m3: float
+    numero_dof: str
+    numero_licenca: str
+    coordenadas: Coordenadas
+    data_registro: datetime.datetime
+
+class RastreioDisplay(BaseModel):
+    """Resposta do /rastrear: toda a cadeia Produto → Serrado → Tora"""
+    produto: RastreioProduto
+    lote_serrado: Optional[RastreioLoteSerrado] = None
+    lote_tora: Optional[RastreioLoteTora] = None
+    # Só presente com incluir_prova=true
+    ancoragem: Optional[dict] = None
+
+# ===================================
+# VERIFICAÇÃO NA BLOCKCHAIN (ÍNDICE LOCAL)
+# ===================================
+
+class VerificacaoBlockchain(BaseModel):
+    tipo_lote: str
+    id_lote_custom: str
+    registrado: bool
+    bloco: Optional[int] = None
+    tx_hash: Optional[str] = None
+    timestamp_bloco: Optional[int] = None
+    responsavel: Optional[str] = None
+    indexado_ate_bloco: Optional[int] = None  # "não registrado" vale até este bloco
+
+# ===================================
+# RELATÓRIOS (MODELO DE LEITURA linhagem_produtos)
+# ===================================
+
+class ItemRelatorioVolume(BaseModel):
+    chave: Optional[str] = None  # espécie, DOF ou ID da serraria/fábrica
+    nome: Optional[str] = None  # nome da serraria/fábrica
+    produtos: int
+    lotes_serrados: int
+    lotes_tora: int
+    volume_serrado_m3: Decimal  # cada lote serrado conta uma vez no grupo
+    volume_tora_m3: Decimal  # volume estimado, cada tora uma vez no grupo
+
+class RelatorioVolume(BaseModel):
+    """Madeira que já virou produto acabado, agrupada (maior volume primeiro)"""
+    agrupar_por: str
+    itens: List[ItemRelatorioVolume]
@@ -0,0 +1,1036 @@
+"""
+servicos.py - Regras de negócio dos endpoints
+
+Funções síncronas que recebem uma Session. São usadas diretamente pelas
+rotas síncronas (main.py) e, pelas rotas assíncronas (rotas_async.py), via
+AsyncSession.run_sync, para que os dois caminhos tenham o mesmo comportamento.
+"""
+
+import os
+import json
+import time
+import base64
+import datetime
+import hashlib
+from decimal import Decimal
+from typing import Literal, Optional, Tuple
+from fastapi import HTTPException, Query
+from fastapi.responses import JSONResponse, Response
+from pydantic import ValidationError
+from sqlalchemy import event, func, insert, select, update, or_, literal, tuple_, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from jose import jwt, JWTError
+
+import logs
+import models
+import schemas
+import ancoragem
+import cache
+import identificadores
+import indexador
+import linhagem
+import auth
+from auth import SECRET_KEY, ALGORITHM
+
+log = logs.obter_logger("servicos")
+
+# ===================================
+# AUTENTICAÇÃO
+# ===================================
+
+MODELOS_USUARIO = (models.TecnicoCampo, models.EquipeSerraria, models.EquipeFabrica)
+MODELO_POR_PAPEL = {
+    "tecnico": models.TecnicoCampo,
+    "serraria": models.EquipeSerraria,
+    "fabrica": models.EquipeFabrica,
+}
+
+# Usuários já resolvidos, por token. TTL curto: um usuário removido perde
+# o acesso em no máximo AUTH_CACHE_TTL_S segundos.
+AUTH_CACHE_TTL_S = float(os.getenv("AUTH_CACHE_TTL_S", "60"))
+cache_principais = cache.CacheLRU("principais", max_itens=10000, ttl_s=AUTH_CACHE_TTL_S)
+
+def dados_do_token(token: str) -> Optional[schemas.TokenData]:
+    """Decodifica e valida o JWT; None se inválido ou expirado."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return schemas.TokenData(
+        email=payload.get("sub"),
+        uid=payload.get("uid"),
+        role=payload.get("role"),
+        exp=payload.get("exp"),
+    )
+
+def email_do_token(token: str) -> Optional[str]:
+    """Decodifica o JWT e retorna o email (claim 'sub'), ou None se inválido."""
+    dados = dados_do_token(token)
+    return dados.email if dados else None
+
+def buscar_usuario(db: Session, email: str, modelos=MODELOS_USUARIO):
+    """Procura o usuário nas tabelas indicadas, na ordem dada."""
+    for modelo in modelos:
+        user = db.query(modelo).filter(modelo.email == email).first()
+        if user:
+            return user
+    return None
+
+def buscar_conta_login(db: Session, email: str):
+    """
+    Procura o email nas 3 tabelas numa única consulta (UNION ALL sobre os
+    índices únicos de email). Se o email existir em mais de uma tabela,
+    vale a primeira na ordem Técnico, Serraria, Fábrica.
+    Retorna uma linha (papel, id, email, hash_senha) ou None.
+    """
+    consultas = [
+        select(
+            literal(ordem).label("ordem"),
+            literal(papel).label("papel"),
+            modelo.id.label("id"),
+            modelo.email.label("email"),
+            modelo.hash_senha.label("hash_senha"),
+        ).where(modelo.email == email)
+        for ordem, (papel, modelo) in enumerate(MODELO_POR_PAPEL.items())
+    ]
+    uniao = union_all(*consultas).subquery()
+    return db.execute(select(uniao).order_by(uniao.c.ordem).limit(1)).first()
+
+def atualizar_hash_senha(db: Session, papel: str, id_usuario: int, novo_hash: str):
+    """Regrava o hash quando o pwd_context pede (needs_update)."""
+    modelo = MODELO_POR_PAPEL[papel]
+    db.execute(update(modelo).where(modelo.id == id_usuario).values(hash_senha=novo_hash))
+    db.commit()
+
+def papel_do_usuario(user) -> str:
+    if isinstance(user, schemas.UsuarioAutenticado):
+        return user.role
+    elif isinstance(user, models.TecnicoCampo):
+        return "tecnico"
+    elif isinstance(user, models.EquipeSerraria):
+        return "serraria"
+    elif isinstance(user, models.EquipeFabrica):
+        return "fabrica"
+    return "desconhecido"
+
+def criar_token_usuario(user) -> str:
+    """Token com id e papel assinados, para autenticar sem consultar o banco."""
+    return auth.criar_access_token(data={
+        "sub": user.email,
+        "uid": user.id,
+        "role": papel_do_usuario(user),
+    })
+
+def principal_em_cache(token: str) -> Optional[schemas.UsuarioAutenticado]:
+    entrada = cache_principais.get(token)
+    if entrada is None:
+        return None
+    principal, expira = entrada
+    if expira is not None and expira <= time.time():
+        cache_principais.delete(token)
+        return None
+    return principal
+
+def autenticar(db: Session, token: str, papel: Optional[str] = None) -> Optional[schemas.UsuarioAutenticado]:
+    """
+    Resolve o usuário do token. Com o token em cache: nenhuma consulta.
+    Tokens com 'uid'/'role': uma consulta pela chave primária.
+    Tokens antigos (só 'sub'): busca por email, como antes (na tabela do
+    papel pedido, ou nas 3), sem cache.
+    """
+    principal = principal_em_cache(token)
+    if principal is not None:
+        return principal
+
+    dados = dados_do_token(token)
+    if dados is None or dados.email is None:
+        return None
+
+    if dados.uid is not None and dados.role in MODELO_POR_PAPEL:
+        user = db.get(MODELO_POR_PAPEL[dados.role], dados.uid)
+        if user is None or user.email != dados.email:
+            return None
+        principal = schemas.UsuarioAutenticado(id=user.id, email=user.email, role=dados.role)
+        cache_principais.set(token, (principal, dados.exp))
+        return principal
+
+    modelos = (MODELO_POR_PAPEL[papel],) if papel else MODELOS_USUARIO
+    user = buscar_usuario(db, dados.email, modelos=modelos)
+    if user is None:
+        return None
+    return schemas.UsuarioAutenticado(id=user.id, email=user.email, role=papel_do_usuario(user))
+
+# ===================================
+# LISTAGENS (PAGINAÇÃO POR CURSOR)
+# ===================================
+
+# Paginação keyset: ordena por (data, id) decrescente e a próxima página
+# começa depois do último item visto, então o custo de cada página não
+# cresce com o tamanho da tabela (ao contrário de OFFSET).
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 500
+
+def parametros_lista(
+    cursor: Optional[str] = Query(None, description="Valor do header X-Proximo-Cursor da página anterior"),
+    limite: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAXIMO),
+    data_inicio: Optional[datetime.datetime] = None,
+    data_fim: Optional[datetime.datetime] = None,
+    especie: Optional[str] = Query(None, description="Nome popular ou científico"),
+    numero_dof: Optional[str] = None,
+    responsavel: Optional[int] = Query(None, description="ID do técnico/equipe responsável"),
+    status_ancoragem: Optional[Literal["pendente", "agrupado", "enviado", "confirmado", "falhou"]] = None,
+) -> schemas.FiltrosLista:
+    """Dependência com os parâmetros comuns das listagens."""
+    return schemas.FiltrosLista(
+        cursor=cursor, limite=limite, data_inicio=data_inicio, data_fim=data_fim,
+        especie=especie, numero_dof=numero_dof, responsavel=responsavel,
+        status_ancoragem=status_ancoragem,
+    )
+
+def _codificar_cursor(id_item: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": id_item}).encode()).decode().rstrip("=")
+
+def _decodificar_cursor(cursor: str) -> int:
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return int(json.loads(bruto)["id"])
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def _filtrar_periodo(consulta, coluna_data, filtros: schemas.FiltrosLista):
+    if filtros.data_inicio is not None:
+        consulta = consulta.filter(coluna_data >= filtros.data_inicio)
+    if filtros.data_fim is not None:
+        consulta = consulta.filter(coluna_data <= filtros.data_fim)
+    return consulta
+
+def _filtrar_ancoragem(consulta, modelo, filtros: schemas.FiltrosLista):
+    """Lotes numa situação de ancoragem (ex.: 'falhou'), pelo índice de status_ancoragem."""
+    if filtros.status_ancoragem:
+        consulta = consulta.filter(modelo.status_ancoragem == filtros.status_ancoragem)
+    return consulta
+
+def _filtrar_tora(consulta, filtros: schemas.FiltrosLista):
+    """Filtros de espécie e DOF (colunas de LoteTora)."""
+    if filtros.especie:
+        consulta = consulta.filter(or_(
+            models.LoteTora.especie_madeira_popular == filtros.especie,
+            models.LoteTora.especie_madeira_cientifico == filtros.especie,
+        ))
+    if filtros.numero_dof:
+        consulta = consulta.filter(models.LoteTora.numero_dof == filtros.numero_dof)
+    return consulta
+
+def paginar(consulta, coluna_data, coluna_id, filtros: schemas.FiltrosLista) -> Tuple[list, Optional[str]]:
+    """Aplica cursor e limite; retorna (itens, cursor da próxima página ou None)."""
+    if filtros.cursor:
+        # Compara com o (data, id) do último item visto numa subconsulta, com
+        # os mesmos filtros e restrições de dono da listagem: a data nunca
+        # passa pelo Python (no SQLite a data do server_default não tem
+        # microssegundos e o valor ligado de volta viraria outro texto,
+        # repetindo a página). Cursor de outro conjunto (ou de item
+        # inexistente) dá 400, em vez de uma página vazia.
+        id_item = _decodificar_cursor(filtros.cursor)
+        ultimo_visto = consulta.with_entities(coluna_data, coluna_id).filter(
+            coluna_id == id_item, coluna_data.isnot(None)
+        )
+        if ultimo_visto.first() is None:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        consulta = consulta.filter(
+            tuple_(coluna_data, coluna_id) < ultimo_visto.correlate(None).scalar_subquery()
+        )
+
+    itens = consulta.order_by(coluna_data.desc(), coluna_id.desc()).limit(filtros.limite + 1).all()
+    if len(itens) <= filtros.limite:
+        return itens, None
+
+    itens = itens[:filtros.limite]
+    ultimo = itens[-1]
+    return itens, _codificar_cursor(getattr(ultimo, coluna_id.key))
+
+def com_cursor(response: Response, itens, proximo: Optional[str]):
+    """Coloca o cursor da próxima página no header; o corpo continua o mesmo."""
+    if proximo:
+        response.headers["X-Proximo-Cursor"] = proximo
+    return itens
+
+# ===================================
+# LOTES DE TORA
+# ===================================
+
+def _registro_tora(id_lote_custom: str, lote: schemas.LoteToraCreate) -> dict:
+    """Dados do lote de tora registrados na blockchain."""
+    return {
+        "id_lote_custom": id_lote_custom,
+        "coordenadas_lat": float(lote.coordenadas_gps_lat),
+        "coordenadas_lon": float(lote.coordenadas_gps_lon),
+        "numero_dof": lote.numero_dof,
+        "numero_licenca": lote.numero_licenca_ambiental,
+        "especie": lote.especie_madeira_popular or "Não informada",
+        "volume_m3": float(lote.volume_estimado_m3)
+    }
+
+def criar_lote_tora(db: Session, lote: schemas.LoteToraCreate, id_tecnico: int) -> models.LoteTora:
+    new_id_custom = identificadores.alocar_id(db, identificadores.PREFIXO_TORA)
+
+    db_lote = models.LoteTora(
+        **lote.model_dump(),
+        id_lote_custom=new_id_custom,
+        id_tecnico_campo=id_tecnico
+    )
+
+    try:
+        # 1. Salvar no banco de dados centralizado
+        db.add(db_lote)
+        db.flush()
+
+        # 2. Enfileirar o registro na blockchain (mesma transação)
+        ancoragem.enfileirar(db, "tora", db_lote.id, new_id_custom, _registro_tora(new_id_custom, lote))
+
+        db.commit()
+        db.refresh(db_lote)
+
+        log.info("✅ Lote %s salvo no banco de dados (ancoragem pendente)", new_id_custom,
+                 extra=logs.amostrado(id_lote=new_id_custom))
+
+        return db_lote
+
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Erro ao salvar no banco: {e}")
+
+def _toras_existentes(db: Session, id_tecnico: int, chaves: list) -> dict:
+    """{chave_idempotencia: (id, id_lote_custom)} das chaves já gravadas pelo técnico."""
+    if not chaves:
+        return {}
+    linhas = db.execute(
+        select(models.LoteTora.chave_idempotencia, models.LoteTora.id, models.LoteTora.id_lote_custom)
+        .where(models.LoteTora.id_tecnico_campo == id_tecnico, models.LoteTora.chave_idempotencia.in_(chaves))
+    ).all()
+    return {chave: (id_lote, id_custom) for chave, id_lote, id_custom in linhas}
+
+def criar_lotes_tora_em_lote(db: Session, itens: list, id_tecnico: int) -> schemas.LotesToraEmLoteResultado:
+    """
+    Sincronização do app de campo: valida cada item, descarta os que já
+    foram gravados (mesma chave de idempotência do mesmo técnico), aloca
+    todos os IDs de uma vez e insere lotes e fila de ancoragem numa única
+    transação, com INSERTs em lote.
+    """
+    resultados = [None] * len(itens)
+    validos = []  # (indice, LoteToraCreateEmLote)
+    for indice, bruto in enumerate(itens):
+        try:
+            validos.append((indice, schemas.LoteToraCreateEmLote.model_validate(bruto)))
+        except ValidationError as e:
+            erros = [f"{'.'.join(str(p) for p in erro['loc'])}: {erro['msg']}" for erro in e.errors()]
+            resultados[indice] = schemas.ResultadoItemLote(indice=indice, status="invalido", erros=erros)
+
+    for tentativa in range(2):
+        # Chave repetida dentro do próprio envio: só a primeira ocorrência é gravada
+        primeira_ocorrencia = {}
+        novos, repetidos = [], []
+        chaves = [lote.chave_idempotencia for _, lote in validos if lote.chave_idempotencia]
+        existentes = _toras_existentes(db, id_tecnico, chaves)
+        for indice, lote in validos:
+            chave = lote.chave_idempotencia
+            if chave in existentes:
+                id_lote, id_custom = existentes[chave]
+                resultados[indice] = schemas.ResultadoItemLote(
+                    indice=indice, status="existente", chave_idempotencia=chave, id=id_lote, id_lote_custom=id_custom
+                )
+            elif chave and chave in primeira_ocorrencia:
+                repetidos.append((indice, primeira_ocorrencia[chave]))
+            else:
+                if chave:
+                    primeira_ocorrencia[chave] = indice
+                novos.append((indice, lote))
+
+        if not novos:
+            break
+
+        try:
+            ids_custom = identificadores.alocar_ids(db, identificadores.PREFIXO_TORA, len(novos))
+            linhas = [
+                {
+                    **lote.model_dump(exclude={"chave_idempotencia"}),
+                    "id_lote_custom": id_custom,
+                    "id_tecnico_campo": id_tecnico,
+                    "chave_idempotencia": lote.chave_idempotencia,
+                }
+                for (_, lote), id_custom in zip(novos, ids_custom)
+            ]
+            # insertmanyvalues: INSERT de várias linhas por comando, com RETURNING
+            inseridos = db.execute(
+                insert(models.LoteTora).returning(models.LoteTora.id, models.LoteTora.id_lote_custom, sort_by_parameter_order=True),
+                linhas,
+            ).all()
+
+            for (indice, lote), (id_lote, id_custom) in zip(novos, inseridos):
+                ancoragem.enfileirar(db, "tora", id_lote, id_custom, _registro_tora(id_custom, lote))
+                resultados[indice] = schemas.ResultadoItemLote(
+                    indice=indice, status="criado", chave_idempotencia=lote.chave_idempotencia,
+                    id=id_lote, id_lote_custom=id_custom
+                )
+            db.commit()
+            break
+        except IntegrityError:
+            # Outro envio com as mesmas chaves gravou primeiro: recalcula os existentes
+            db.rollback()
+            if tentativa == 1:
+                raise HTTPException(status_code=409, detail="Conflito de chaves de idempotência, tente novamente")
+        except Exception as e:
+            db.rollback()
+            raise HTTPException(status_code=400, detail=f"Erro ao salvar lotes no banco: {e}")
+
+    for indice, indice_original in repetidos:
+        original = resultados[indice_original]
+        resultados[indice] = original.model_copy(update={"indice": indice, "status": "existente"})
+
+    resumo = schemas.LotesToraEmLoteResultado(
+        criados=sum(r.status == "criado" for r in resultados),
+        existentes=sum(r.status == "existente" for r in resultados),
+        invalidos=sum(r.status == "invalido" for r in resultados),
+        resultados=resultados,
+    )
+    log.info("✅ Sincronização em lote: %s lotes criados, %s já existentes, %s inválidos (ancoragem pendente)",
+             resumo.criados, resumo.existentes, resumo.invalidos, extra=logs.amostrado())
+    return resumo
+
+def listar_lotes_tora(db: Session, current_user, filtros: schemas.FiltrosLista) -> Tuple[list, Optional[str]]:
+    """Técnicos veem apenas os seus. Serraria e Fábrica veem todos."""
+    consulta = db.query(models.LoteTora)
+    if papel_do_usuario(current_user) == "tecnico":
+        consulta = consulta.filter(models.LoteTora.id_tecnico_campo == current_user.id)
+    elif filtros.responsavel is not None:
+        consulta = consulta.filter(models.LoteTora.id_tecnico_campo == filtros.responsavel)
+
+    consulta = _filtrar_periodo(consulta, models.LoteTora.data_hora_registro, filtros)
+    consulta = _filtrar_tora(consulta, filtros)
+    consulta = _filtrar_ancoragem(consulta, models.LoteTora, filtros)
+    return paginar(consulta, models.LoteTora.data_hora_registro, models.LoteTora.id, filtros)
+
+def obter_lote_tora(db: Session, lote_id: int, current_user) -> models.LoteTora:
+    lote = db.query(models.LoteTora).filter(models.LoteTora.id == lote_id).first()
+
+    if not lote:
+        raise HTTPException(status_code=404, detail="Lote de tora não encontrado")
+
+    if papel_do_usuario(current_user) == "tecnico" and lote.id_tecnico_campo != current_user.id:
+        raise HTTPException(status_code=403, detail="Acesso negado a este lote")
+
+    return lote
+
+# ===================================
+# LOTES SERRADOS
+# ===================================
+
+def _consumir_volume_tora(db: Session, id_lote_tora: int, volume: Decimal):
+    """
+    Soma `volume` ao volume_processado_m3 da tora se couber no volume
+    estimado. Retorna (id, id_lote_custom) da tora; 404 se ela não existe e
+    400 se o volume excede o disponível.
+    """
+    Tora = models.LoteTora
+    reservado = db.execute(
+        update(Tora)
+        .where(Tora.id == id_lote_tora, Tora.volume_estimado_m3 - Tora.volume_processado_m3 >= volume)
+        .values(volume_processado_m3=Tora.volume_processado_m3 + volume)
+        .returning(Tora.id, Tora.id_lote_custom)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if reservado is not None:
+        return reservado
+
+    tora = db.execute(
+        select(Tora.volume_estimado_m3, Tora.volume_processado_m3).where(Tora.id == id_lote_tora)
+    ).first()
+    if tora is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Lote de tora com ID {id_lote_tora} não encontrado"
+        )
+    volume_disponivel = tora.volume_estimado_m3 - tora.volume_processado_m3
+    raise HTTPException(
+        status_code=400,
+        detail=f"Volume de saída ({volume} m³) excede o volume disponível ({volume_disponivel:.2f} m³)"
+    )
+
+def volumes_disponiveis(db: Session, ids: list, current_user) -> list:
+    """
+    Volume estimado, processado e disponível de várias toras numa consulta.
+    IDs inexistentes (ou, para técnicos, de outros técnicos) são omitidos.
+    """
+    Tora = models.LoteTora
+    consulta = (
+        select(Tora.id, Tora.id_lote_custom, Tora.volume_estimado_m3, Tora.volume_processado_m3)
+        .where(Tora.id.in_(ids))
+        .order_by(Tora.id)
+    )
+    if papel_do_usuario(current_user) == "tecnico":
+        consulta = consulta.where(Tora.id_tecnico_campo == current_user.id)
+    linhas = db.execute(consulta).all()
+    return [
+        schemas.VolumeDisponivel(
+            id=linha.id,
+            id_lote_custom=linha.id_lote_custom,
+            volume_estimado_m3=linha.volume_estimado_m3,
+            volume_processado_m3=linha.volume_processado_m3,
+            volume_disponivel_m3=linha.volume_estimado_m3 - linha.volume_processado_m3,
+        )
+        for linha in linhas
+    ]
+
+def _registro_serrado(id_lote_serrado_custom: str, lote, id_lote_tora_custom: str) -> dict:
+    """Dados do lote serrado registrados na blockchain."""
+    return {
+        "id_lote_serrado_custom": id_lote_serrado_custom,
+        "id_lote_tora_origem": id_lote_tora_custom,
+        "volume_saida_m3": float(lote.volume_saida_m3),
+        "tipo_produto": lote.tipo_produto or "",
+        "dimensoes": lote.dimensoes or ""
+    }
+
+def criar_lote_serrado(db: Session, lote: schemas.LoteSerradaCreate, id_equipe: int) -> models.LoteSerrado:
+    # 1. Verificar a tora de origem e reservar o volume: um UPDATE ... RETURNING
+    # condicional (volume disponível >= volume de saída) substitui a consulta
+    # da tora e a soma dos lotes já serrados. Ele trava a linha da tora até o
+    # fim da transação, então duas entradas simultâneas não conseguem
+    # consumir o mesmo volume (404 se a tora não existe, 400 se não cabe)
+    lote_tora = _consumir_volume_tora(db, lote.id_lote_tora_origem, lote.volume_saida_m3)
+
+    # 2. Gerar ID customizado
+    id_lote_serrado_custom = identificadores.alocar_id(db, identificadores.PREFIXO_SERRADO)
+
+    # 3. Criar o lote serrado
+    db_lote_serrado = models.LoteSerrado(
+        **lote.model_dump(),
+        id_lote_serrado_custom=id_lote_serrado_custom,
+        id_equipe_serraria=id_equipe
+    )
+
+    try:
+        # Salvar no banco
+        db.add(db_lote_serrado)
+        db.flush()
+
+        # Enfileirar o registro na blockchain (mesma transação)
+        ancoragem.enfileirar(db, "serrado", db_lote_serrado.id, id_lote_serrado_custom,
+                             _registro_serrado(id_lote_serrado_custom, lote, lote_tora.id_lote_custom))
+
+        db.commit()
+        db.refresh(db_lote_serrado)
+
+        log.info("✅ Lote serrado %s salvo no banco de dados (ancoragem pendente)", id_lote_serrado_custom,
+                 extra=logs.amostrado(id_lote=id_lote_serrado_custom))
+
+        return db_lote_serrado
+
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Erro ao salvar lote serrado: {e}")
+
+def listar_lotes_serrados(db: Session, filtros: schemas.FiltrosLista, id_equipe: Optional[int] = None) -> Tuple[list, Optional[str]]:
+    """
+    Lotes serrados de uma equipe (ou de todas, se id_equipe for None; aí
+    filtros.responsavel escolhe a equipe). Espécie e DOF são os da tora de origem.
+    """
+    consulta = db.query(models.LoteSerrado)
+    id_equipe = id_equipe if id_equipe is not None else filtros.responsavel
+    if id_equipe is not None:
+        consulta = consulta.filter(models.LoteSerrado.id_equipe_serraria == id_equipe)
+    if filtros.especie or filtros.numero_dof:
+        consulta = _filtrar_tora(consulta.join(models.LoteSerrado.lote_tora_origem), filtros)
+
+    consulta = _filtrar_periodo(consulta, models.LoteSerrado.data_processamento, filtros)
+    consulta = _filtrar_ancoragem(consulta, models.LoteSerrado, filtros)
+    return paginar(consulta, models.LoteSerrado.data_processamento, models.LoteSerrado.id, filtros)
+
+# ===================================
+# PRODUTOS ACABADOS
+# ===================================
+
+def _registro_produto(id_lote_produto_custom: str, produto, id_lote_serrado_custom: str) -> dict:
+    """Dados do produto acabado registrados na blockchain."""
+    return {
+        "id_produto_custom": id_lote_produto_custom,
+        "id_lote_serrado_origem": id_lote_serrado_custom,  # ID customizado!
+        "sku_produto": produto.sku_produto,
+        "nome_produto": produto.nome_produto
+    }
+
+def criar_produto_acabado(db: Session, produto: schemas.LoteProdutoAcabadoCreate, id_equipe: int) -> models.LoteProdutoAcabado:
+    # 1. Verificar se o lote serrado existe
+    lote_serrado = db.query(models.LoteSerrado).filter(
+        models.LoteSerrado.id == produto.id_lote_serrado_origem
+    ).first()
+
+    if not lote_serrado:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Lote serrado com ID {produto.id_lote_serrado_origem} não encontrado"
+        )
+
+    # 2. Gerar ID customizado
+    id_lote_produto_custom = identificadores.alocar_id(db, identificadores.PREFIXO_PRODUTO)
+
+    # 3. Gerar link de rastreabilidade
+    link_qr_code = f"https://app-rastreabilidade.onrender.com/rastrear.html?id={id_lote_produto_custom}"
+
+    # 4. Criar o produto
+    db_produto = models.LoteProdutoAcabado(
+        **produto.model_dump(exclude={'link_qr_code'}),
+        id_lote_produto_custom=id_lote_produto_custom,
+        id_equipe_fabrica=id_equipe,
+        link_qr_code=link_qr_code
+    )
+
+    try:
+        # Salvar no banco
+        db.add(db_produto)
+        db.flush()
+
+        # Enfileirar o registro na blockchain (mesma transação)
+        ancoragem.enfileirar(db, "produto", db_produto.id, id_lote_produto_custom,
+                             _registro_produto(id_lote_produto_custom, produto, lote_serrado.id_lote_serrado_custom))
+
+        db.commit()
+        db.refresh(db_produto)
+
+        log.info("✅ Produto %s salvo no banco de dados (ancoragem pendente)", id_lote_produto_custom,
+                 extra=logs.amostrado(id_lote=id_lote_produto_custom))
+
+        return db_produto
+
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Erro ao salvar produto acabado: {e}")
+
+def listar_produtos_acabados(db: Session, id_equipe: int, filtros: schemas.FiltrosLista) -> Tuple[list, Optional[str]]:
+    """Produtos da equipe. Espécie e DOF são os da tora de origem."""
+    consulta = db.query(models.LoteProdutoAcabado).filter(
+        models.LoteProdutoAcabado.id_equipe_fabrica == id_equipe
+    )
+    if filtros.especie or filtros.numero_dof:
+        consulta = _filtrar_tora(
+            consulta.join(models.LoteProdutoAcabado.lote_serrado_origem).join(models.LoteSerrado.lote_tora_origem),
+            filtros,
+        )
+
+    consulta = _filtrar_periodo(consulta, models.LoteProdutoAcabado.data_fabricacao, filtros)
+    consulta = _filtrar_ancoragem(consulta, models.LoteProdutoAcabado, filtros)
+    return paginar(consulta, models.LoteProdutoAcabado.data_fabricacao, models.LoteProdutoAcabado.id, filtros)
+
+# ===================================
+# LINHAGEM PARA FRENTE
+# ===================================
+
+def linhagem_da_tora(
+    db: Session,
+    current_user,
+    id_lote_tora: Optional[int] = None,
+    numero_dof: Optional[str] = None,
+    profundidade: int = 2,
+    filtros: Optional[schemas.FiltrosLista] = None,
+) -> Tuple[schemas.LinhagemDisplay, Optional[str]]:
+    """
+    Tudo o que saiu de uma tora (por id) ou das toras de um DOF: lotes
+    serrados (profundidade >= 1) e produtos (profundidade 2). A cadeia tem
+    profundidade fixa, então são no máximo seis consultas (toras, serrados,
+    produtos e as contagens), cada uma por índice de chave estrangeira,
+    independentemente de quantos descendentes existam.
+    O nível mais fundo pedido é paginado por id (cursor em
+    X-Proximo-Cursor); com profundidade 2, os lotes serrados vêm limitados
+    a `limite` por resposta e total_lotes_serrados diz quantos são (para
+    percorrer todos, use profundidade 1).
+    """
+    if (id_lote_tora is None) == (not numero_dof):
+        raise HTTPException(status_code=400, detail="Informe id_lote_tora ou numero_dof (apenas um)")
+    filtros = filtros or schemas.FiltrosLista()
+    Tora, Serrado, Produto = models.LoteTora, models.LoteSerrado, models.LoteProdutoAcabado
+
+    consulta_toras = select(
+        Tora.id, Tora.id_lote_custom, Tora.numero_dof, Tora.especie_madeira_popular,
+        Tora.volume_estimado_m3, Tora.data_hora_registro,
+    )
+    if id_lote_tora is not None:
+        consulta_toras = consulta_toras.where(Tora.id == id_lote_tora)
+    else:
+        consulta_toras = consulta_toras.where(Tora.numero_dof == numero_dof)
+    if papel_do_usuario(current_user) == "tecnico":
+        consulta_toras = consulta_toras.where(Tora.id_tecnico_campo == current_user.id)
+
+    toras = db.execute(consulta_toras.order_by(Tora.id)).all()
+    if not toras:
+        raise HTTPException(status_code=404, detail="Lote de tora não encontrado")
+    ids_tora = [t.id for t in toras]
+
+    serrados, total_serrados, proximo = [], None, None
+    if profundidade >= 1:
+        consulta = select(
+            Serrado.id, Serrado.id_lote_serrado_custom, Serrado.id_lote_tora_origem,
+            Serrado.id_equipe_serraria, Serrado.volume_saida_m3, Serrado.data_processamento,
+        ).where(Serrado.id_lote_tora_origem.in_(ids_tora))
+        if profundidade == 1 and filtros.cursor:
+            consulta = consulta.where(Serrado.id > _decodificar_cursor(filtros.cursor))
+        serrados = db.execute(consulta.order_by(Serrado.id).limit(filtros.limite + 1)).all()
+        if len(serrados) > filtros.limite:
+            serrados = serrados[:filtros.limite]
+            if profundidade == 1:
+                proximo = _codificar_cursor(serrados[-1].id)
+            if not filtros.cursor:
+                total_serrados = db.execute(
+                    select(func.count()).select_from(Serrado).where(Serrado.id_lote_tora_origem.in_(ids_tora))
+                ).scalar_one()
+        elif not filtros.cursor:
+            total_serrados = len(serrados)
+
+    produtos, total_produtos = [], None
+    if profundidade >= 2 and serrados:
+        da_tora = (
+            select(Produto.id)
+            .join(Serrado, Serrado.id == Produto.id_lote_serrado_origem)
+            .where(Serrado.id_lote_tora_origem.in_(ids_tora))
+        )
+        consulta = select(
+            Produto.id, Produto.id_lote_produto_custom, Produto.id_lote_serrado_origem,
+            Produto.id_equipe_fabrica, Produto.sku_produto, Produto.nome_produto, Produto.data_fabricacao,
+        ).join(Serrado, Serrado.id == Produto.id_lote_serrado_origem).where(Serrado.id_lote_tora_origem.in_(ids_tora))
+        if filtros.cursor:
+            consulta = consulta.where(Produto.id > _decodificar_cursor(filtros.cursor))
+        produtos = db.execute(consulta.order_by(Produto.id).limit(filtros.limite + 1)).all()
+        if len(produtos) > filtros.limite:
+            produtos = produtos[:filtros.limite]
+            proximo = _codificar_cursor(produtos[-1].id)
+        if not filtros.cursor:
+            total_produtos = db.execute(select(func.count()).select_from(da_tora.subquery())).scalar_one()
+
+    linhagem = schemas.LinhagemDisplay(
+        toras=[schemas.LinhagemTora(**t._mapping) for t in toras],
+        lotes_serrados=[schemas.LinhagemSerrado(**l._mapping) for l in serrados],
+        produtos=[schemas.LinhagemProduto(**p._mapping) for p in produtos],
+        total_lotes_serrados=total_serrados,
+        total_produtos=total_produtos,
+    )
+    return linhagem, proximo
+
+# ===================================
+# RELATÓRIOS (MODELO DE LEITURA)
+# ===================================
+
+Linhagem = models.LinhagemDesnormalizada
+
+AGRUPAMENTOS_RELATORIO = {
+    "especie": Linhagem.especie_madeira_popular,
+    "dof": Linhagem.numero_dof,
+    "serraria": Linhagem.id_equipe_serraria,
+    "fabrica": Linhagem.id_equipe_fabrica,
+}
+
+# Cada papel só agrega a madeira que passou por ele
+RESPONSAVEL_RELATORIO = {
+    "tecnico": Linhagem.id_tecnico_campo,
+    "serraria": Linhagem.id_equipe_serraria,
+    "fabrica": Linhagem.id_equipe_fabrica,
+}
+
+def relatorio_volume(
+    db: Session,
+    current_user,
+    agrupar_por: str,
+    filtros: Optional[schemas.FiltrosLista] = None,
+) -> schemas.RelatorioVolume:
+    """
+    Volume por espécie, DOF, serraria ou fábrica, lido só de
+    linhagem_produtos (sem JOINs). Conta a madeira que já virou produto:
+    cada lote serrado e cada tora entram uma vez por grupo, mesmo com
+    vários produtos. Filtros: período de fabricação, espécie e DOF.
+    """
+    filtros = filtros or schemas.FiltrosLista()
+    papel = papel_do_usuario(current_user)
+    if papel not in RESPONSAVEL_RELATORIO:
+        raise HTTPException(status_code=403, detail="Acesso negado a este relatório")
+    chave = AGRUPAMENTOS_RELATORIO[agrupar_por]
+
+    condicoes = [RESPONSAVEL_RELATORIO[papel] == current_user.id]
+    if filtros.data_inicio is not None:
+        condicoes.append(Linhagem.data_fabricacao >= filtros.data_inicio)
+    if filtros.data_fim is not None:
+        condicoes.append(Linhagem.data_fabricacao <= filtros.data_fim)
+    if filtros.especie:
+        condicoes.append(or_(
+            Linhagem.especie_madeira_popular == filtros.especie,
+            Linhagem.especie_madeira_cientifico == filtros.especie,
+        ))
+    if filtros.numero_dof:
+        condicoes.append(Linhagem.numero_dof == filtros.numero_dof)
+
+    contagens = db.execute(
+        select(
+            chave.label("chave"),
+            func.count().label("produtos"),
+            func.count(Linhagem.id_lote_serrado.distinct()).label("lotes_serrados"),
+            func.count(Linhagem.id_lote_tora.distinct()).label("lotes_tora"),
+        ).where(*condicoes).group_by(chave)
+    ).all()
+
+    def soma_por_lote(coluna_id, coluna_volume) -> dict:
+        # Um lote aparece em uma linha por produto: soma cada um só uma vez
+        lotes = select(chave.label("chave"), coluna_id, coluna_volume.label("volume")).where(*condicoes).distinct().subquery()
+        return dict(db.execute(
+            select(lotes.c.chave, func.sum(lotes.c.volume)).group_by(lotes.c.chave)
+        ).all())
+
+    volume_serrado = soma_por_lote(Linhagem.id_lote_serrado, Linhagem.volume_saida_m3)
+    volume_tora = soma_por_lote(Linhagem.id_lote_tora, Linhagem.volume_estimado_m3)
+
+    nomes = {}
+    if agrupar_por in ("serraria", "fabrica") and contagens:
+        modelo, coluna_nome = (
+            (models.EquipeSerraria, models.EquipeSerraria.nome_serraria) if agrupar_por == "serraria"
+            else (models.EquipeFabrica, models.EquipeFabrica.nome_fabrica)
+        )
+        nomes = dict(db.execute(
+            select(modelo.id, coluna_nome).where(modelo.id.in_([linha.chave for linha in contagens]))
+        ).all())
+
+    itens = [
+        schemas.ItemRelatorioVolume(
+            chave=None if linha.chave is None else str(linha.chave),
+            nome=nomes.get(linha.chave),
+            produtos=linha.produtos,
+            lotes_serrados=linha.lotes_serrados,
+            lotes_tora=linha.lotes_tora,
+            volume_serrado_m3=volume_serrado.get(linha.chave) or 0,
+            volume_tora_m3=volume_tora.get(linha.chave) or 0,
+        )
+        for linha in contagens
+    ]
+    itens.sort(key=lambda item: item.volume_serrado_m3, reverse=True)
+    return schemas.RelatorioVolume(agrupar_por=agrupar_por, itens=itens)
+
+# ===================================
+# VERIFICAÇÃO NA BLOCKCHAIN (ÍNDICE LOCAL)
+# ===================================
+
+def verificar_registro(db: Session, tipo_lote: str, id_lote_custom: str) -> schemas.VerificacaoBlockchain:
+    """Registro do lote no contrato segundo eventos_blockchain (sem eth_call)."""
+    evento = indexador.evento_do_lote(db, id_lote_custom, tipo_lote)
+    verificacao = schemas.VerificacaoBlockchain(
+        tipo_lote=tipo_lote,
+        id_lote_custom=id_lote_custom,
+        registrado=evento is not None,
+        indexado_ate_bloco=indexador.bloco_do_checkpoint(db),
+    )
+    if evento is not None:
+        verificacao.bloco = evento.bloco
+        verificacao.tx_hash = evento.tx_hash
+        verificacao.timestamp_bloco = evento.timestamp_bloco
+        verificacao.responsavel = evento.responsavel
+    return verificacao
+
+# ===================================
+# RASTREABILIDADE PÚBLICA
+# ===================================
+
+def _situacao_ancoragem(linha, nivel: str) -> dict:
+    """Colunas de ancoragem de um nível da linha de linhagem, para os esquemas de rastreio."""
+    return {campo: getattr(linha, f"{campo}_{nivel}") for campo in schemas.SituacaoAncoragem.model_fields}
+
+def _linha_linhagem(db: Session, id_produto_custom: str):
+    """
+    Linha do produto em linhagem_produtos (uma leitura por índice único).
+    Se ainda não existir (ex.: DB_AUTO_MIGRAR=false antes do preenchimento),
+    monta a mesma linha a partir das tabelas de lotes.
+    """
+    linha = db.execute(
+        select(*Linhagem.__table__.c).where(Linhagem.id_lote_produto_custom == id_produto_custom)
+    ).first()
+    if linha is None:
+        linha = db.execute(
+            linhagem.consulta_origem().where(models.LoteProdutoAcabado.id_lote_produto_custom == id_produto_custom)
+        ).first()
+        if linha is not None:
+            log.warning("⚠️ Produto %s sem linha em linhagem_produtos; lido das tabelas de lotes", id_produto_custom)
+    return linha
+
+def rastrear_produto(db: Session, id_produto_custom: str, incluir_prova: bool = False) -> schemas.RastreioDisplay:
+    # Produto, lote serrado e tora já estão na mesma linha do modelo de leitura
+    linha = _linha_linhagem(db, id_produto_custom)
+    if linha is None:
+        raise HTTPException(status_code=404, detail="Produto não encontrado")
+
+    resposta = schemas.RastreioDisplay(
+        produto=schemas.RastreioProduto(
+            id=linha.id_produto,
+            id_custom=linha.id_lote_produto_custom,
+            nome=linha.nome_produto,
+            sku=linha.sku_produto,
+            data_fabricacao=linha.data_fabricacao,
+            dados_acabamento=linha.dados_acabamento,
+            **_situacao_ancoragem(linha, "produto")
+        ),
+        lote_serrado=schemas.RastreioLoteSerrado(
+            id=linha.id_lote_serrado,
+            id_custom=linha.id_lote_serrado_custom,
+            tipo_produto=linha.tipo_produto,
+            dimensoes=linha.dimensoes,
+            volume_m3=float(linha.volume_saida_m3),
+            data_processamento=linha.data_processamento,
+            **_situacao_ancoragem(linha, "serrado")
+        ),
+        lote_tora=schemas.RastreioLoteTora(
+            id=linha.id_lote_tora,
+            id_custom=linha.id_lote_tora_custom,
+            especie_popular=linha.especie_madeira_popular,
+            especie_cientifica=linha.especie_madeira_cientifico,
+            volume_m3=float(linha.volume_estimado_m3),
+            numero_dof=linha.numero_dof,
+            numero_licenca=linha.numero_licenca_ambiental,
+            coordenadas=schemas.Coordenadas(
+                lat=float(linha.coordenadas_gps_lat),
+                lon=float(linha.coordenadas_gps_lon)
+            ),
+            data_registro=linha.data_hora_registro,
+            **_situacao_ancoragem(linha, "tora")
+        )
+    )
+
+    if incluir_prova:
+        lotes = [("produto", linha.id_produto), ("serrado", linha.id_lote_serrado), ("tora", linha.id_lote_tora)]
+        provas = ancoragem.obter_provas(db, lotes)
+        resposta.ancoragem = {
+            tipo: provas.get((tipo, id_lote)) for tipo, id_lote in lotes
+        }
+
+    return resposta
+
+# ===================================
+# CACHE DA RASTREABILIDADE
+# ===================================
+
+# Produtos acabados não mudam depois de criados; o que pode mudar é um lote
+# de origem corrigido, e aí as entradas dos produtos afetados são
+# invalidadas no commit (ver _coletar_invalidacoes abaixo). O TTL limita o
+# tempo de uma entrada que escape da invalidação (ex.: UPDATE em massa).
+CACHE_RASTREIO_TTL_S = float(os.getenv("CACHE_RASTREIO_TTL_S", "3600"))
+# A situação da ancoragem faz parte da resposta e muda pelo despachante,
+# que pode rodar em outro processo (ou worker, com o LRU local): a
+# invalidação no commit não alcança os outros caches. Enquanto algum lote
+# da cadeia não estiver confirmado, a entrada (e o max-age) dura só isto.
+CACHE_RASTREIO_TTL_PENDENTE_S = float(os.getenv("CACHE_RASTREIO_TTL_PENDENTE_S", "10"))
+CACHE_RASTREIO_TTL_NEGATIVO_S = float(os.getenv("CACHE_RASTREIO_TTL_NEGATIVO_S", "30"))
+CACHE_RASTREIO_MAX_ITENS = int(os.getenv("CACHE_RASTREIO_MAX_ITENS", "20000"))
+# Cache-Control enviado a navegadores/CDN
+RASTREIO_MAX_AGE_S = int(os.getenv("RASTREIO_MAX_AGE_S", "300"))
+
+cache_rastreio = cache.criar_cache("rastreio", max_itens=CACHE_RASTREIO_MAX_ITENS, ttl_s=CACHE_RASTREIO_TTL_S)
+
+# Entrada negativa: ID consultado que não existe
+NAO_ENCONTRADO = {"nao_encontrado": True}
+
+def _etag(dados: dict) -> str:
+    corpo = json.dumps(dados, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return '"' + hashlib.sha256(corpo.encode("utf-8")).hexdigest()[:32] + '"'
+
+def _nao_encontrado() -> HTTPException:
+    return HTTPException(
+        status_code=404,
+        detail="Produto não encontrado",
+        headers={"Cache-Control": f"public, max-age={int(CACHE_RASTREIO_TTL_NEGATIVO_S)}"},
+    )
+
+def rastreio_em_cache(id_produto_custom: str) -> Optional[dict]:
+    """
+    Entrada do cache ({"etag", "dados"}) ou None se não estiver em cache.
+    Levanta 404 se o ID estiver em cache como inexistente.
+    """
+    entrada = cache_rastreio.get(id_produto_custom)
+    if entrada == NAO_ENCONTRADO:
+        raise _nao_encontrado()
+    return entrada
+
+def _ancoragem_final(dados: dict) -> bool:
+    """Todos os lotes da cadeia já confirmados na blockchain (situação que não muda mais)."""
+    niveis = [dados.get(nivel) for nivel in ("produto", "lote_serrado", "lote_tora")]
+    return all(n.get("status_ancoragem") == ancoragem.STATUS_CONFIRMADO for n in niveis if n)
+
+def rastrear_produto_cacheado(db: Session, id_produto_custom: str) -> dict:
+    """Read-through do /rastrear (sem prova): retorna {"etag", "dados"}."""
+    entrada = rastreio_em_cache(id_produto_custom)
+    if entrada is not None:
+        return entrada
+
+    try:
+        dados = rastrear_produto(db, id_produto_custom).model_dump(mode="json", exclude_unset=True)
+    except HTTPException as e:
+        if e.status_code == 404:
+            cache_rastreio.set(id_produto_custom, NAO_ENCONTRADO, ttl_s=CACHE_RASTREIO_TTL_NEGATIVO_S)
+            raise _nao_encontrado()
+        raise
+
+    final = _ancoragem_final(dados)
+    entrada = {"etag": _etag(dados), "dados": dados, "final": final}
+    cache_rastreio.set(id_produto_custom, entrada, ttl_s=None if final else CACHE_RASTREIO_TTL_PENDENTE_S)
+    return entrada
+
+def resposta_rastreio(entrada: dict, if_none_match: Optional[str]) -> Response:
+    """200 com ETag/Cache-Control, ou 304 se o cliente já tem esta versão."""
+    max_age = RASTREIO_MAX_AGE_S if entrada.get("final", True) else min(RASTREIO_MAX_AGE_S, int(CACHE_RASTREIO_TTL_PENDENTE_S))
+    headers = {
+        "ETag": entrada["etag"],
+        "Cache-Control": f"public, max-age={max_age}",
+    }
+    if if_none_match:
+        etags_cliente = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+        if entrada["etag"] in etags_cliente or "*" in etags_cliente:
+            return Response(status_code=304, headers=headers)
+    return JSONResponse(entrada["dados"], headers=headers)
+
+def _produtos_afetados(session: Session, ids_tora: set, ids_serrado: set) -> set:
+    """IDs custom dos produtos que descendem dos lotes alterados."""
+    Produto, Serrado = models.LoteProdutoAcabado, models.LoteSerrado
+    condicoes = []
+    if ids_serrado:
+        condicoes.append(Produto.id_lote_serrado_origem.in_(ids_serrado))
+    if ids_tora:
+        condicoes.append(Serrado.id_lote_tora_origem.in_(ids_tora))
+    consulta = (
+        select(Produto.id_lote_produto_custom)
+        .join(Serrado, Serrado.id == Produto.id_lote_serrado_origem)
+        .where(or_(*condicoes))
+    )
+    return set(session.connection().execute(consulta).scalars())
+
+@event.listens_for(Session, "after_flush")
+def _coletar_invalidacoes(session: Session, flush_context):
+    """
+    Anota, durante a transação, quais produtos precisam sair do cache. A
+    remoção só acontece no commit (após um rollback nada muda).
+    """
+    chaves = set()
+    ids_tora, ids_serrado = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, models.LoteProdutoAcabado):
+            chaves.add(obj.id_lote_produto_custom)  # novo produto: derruba entrada negativa
+        elif isinstance(obj, models.LoteSerrado) and obj not in session.new:
+            ids_serrado.add(obj.id)
+        elif isinstance(obj, models.LoteTora) and obj not in session.new:
+            ids_tora.add(obj.id)
+
+    if ids_tora or ids_serrado:
+        chaves |= _produtos_afetados(session, ids_tora, ids_serrado)
+    if chaves:
+        session.info.setdefault("rastreio_invalidar", set()).update(chaves)
+
+@event.listens_for(Session, "after_commit")
+def _aplicar_invalidacoes(session: Session):
+    chaves = session.info.pop("rastreio_invalidar", None)
+    if chaves:
+        cache_rastreio.delete(*chaves)
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_invalidacoes(session: Session):
+    session.info.pop("rastreio_invalidar", None)
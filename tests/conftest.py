@@ -0,0 +1,113 @@
+"""
+Fixtures comuns: banco SQLite temporário (recriado a cada teste) e uma
+cadeia eth-tester em memória, sem rede externa.
+"""
+
+import os
+import sys
+import json
+import datetime
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# Antes de importar database: o engine é criado na importação
+_DIRETORIO = tempfile.mkdtemp(prefix="rastreabilidade-testes-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_DIRETORIO, 'testes.db')}")
+os.environ.setdefault("SECRET_KEY", "testes")
+os.environ.setdefault("LOG_FORMATO", "texto")
+
+import database  # noqa: E402
+import models  # noqa: E402
+
+# Runtime mínimo que emite log2(topic0, topic1, dados) a partir do calldata
+# (topic0 e topic1 nos primeiros 64 bytes): permite emitir os eventos do ABI
+# do contrato sem compilar o contrato real.
+RUNTIME_EMISSOR = bytes.fromhex("366000600037" "602051" "600051" "60403603" "6040" "a2" "00")
+
+
+@pytest.fixture
+def db_limpo():
+    """Recria todas as tabelas; retorna a fábrica de sessões."""
+    database.Base.metadata.drop_all(database.engine)
+    database.Base.metadata.create_all(database.engine)
+    yield database.SessionLocal
+    database.engine.dispose()
+
+
+@pytest.fixture
+def w3():
+    from web3 import Web3, EthereumTesterProvider
+    return Web3(EthereumTesterProvider())
+
+
+@pytest.fixture
+def contrato_emissor(w3):
+    """Contrato com o ABI real, num endereço cujo código só emite eventos."""
+    init = bytes.fromhex("60%02x600c60003960%02x6000f3" % (len(RUNTIME_EMISSOR), len(RUNTIME_EMISSOR))) + RUNTIME_EMISSOR
+    tx = w3.eth.send_transaction({"from": w3.eth.accounts[0], "data": init})
+    endereco = w3.eth.get_transaction_receipt(tx)["contractAddress"]
+    with open(os.path.join(RAIZ, "contract_abi.json")) as arquivo:
+        abi = json.load(arquivo)
+    return w3.eth.contract(address=endereco, abi=abi)
+
+
+@pytest.fixture
+def emitir(w3, contrato_emissor):
+    """emitir(evento, id_lote, tipos, valores) -> tx_hash (bytes)."""
+    from eth_abi import encode
+    from web3 import Web3
+
+    def _emitir(evento: str, id_lote: str, tipos: list, valores: list):
+        topico = bytes.fromhex(getattr(contrato_emissor.events, evento).topic[2:])
+        dados = topico + bytes(Web3.keccak(text=id_lote)) + encode(tipos, valores)
+        return w3.eth.send_transaction({"from": w3.eth.accounts[0], "to": contrato_emissor.address, "data": dados})
+    return _emitir
+
+
+@pytest.fixture
+def cadeia(db_limpo):
+    """Uma cadeia tora → serrado → produto gravada pelo ORM; retorna os ids."""
+    with db_limpo() as db:
+        tecnico = models.TecnicoCampo(nome="t", email="t@teste", hash_senha="x")
+        serraria = models.EquipeSerraria(nome_responsavel="s", nome_serraria="Serraria Teste", email="s@teste", hash_senha="x")
+        fabrica = models.EquipeFabrica(nome_responsavel="f", email="f@teste", hash_senha="x")
+        db.add_all([tecnico, serraria, fabrica])
+        db.flush()
+        tora = models.LoteTora(
+            id_lote_custom="TORA-T-001", id_tecnico_campo=tecnico.id, coordenadas_gps_lat=-3.1,
+            coordenadas_gps_lon=-60.0, numero_dof="DOF-1", numero_licenca_ambiental="LIC",
+            especie_madeira_popular="Ipê", volume_estimado_m3=10,
+        )
+        serrado = models.LoteSerrado(
+            id_lote_serrado_custom="SERR-T-001", lote_tora_origem=tora, id_equipe_serraria=serraria.id,
+            data_recebimento_tora=datetime.datetime.now(), volume_saida_m3=4,
+        )
+        produto = models.LoteProdutoAcabado(
+            id_lote_produto_custom="PROD-T-001", lote_serrado_origem=serrado, id_equipe_fabrica=fabrica.id,
+            sku_produto="SKU", nome_produto="Mesa", link_qr_code="x",
+        )
+        db.add_all([tora, serrado, produto])
+        db.commit()
+        return {
+            "tecnico": tecnico.id, "serraria": serraria.id, "fabrica": fabrica.id,
+            "tora": tora.id, "serrado": serrado.id, "produto": produto.id,
+            "id_produto_custom": produto.id_lote_produto_custom,
+        }
+
+
+@pytest.fixture
+def blockchain_local(w3, monkeypatch):
+    """Módulo blockchain apontando para a cadeia eth-tester (contrato num endereço sem código)."""
+    import blockchain
+    monkeypatch.setattr(blockchain, "PRIVATE_KEY", "0x" + "00" * 31 + "01")  # conta 0 do eth-tester
+    monkeypatch.setattr(blockchain, "WALLET_ADDRESS", w3.eth.accounts[0])
+    monkeypatch.setattr(blockchain, "CHAIN_ID", w3.eth.chain_id)
+    monkeypatch.setattr(blockchain, "gerenciador_nonce", blockchain.GerenciadorNonce(blockchain._nonce_pendente_da_rede))
+    monkeypatch.setattr(blockchain, "oraculo_gas", blockchain.OraculoGas())
+    blockchain.configurar(w3, w3.eth.contract(address="0x000000000000000000000000000000000000dEaD", abi=blockchain.CONTRACT_ABI))
+    yield blockchain
+    blockchain.configurar(None, None)
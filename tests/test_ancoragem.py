@@ -0,0 +1,91 @@
+import datetime
+
+import ancoragem
+import models
+import schemas
+import servicos
+
+
+def _nova_tora(db_limpo) -> int:
+    with db_limpo() as db:
+        tecnico = models.TecnicoCampo(nome="t", email="t@teste", hash_senha="x")
+        db.add(tecnico)
+        db.commit()
+        lote = servicos.criar_lote_tora(db, schemas.LoteToraCreate(
+            coordenadas_gps_lat="-3.1", coordenadas_gps_lon="-60.0", numero_dof="DOF-1",
+            numero_licenca_ambiental="LIC", especie_madeira_popular="Ipê", volume_estimado_m3="10",
+        ), tecnico.id)
+        return lote.id
+
+
+def test_despachante_envia_e_confirma_no_eth_tester(db_limpo, blockchain_local, w3):
+    id_tora = _nova_tora(db_limpo)
+    with db_limpo() as db:
+        item = db.query(models.FilaAncoragem).one()
+        assert (item.tipo_lote, item.id_lote, item.status) == ("tora", id_tora, ancoragem.STATUS_PENDENTE)
+
+    despachante = ancoragem.DespachanteAncoragem(session_factory=db_limpo)
+    assert despachante.processar_uma_vez() == 1  # envio; o recibo fica para depois de INTERVALO_RECIBO_S
+    with db_limpo() as db:
+        item = db.query(models.FilaAncoragem).one()
+        assert item.status == ancoragem.STATUS_ENVIADO and item.tx_hash
+        assert db.get(models.LoteTora, id_tora).status_ancoragem == ancoragem.STATUS_ENVIADO
+        item.proxima_tentativa = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+        db.commit()
+
+    assert despachante.processar_uma_vez() == 1  # recibo
+    with db_limpo() as db:
+        item = db.query(models.FilaAncoragem).one()
+        assert item.status == ancoragem.STATUS_CONFIRMADO
+        recibo = w3.eth.get_transaction_receipt(item.tx_hash)
+        assert recibo["status"] == 1 and item.bloco == recibo["blockNumber"]
+        tora = db.get(models.LoteTora, id_tora)
+        assert (tora.status_ancoragem, tora.tx_hash, tora.tentativas_ancoragem) == (ancoragem.STATUS_CONFIRMADO, item.tx_hash, 1)
+
+    assert despachante.processar_uma_vez() == 0  # fila vazia
+
+
+def test_despachante_espera_sem_blockchain(db_limpo):
+    _nova_tora(db_limpo)
+    assert ancoragem.DespachanteAncoragem(session_factory=db_limpo).processar_uma_vez() == 0
+    with db_limpo() as db:
+        assert db.query(models.FilaAncoragem).one().status == ancoragem.STATUS_PENDENTE
+
+
+def _registro_tora(id_lote_custom):
+    return {
+        "id_lote_custom": id_lote_custom, "coordenadas_lat": -3.1, "coordenadas_lon": -60.0, "numero_dof": "DOF-1",
+        "numero_licenca": "LIC", "especie": "Ipê", "volume_m3": 10.0,
+    }
+
+
+def test_grupo_merkle_nao_fica_atras_de_itens_diretos_mais_novos(db_limpo, blockchain_local, monkeypatch):
+    monkeypatch.setattr(ancoragem, "ITENS_POR_VARREDURA", 1)
+    monkeypatch.setattr(ancoragem, "MERKLE_TAMANHO_MAX", 2)
+    despachante = ancoragem.DespachanteAncoragem(session_factory=db_limpo)
+
+    monkeypatch.setattr(ancoragem, "MODO", ancoragem.MODO_MERKLE)
+    with db_limpo() as db:
+        for id_lote in (1, 2):
+            ancoragem.enfileirar(db, "tora", id_lote, f"TORA-M-{id_lote}", _registro_tora(f"TORA-M-{id_lote}"))
+        db.commit()
+    assert despachante._agrupar_merkle() == 2
+
+    # Tráfego direto contínuo, sempre vencido, chegando depois do grupo
+    monkeypatch.setattr(ancoragem, "MODO", ancoragem.MODO_DIRETO)
+    with db_limpo() as db:
+        for id_lote in (3, 4, 5):
+            ancoragem.enfileirar(db, "tora", id_lote, f"TORA-D-{id_lote}", _registro_tora(f"TORA-D-{id_lote}"))
+        db.commit()
+
+    assert despachante.processar_uma_vez() == 1
+    with db_limpo() as db:
+        assert db.query(models.LoteMerkle).one().status == ancoragem.STATUS_ENVIADO
+        diretos = db.query(models.FilaAncoragem).filter(models.FilaAncoragem.modo == ancoragem.MODO_DIRETO)
+        assert {item.status for item in diretos} == {ancoragem.STATUS_PENDENTE}
+
+    # Em seguida, os diretos, do mais antigo ao mais novo
+    assert despachante.processar_uma_vez() == 1
+    with db_limpo() as db:
+        enviados = db.query(models.FilaAncoragem.id_lote).filter(models.FilaAncoragem.status == ancoragem.STATUS_ENVIADO)
+        assert [linha.id_lote for linha in enviados] == [3]
@@ -0,0 +1,250 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import blockchain
+
+
+class RedeFalsa:
+    """Fonte do nonce 'pending' da rede; conta as consultas."""
+
+    def __init__(self, nonce=0, atraso_s=0.0):
+        self.nonce = nonce
+        self.atraso_s = atraso_s
+        self.consultas = 0
+
+    def __call__(self):
+        self.consultas += 1
+        time.sleep(self.atraso_s)  # alarga a janela de corrida da primeira reserva
+        return self.nonce
+
+
+def _em_threads(funcao, quantidade=8):
+    barreira = threading.Barrier(quantidade)
+    resultados = [None] * quantidade
+
+    def executar(indice):
+        barreira.wait()
+        resultados[indice] = funcao()
+
+    threads = [threading.Thread(target=executar, args=(i,)) for i in range(quantidade)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return resultados
+
+
+# ===================================
+# GERENCIADOR DE NONCE
+# ===================================
+
+def test_reservas_concorrentes_sao_unicas_e_consultam_a_rede_uma_vez():
+    rede = RedeFalsa(nonce=5, atraso_s=0.01)
+    gerenciador = blockchain.GerenciadorNonce(rede)
+    por_thread = _em_threads(lambda: [gerenciador.reservar() for _ in range(50)])
+    nonces = [nonce for lista in por_thread for nonce in lista]
+    assert sorted(nonces) == list(range(5, 5 + 8 * 50))
+    assert all(lista == sorted(lista) for lista in por_thread)
+    assert rede.consultas == 1
+
+
+def test_liberar_reutiliza_a_menor_lacuna_primeiro():
+    gerenciador = blockchain.GerenciadorNonce(RedeFalsa(nonce=0))
+    assert [gerenciador.reservar() for _ in range(5)] == [0, 1, 2, 3, 4]
+    gerenciador.liberar(3)
+    gerenciador.liberar(1)
+    gerenciador.liberar(1)  # repetido não duplica a lacuna
+    gerenciador.liberar(9)  # nunca reservado: ignorado
+    assert [gerenciador.reservar() for _ in range(3)] == [1, 3, 5]
+
+
+def test_reservar_e_liberar_concorrentes_nao_perdem_nem_repetem_nonces():
+    gerenciador = blockchain.GerenciadorNonce(RedeFalsa(nonce=100))
+
+    def trabalhar():
+        enviados = []
+        for i in range(200):
+            nonce = gerenciador.reservar()
+            if i % 3 == 0:
+                gerenciador.liberar(nonce)  # falhou antes de chegar à rede
+            else:
+                gerenciador.marcar_enviado(nonce)
+                enviados.append(nonce)
+        return enviados
+
+    enviados = [nonce for lista in _em_threads(trabalhar) for nonce in lista]
+    assert len(enviados) == len(set(enviados))
+    # Enviados + lacunas pendentes cobrem exatamente a faixa usada
+    assert sorted(enviados + gerenciador._lacunas) == list(range(100, gerenciador._proximo))
+    assert not gerenciador._reservados
+
+
+def test_nonce_too_low_ressincroniza_com_a_rede(monkeypatch):
+    rede = RedeFalsa(nonce=0)
+    gerenciador = blockchain.GerenciadorNonce(rede)
+    for _ in range(3):
+        gerenciador.marcar_enviado(gerenciador.reservar())
+    rede.nonce = 6  # outro processo enviou 3 transações com a mesma carteira
+
+    def enviar(_raw):
+        raise ValueError({"code": -32000, "message": "nonce too low"})
+
+    monkeypatch.setattr(blockchain, "gerenciador_nonce", gerenciador)
+    monkeypatch.setattr(blockchain, "obter_w3", lambda: SimpleNamespace(eth=SimpleNamespace(send_raw_transaction=enviar)))
+    nonce = gerenciador.reservar()
+    assert nonce == 3
+    with pytest.raises(ValueError):
+        blockchain.transmitir_transacao(SimpleNamespace(raw_transaction=b"\x00"), nonce)
+
+    assert rede.consultas == 2
+    assert gerenciador._lacunas == []  # o 3 devolvido ficou abaixo da rede
+    assert [gerenciador.reservar() for _ in range(2)] == [6, 7]
+
+
+def test_ressincronizar_com_rede_atrasada_preenche_lacunas_sem_tocar_reservas_em_voo():
+    rede = RedeFalsa(nonce=0)
+    gerenciador = blockchain.GerenciadorNonce(rede)
+    for _ in range(10):
+        nonce = gerenciador.reservar()
+        if nonce not in (7, 8):
+            gerenciador.marcar_enviado(nonce)
+    # 7 ainda está em construção; a reserva do 8 foi abandonada
+    gerenciador._reservados[8] = time.monotonic() - gerenciador.RESERVA_MAX_S - 1
+    rede.nonce = 5  # transações 5..9 sumiram da mempool
+
+    gerenciador.ressincronizar()
+    assert [gerenciador.reservar() for _ in range(5)] == [5, 6, 8, 9, 10]
+
+
+# ===================================
+# ORÁCULO DE GAS
+# ===================================
+
+class EthFalso:
+    """w3.eth mínimo para o oráculo; conta as chamadas RPC por método."""
+
+    def __init__(self, base_fee=100):
+        self.base_fee = base_fee
+        self.chamadas = {}
+
+    def _contar(self, metodo):
+        self.chamadas[metodo] = self.chamadas.get(metodo, 0) + 1
+
+    def get_block(self, identificador):
+        self._contar("eth_getBlockByNumber")
+        return {"number": 1, "baseFeePerGas": self.base_fee}
+
+    @property
+    def max_priority_fee(self):
+        self._contar("eth_maxPriorityFeePerGas")
+        return 2
+
+    @property
+    def gas_price(self):
+        self._contar("eth_gasPrice")
+        return 50
+
+
+class ChamadaFalsa:
+    """ContractFunction mínima: nome, argumentos e estimate_gas contado."""
+
+    def __init__(self, fn_name, *args, estimativa=100000, erro=None):
+        self.fn_name, self.args = fn_name, args
+        self.estimativa, self.erro = estimativa, erro
+        self.estimativas = 0
+
+    def estimate_gas(self, transacao):
+        self.estimativas += 1
+        if self.erro:
+            raise self.erro
+        return self.estimativa
+
+
+@pytest.fixture
+def oraculo(monkeypatch):
+    """OraculoGas (TTL 15 s) com w3 falso e relógio controlado; é também o global do módulo."""
+    relogio = SimpleNamespace(agora=1000.0)
+    relogio.monotonic = lambda: relogio.agora
+    eth = EthFalso()
+    monkeypatch.setattr(blockchain, "time", relogio)
+    monkeypatch.setattr(blockchain, "obter_w3", lambda: SimpleNamespace(eth=eth))
+    oraculo = blockchain.OraculoGas(ttl_s=15, usar_eip1559=True)
+    monkeypatch.setattr(blockchain, "oraculo_gas", oraculo)
+    return oraculo, eth, relogio
+
+
+def test_taxas_em_cache_ate_o_ttl(oraculo):
+    oraculo, eth, relogio = oraculo
+    assert oraculo.taxas() == {"maxFeePerGas": 2 * 100 + 2, "maxPriorityFeePerGas": 2}
+    assert eth.chamadas == {"eth_getBlockByNumber": 1, "eth_maxPriorityFeePerGas": 1}
+
+    relogio.agora += 14.9
+    eth.base_fee = 300
+    assert oraculo.taxas()["maxFeePerGas"] == 202  # ainda do cache
+    assert eth.chamadas == {"eth_getBlockByNumber": 1, "eth_maxPriorityFeePerGas": 1}
+
+    relogio.agora += 0.1  # venceu
+    assert oraculo.taxas()["maxFeePerGas"] == 602
+    assert eth.chamadas == {"eth_getBlockByNumber": 2, "eth_maxPriorityFeePerGas": 2}
+    estatisticas = oraculo.estatisticas()
+    assert (estatisticas["taxas_hits"], estatisticas["taxas_misses"]) == (1, 2)
+
+
+def test_taxas_devolvidas_sao_copias(oraculo):
+    oraculo, _, _ = oraculo
+    oraculo.taxas()["maxFeePerGas"] = 0
+    assert oraculo.taxas()["maxFeePerGas"] == 202
+
+
+def test_taxas_legadas_sem_eip1559(oraculo):
+    oraculo, eth, _ = oraculo
+    eth.base_fee = None  # rede sem London
+    assert oraculo.taxas() == {"gasPrice": 50}
+    oraculo.usar_eip1559 = False
+    oraculo.atualizar_taxas()
+    assert eth.chamadas == {"eth_getBlockByNumber": 1, "eth_gasPrice": 2}
+
+
+def test_limite_memorizado_por_funcao_e_faixa_de_tamanho(oraculo):
+    oraculo, _, _ = oraculo
+    curta = ChamadaFalsa("registrarLoteTora", "TORA-20240101-001", "DOF-1")
+    assert oraculo.limite_gas(curta, "0xremetente") == int(100000 * blockchain.GAS_MARGEM_LIMITE)
+    # Mesma função, argumentos na mesma faixa de 32 bytes: sem nova estimativa
+    outra_curta = ChamadaFalsa("registrarLoteTora", "TORA-20240101-002", "DOF-2")
+    assert oraculo.limite_gas(outra_curta, "0xremetente") == 120000
+    assert (curta.estimativas, outra_curta.estimativas) == (1, 0)
+
+    longa = ChamadaFalsa("registrarLoteTora", "TORA-20240101-003", "D" * 40, estimativa=150000)
+    assert oraculo.limite_gas(longa, "0xremetente") == 180000
+    outra_funcao = ChamadaFalsa("registrarLoteSerrado", "TORA-20240101-001", "DOF-1", estimativa=200000)
+    assert oraculo.limite_gas(outra_funcao, "0xremetente") == 240000
+    assert (longa.estimativas, outra_funcao.estimativas) == (1, 1)
+
+    estatisticas = oraculo.estatisticas()
+    assert (estatisticas["limite_hits"], estatisticas["limite_misses"], estatisticas["limites_memorizados"]) == (1, 3, 3)
+
+
+def test_falha_na_estimativa_usa_o_padrao_sem_memorizar(oraculo):
+    oraculo, _, _ = oraculo
+    falha = ChamadaFalsa("registrarLoteTora", "TORA-1", erro=ValueError("execution reverted"))
+    assert oraculo.limite_gas(falha, "0xremetente") == blockchain.GAS_LIMITE_PADRAO
+    assert oraculo.estatisticas()["limites_memorizados"] == 0
+    ok = ChamadaFalsa("registrarLoteTora", "TORA-1")
+    assert oraculo.limite_gas(ok, "0xremetente") == 120000 and ok.estimativas == 1
+
+
+def test_contadores_exportados_em_metricas(oraculo):
+    oraculo, _, relogio = oraculo
+    chamada = ChamadaFalsa("registrarLoteTora", "TORA-1")
+    for _ in range(3):
+        oraculo.taxas()
+        oraculo.limite_gas(chamada, "0xremetente")
+    relogio.agora += 15
+    oraculo.taxas()
+    metrica = next(m for m in blockchain.metricas._registro if m.nome == "blockchain_gas_cache_total")
+    assert metrica._amostras() == {
+        ("taxas", "hit"): 2, ("taxas", "miss"): 2, ("limite", "hit"): 2, ("limite", "miss"): 1,
+    }
@@ -0,0 +1,51 @@
+import fnmatch
+
+import cache
+
+
+class RedisFalso:
+    """Dublê do cliente Redis com o que o CacheRedis usa."""
+
+    def __init__(self):
+        self.dados = {}
+
+    def get(self, chave):
+        return self.dados.get(chave)
+
+    def set(self, chave, valor, ex=None):
+        self.dados[chave] = valor
+
+    def delete(self, *chaves):
+        for chave in chaves:
+            self.dados.pop(chave, None)
+
+    unlink = delete
+
+    def scan_iter(self, match="*", count=None):
+        return [chave for chave in list(self.dados) if fnmatch.fnmatch(chave, match)]
+
+
+def test_redis_limpar_remove_so_o_prefixo():
+    cliente = RedisFalso()
+    rastreio = cache.CacheRedis("rastreio", cliente)
+    outro = cache.CacheRedis("outro", cliente)
+    for i in range(7):
+        rastreio.set(f"PROD-{i}", {"i": i})
+    outro.set("x", 1)
+
+    rastreio.limpar(lote=3)
+
+    assert rastreio.get("PROD-0") is None
+    assert not any(chave.startswith(rastreio.prefixo) for chave in cliente.dados)
+    assert outro.get("x") == 1
+
+
+def test_lru_expira_e_limpa():
+    lru = cache.CacheLRU("teste", max_itens=2, ttl_s=60)
+    lru.set("a", 1)
+    lru.set("b", 2, ttl_s=0)
+    lru.set("c", 3)
+    assert lru.get("b") is None
+    assert lru.get("c") == 3
+    lru.limpar()
+    assert lru.get("c") is None
@@ -0,0 +1,28 @@
+import identificadores
+import models
+
+
+def test_upsert_aloca_numeros_consecutivos(db_limpo):
+    with db_limpo() as db:
+        assert identificadores.alocar_id(db, "TORA").endswith("-001")
+        ids = identificadores.alocar_ids(db, "TORA", 3, dia="20240101")
+        assert ids == ["TORA-20240101-001", "TORA-20240101-002", "TORA-20240101-003"]
+        assert identificadores.alocar_ids(db, "TORA", 1, dia="20240101") == ["TORA-20240101-004"]
+        db.commit()
+
+
+def test_caminho_sem_upsert_continua_a_sequencia(db_limpo, monkeypatch):
+    monkeypatch.setattr(identificadores, "_INSERTS", {})
+    tabela = models.ContadorLote.__table__
+    with db_limpo() as db:
+        assert identificadores.alocar_ids(db, "SERR", 2, dia="20240101") == ["SERR-20240101-001", "SERR-20240101-002"]
+        assert identificadores.alocar_ids(db, "SERR", 1, dia="20240101") == ["SERR-20240101-003"]
+        db.commit()
+        assert db.execute(tabela.select()).one().ultimo == 3
+
+
+def test_rollback_devolve_o_numero(db_limpo):
+    with db_limpo() as db:
+        identificadores.alocar_ids(db, "PROD", 1, dia="20240101")
+        db.rollback()
+        assert identificadores.alocar_ids(db, "PROD", 1, dia="20240101") == ["PROD-20240101-001"]
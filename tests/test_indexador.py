@@ -0,0 +1,56 @@
+import datetime
+
+import indexador
+import models
+
+
+def _eventos_da_cadeia(w3, emitir):
+    conta = w3.eth.accounts[0]
+    tx_tora = emitir("LoteToraRegistrado", "TORA-1", ["string", "uint256", "address", "uint256"], ["Ipe", 1050, conta, 123])
+    emitir("LoteSerradoRegistrado", "SERR-1", ["string", "uint256", "address", "uint256"], ["TORA-1", 400, conta, 124])
+    emitir("ProdutoAcabadoRegistrado", "PROD-1", ["string", "string", "address", "uint256"], ["SERR-1", "Mesa", conta, 125])
+    return tx_tora
+
+
+def test_processar_uma_vez_grava_eventos_da_janela(db_limpo, w3, contrato_emissor, emitir):
+    tx_tora = _eventos_da_cadeia(w3, emitir)
+    with db_limpo() as db:
+        db.add(models.FilaAncoragem(
+            tipo_lote="tora", id_lote=1, id_lote_custom="TORA-1", dados="{}", status="enviado",
+            tx_hash="0x" + bytes(tx_tora).hex(), proxima_tentativa=datetime.datetime.now(),
+        ))
+        db.commit()
+
+    ix = indexador.IndexadorEventos(session_factory=db_limpo, w3=w3, contrato=contrato_emissor, confirmacoes=0)
+    avancou = ix.processar_uma_vez()
+    assert avancou == w3.eth.block_number + 1
+    assert ix.processar_uma_vez() == 0  # em dia
+
+    with db_limpo() as db:
+        eventos = {e.tipo_lote: e for e in db.query(models.EventoBlockchain)}
+        assert set(eventos) == {"tora", "serrado", "produto"}
+        assert eventos["tora"].id_lote_custom == "TORA-1"  # resolvido pela fila
+        assert float(eventos["tora"].volume_m3) == 10.5
+        assert eventos["serrado"].id_lote_origem == "TORA-1"
+        assert indexador.bloco_do_checkpoint(db) == w3.eth.block_number
+        assert indexador.lote_existe(db, "PROD-1", "produto", consultar_rede=False)
+
+
+def test_reorg_recua_e_reindexa(db_limpo, w3, contrato_emissor, emitir):
+    _eventos_da_cadeia(w3, emitir)
+    ix = indexador.IndexadorEventos(session_factory=db_limpo, w3=w3, contrato=contrato_emissor, confirmacoes=0)
+    ix.blocos_por_consulta = 2
+    while ix.processar_uma_vez():
+        pass
+
+    with db_limpo() as db:
+        checkpoint = db.get(models.CheckpointIndexador, indexador.NOME_CHECKPOINT)
+        checkpoint.hash_ultimo_bloco = "0xdead"  # hash que não está mais na cadeia
+        db.commit()
+
+    assert ix.processar_uma_vez() == 0
+    while ix.processar_uma_vez():
+        pass
+    with db_limpo() as db:
+        assert db.query(models.EventoBlockchain).count() == 3
+        assert indexador.bloco_do_checkpoint(db) == w3.eth.block_number
@@ -0,0 +1,97 @@
+import datetime
+
+from sqlalchemy import text
+
+import ancoragem
+import linhagem
+import models
+
+Linhagem = models.LinhagemDesnormalizada
+
+
+def _linha(db, id_produto):
+    db.expire_all()
+    return db.get(Linhagem, id_produto)
+
+
+def test_linha_criada_junto_com_o_produto(db_limpo, cadeia):
+    with db_limpo() as db:
+        linha = _linha(db, cadeia["produto"])
+        assert linha is not None
+        assert (linha.id_lote_produto_custom, linha.id_lote_serrado_custom, linha.id_lote_tora_custom) == \
+            ("PROD-T-001", "SERR-T-001", "TORA-T-001")
+        assert (linha.id_lote_serrado, linha.id_lote_tora, linha.numero_dof) == (cadeia["serrado"], cadeia["tora"], "DOF-1")
+        assert linha.especie_madeira_popular == "Ipê" and float(linha.volume_saida_m3) == 4
+
+
+def test_correcao_na_tora_atualiza_a_linha(db_limpo, cadeia):
+    with db_limpo() as db:
+        tora = db.get(models.LoteTora, cadeia["tora"])
+        tora.especie_madeira_popular = "Cumaru"
+        tora.numero_dof = "DOF-2"
+        db.commit()
+        linha = _linha(db, cadeia["produto"])
+        assert (linha.especie_madeira_popular, linha.numero_dof) == ("Cumaru", "DOF-2")
+        assert linha.nome_produto == "Mesa"  # colunas não alteradas ficam como estavam
+
+
+def test_ancoragem_refletida_atualiza_as_colunas_do_nivel(db_limpo, cadeia):
+    agora = datetime.datetime.now(datetime.timezone.utc)
+    situacao = {
+        "status_ancoragem": ancoragem.STATUS_CONFIRMADO, "tx_hash": "0xabc", "bloco_ancoragem": 7,
+        "tentativas_ancoragem": 1, "data_envio_ancoragem": agora, "data_confirmacao_ancoragem": agora,
+    }
+    with db_limpo() as db:
+        ancoragem.refletir_nos_lotes(db, [("serrado", cadeia["serrado"])], situacao)
+        db.commit()
+        linha = _linha(db, cadeia["produto"])
+        assert (linha.status_ancoragem_serrado, linha.tx_hash_serrado, linha.bloco_ancoragem_serrado) == \
+            (ancoragem.STATUS_CONFIRMADO, "0xabc", 7)
+        assert linha.status_ancoragem_tora == linha.status_ancoragem_produto == ancoragem.STATUS_PENDENTE
+        assert linha.tx_hash_tora is None
+
+
+def test_rollback_desfaz_a_linha(db_limpo, cadeia):
+    with db_limpo() as db:
+        db.get(models.LoteTora, cadeia["tora"]).especie_madeira_popular = "Cumaru"
+        db.flush()
+        assert _linha(db, cadeia["produto"]).especie_madeira_popular == "Cumaru"
+        db.rollback()
+        assert _linha(db, cadeia["produto"]).especie_madeira_popular == "Ipê"
+
+
+def test_troca_de_origem_reconstroi_a_linha(db_limpo, cadeia):
+    with db_limpo() as db:
+        outra = models.LoteTora(
+            id_lote_custom="TORA-T-002", id_tecnico_campo=cadeia["tecnico"], coordenadas_gps_lat=-3.2,
+            coordenadas_gps_lon=-60.1, numero_dof="DOF-9", numero_licenca_ambiental="LIC",
+            especie_madeira_popular="Jatobá", volume_estimado_m3=5,
+        )
+        db.add(outra)
+        db.flush()
+        db.get(models.LoteSerrado, cadeia["serrado"]).id_lote_tora_origem = outra.id
+        db.commit()
+        linha = _linha(db, cadeia["produto"])
+        assert (linha.id_lote_tora, linha.id_lote_tora_custom, linha.numero_dof) == (outra.id, "TORA-T-002", "DOF-9")
+
+
+def test_produto_apagado_remove_a_linha(db_limpo, cadeia):
+    with db_limpo() as db:
+        # Como no PostgreSQL: a linha referencia o produto e a FK é verificada na hora
+        db.execute(text("PRAGMA foreign_keys=ON"))
+        try:
+            db.delete(db.get(models.LoteProdutoAcabado, cadeia["produto"]))
+            db.commit()
+            assert _linha(db, cadeia["produto"]) is None
+        finally:
+            db.rollback()
+            db.execute(text("PRAGMA foreign_keys=OFF"))  # a conexão volta ao pool
+
+
+def test_preenchimento_dos_produtos_sem_linha(db_limpo, cadeia):
+    with db_limpo() as db:
+        db.connection().execute(Linhagem.__table__.delete())
+        assert linhagem.inserir(db.connection()) == 1
+        assert linhagem.inserir(db.connection()) == 0  # idempotente
+        db.commit()
+        assert _linha(db, cadeia["produto"]).id_lote_tora == cadeia["tora"]
@@ -0,0 +1,46 @@
+import datetime
+
+import pytest
+
+import models
+import schemas
+import servicos
+
+SERRARIA = schemas.UsuarioAutenticado(id=1, email="s@teste", role="serraria")
+
+
+@pytest.fixture
+def dof_com_cinco_serrados(cadeia, db_limpo):
+    with db_limpo() as db:
+        for i in range(4):
+            db.add(models.LoteSerrado(
+                id_lote_serrado_custom=f"SERR-T-1{i}", id_lote_tora_origem=cadeia["tora"],
+                id_equipe_serraria=cadeia["serraria"], data_recebimento_tora=datetime.datetime.now(), volume_saida_m3=1,
+            ))
+        db.commit()
+    return cadeia
+
+
+def test_profundidade_1_pagina_os_lotes_serrados(dof_com_cinco_serrados, db_limpo):
+    vistos, cursor, totais = [], None, []
+    with db_limpo() as db:
+        while True:
+            filtros = schemas.FiltrosLista(cursor=cursor, limite=2)
+            linhagem, cursor = servicos.linhagem_da_tora(db, SERRARIA, numero_dof="DOF-1", profundidade=1, filtros=filtros)
+            vistos += [s.id_lote_serrado_custom for s in linhagem.lotes_serrados]
+            totais.append(linhagem.total_lotes_serrados)
+            if cursor is None:
+                break
+    assert len(vistos) == len(set(vistos)) == 5
+    assert totais == [5, None, None]
+
+
+def test_profundidade_2_limita_os_lotes_serrados(dof_com_cinco_serrados, db_limpo):
+    with db_limpo() as db:
+        linhagem, proximo = servicos.linhagem_da_tora(
+            db, SERRARIA, numero_dof="DOF-1", profundidade=2, filtros=schemas.FiltrosLista(limite=2),
+        )
+    assert len(linhagem.lotes_serrados) == 2
+    assert linhagem.total_lotes_serrados == 5
+    assert [p.id_lote_produto_custom for p in linhagem.produtos] == ["PROD-T-001"]
+    assert linhagem.total_produtos == 1 and proximo is None
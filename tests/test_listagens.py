@@ -0,0 +1,76 @@
+import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import models
+import schemas
+import servicos
+
+
+@pytest.fixture
+def toras(db_limpo):
+    """5 toras do técnico 1 e 2 do técnico 2, com datas distintas (e duas empatadas)."""
+    base = datetime.datetime(2024, 1, 1, 12, 0)
+    with db_limpo() as db:
+        db.add_all([
+            models.TecnicoCampo(nome="a", email="a@teste", hash_senha="x"),
+            models.TecnicoCampo(nome="b", email="b@teste", hash_senha="x"),
+        ])
+        db.flush()
+        for i, (tecnico, minutos) in enumerate([(1, 0), (1, 1), (1, 1), (1, 2), (1, 3), (2, 4), (2, 5)]):
+            db.add(models.LoteTora(
+                id_lote_custom=f"TORA-{i}", id_tecnico_campo=tecnico, data_hora_registro=base + datetime.timedelta(minutes=minutos),
+                coordenadas_gps_lat=0, coordenadas_gps_lon=0, numero_dof="D", numero_licenca_ambiental="L",
+                volume_estimado_m3=1,
+            ))
+        db.commit()
+
+
+def _usuario(id_usuario):
+    return schemas.UsuarioAutenticado(id=id_usuario, email="x@teste", role="tecnico")
+
+
+def test_paginas_cobrem_tudo_sem_repetir(toras, db_limpo):
+    vistos, cursor = [], None
+    with db_limpo() as db:
+        while True:
+            itens, cursor = servicos.listar_lotes_tora(db, _usuario(1), schemas.FiltrosLista(cursor=cursor, limite=2))
+            vistos += [item.id_lote_custom for item in itens]
+            if cursor is None:
+                break
+    assert vistos == ["TORA-4", "TORA-3", "TORA-2", "TORA-1", "TORA-0"]
+
+
+@pytest.mark.parametrize("id_cursor", [6, 999])  # tora de outro técnico / inexistente
+def test_cursor_fora_do_conjunto_da_400(toras, db_limpo, id_cursor):
+    with db_limpo() as db:
+        with pytest.raises(HTTPException) as erro:
+            servicos.listar_lotes_tora(db, _usuario(1), schemas.FiltrosLista(cursor=servicos._codificar_cursor(id_cursor), limite=2))
+    assert erro.value.status_code == 400
+
+
+def _percorrer(db_limpo, usuario, limite):
+    vistos, cursor = [], None
+    with db_limpo() as db:
+        for _ in range(50):
+            itens, cursor = servicos.listar_lotes_tora(db, usuario, schemas.FiltrosLista(cursor=cursor, limite=limite))
+            vistos += [item.id for item in itens]
+            if cursor is None:
+                return vistos
+    raise AssertionError(f"paginação não terminou: {vistos[:12]}...")
+
+
+def test_paginas_de_lotes_criados_pela_api(db_limpo):
+    # data_hora_registro vem do server_default do banco (no SQLite, sem microssegundos)
+    with db_limpo() as db:
+        tecnico = models.TecnicoCampo(nome="t", email="t@teste", hash_senha="x")
+        db.add(tecnico)
+        db.commit()
+        for i in range(5):
+            servicos.criar_lote_tora(db, schemas.LoteToraCreate(
+                coordenadas_gps_lat="-3.1", coordenadas_gps_lon="-60.0", numero_dof=f"DOF-{i}",
+                numero_licenca_ambiental="LIC", especie_madeira_popular="Ipê", volume_estimado_m3="1",
+            ), tecnico.id)
+        usuario = _usuario(tecnico.id)
+    assert _percorrer(db_limpo, usuario, 2) == [5, 4, 3, 2, 1]
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import main
+import models
+
+
+@pytest.fixture
+def cliente(db_limpo):
+    with db_limpo() as db:
+        db.add(models.TecnicoCampo(nome="t", email="t@example.com", hash_senha=auth.get_hash_senha("segredo")))
+        db.commit()
+    return TestClient(main.app)
+
+
+def test_login_e_assincrono():
+    # A espera pelo bcrypt não pode prender uma thread do threadpool das rotas
+    assert asyncio.iscoroutinefunction(main.login_for_access_token)
+
+
+def test_login(cliente):
+    resposta = cliente.post("/token", data={"username": "t@example.com", "password": "segredo"})
+    assert resposta.status_code == 200 and resposta.json()["token_type"] == "bearer"
+    token = resposta.json()["access_token"]
+    assert cliente.get("/users/me", headers={"Authorization": f"Bearer {token}"}).json()["role"] == "tecnico"
+
+
+@pytest.mark.parametrize("usuario, senha", [("t@example.com", "errada"), ("ninguem@example.com", "segredo")])
+def test_login_recusado(cliente, usuario, senha):
+    resposta = cliente.post("/token", data={"username": usuario, "password": senha})
+    assert resposta.status_code == 401
+
+
+def test_login_com_pool_do_bcrypt_saturado(cliente, monkeypatch):
+    def cheio(*args):
+        raise auth.FilaSenhasCheia()
+
+    monkeypatch.setattr(auth, "_submeter_verificacao", cheio)
+    resposta = cliente.post("/token", data={"username": "t@example.com", "password": "segredo"})
+    assert resposta.status_code == 503 and resposta.headers["Retry-After"] == "1"
@@ -0,0 +1,66 @@
+import pytest
+
+import ancoragem
+import merkle
+import models
+
+
+def _folhas(quantidade):
+    return [merkle.hash_folha({"tipo": "tora", "id_lote_custom": f"TORA-T-{i:03d}"}) for i in range(quantidade)]
+
+
+@pytest.mark.parametrize("quantidade", [1, 2, 3, 5, 7, 8])
+def test_provas_de_todas_as_folhas_verificam(quantidade):
+    folhas = _folhas(quantidade)
+    raiz, provas = merkle.construir_arvore(folhas)
+    assert len(provas) == quantidade
+    for folha, prova in zip(folhas, provas):
+        assert merkle.verificar_prova(folha, prova, raiz)
+    if quantidade == 1:
+        assert raiz == folhas[0] and provas == [[]]
+
+
+@pytest.mark.parametrize("quantidade", [3, 5, 7])
+def test_ultima_folha_de_nivel_impar_sobe_sem_hash(quantidade):
+    folhas = _folhas(quantidade)
+    raiz, provas = merkle.construir_arvore(folhas)
+    # A última folha não tem irmão no primeiro nível: a prova é mais curta
+    assert len(provas[-1]) < len(provas[0])
+    assert merkle.verificar_prova(folhas[-1], provas[-1], raiz)
+
+
+def test_folha_ou_prova_adulterada_nao_verifica():
+    folhas = _folhas(5)
+    raiz, provas = merkle.construir_arvore(folhas)
+    outra = merkle.hash_folha({"tipo": "tora", "id_lote_custom": "TORA-T-999"})
+    assert not merkle.verificar_prova(outra, provas[2], raiz)
+    assert not merkle.verificar_prova(folhas[2], provas[2][:-1], raiz)
+    assert not merkle.verificar_prova(folhas[2], provas[1], raiz)
+
+
+def test_arvore_vazia():
+    with pytest.raises(ValueError):
+        merkle.construir_arvore([])
+
+
+def test_grupo_do_despachante_gera_provas_verificaveis(db_limpo, blockchain_local, monkeypatch):
+    monkeypatch.setattr(ancoragem, "MODO", ancoragem.MODO_MERKLE)
+    monkeypatch.setattr(ancoragem, "MERKLE_TAMANHO_MAX", 3)
+    lotes = [("tora", i) for i in range(1, 4)]
+    with db_limpo() as db:
+        for tipo_lote, id_lote in lotes:
+            ancoragem.enfileirar(db, tipo_lote, id_lote, f"TORA-T-{id_lote:03d}", {"id_lote_custom": f"TORA-T-{id_lote:03d}"})
+        db.commit()
+
+    # 3 itens agrupados + o envio do grupo
+    assert ancoragem.DespachanteAncoragem(session_factory=db_limpo).processar_uma_vez() == 4
+    with db_limpo() as db:
+        grupo = db.query(models.LoteMerkle).one()
+        assert (grupo.quantidade, grupo.status) == (3, ancoragem.STATUS_ENVIADO) and grupo.tx_hash
+        provas = ancoragem.obter_provas(db, lotes)
+    assert len(provas) == 3
+    for prova in provas.values():
+        folha = merkle.hash_folha(prova["registro"])
+        assert "0x" + folha.hex() == prova["folha"]
+        assert prova["raiz"] == grupo.raiz
+        assert merkle.verificar_prova(folha, [bytes.fromhex(irmao[2:]) for irmao in prova["prova"]], bytes.fromhex(grupo.raiz[2:]))
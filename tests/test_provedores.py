@@ -0,0 +1,192 @@
+import json
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+import provedores
+
+
+class Relogio:
+    """Substitui provedores.time: monotonic e perf_counter andam só quando mandamos."""
+
+    def __init__(self):
+        self.agora = 1000.0
+
+    def monotonic(self):
+        return self.agora
+
+    def perf_counter(self):
+        return self.agora
+
+    def avancar(self, segundos):
+        self.agora += segundos
+
+
+class TransporteFalso(BaseAdapter):
+    """
+    Adaptador HTTP roteirizado por host: cada chamada consome o próximo
+    comportamento da fila do host ("ok" quando a fila acaba). Registra o
+    host de cada chamada e avança o relógio pela latência do host.
+    """
+
+    def __init__(self, relogio, latencias):
+        super().__init__()
+        self.relogio = relogio
+        self.latencias = latencias
+        self.roteiro = {host: [] for host in latencias}
+        self.chamadas = []
+
+    def send(self, request, **kwargs):
+        host = request.url.split("//")[1].split("/")[0]
+        self.chamadas.append(host)
+        self.relogio.avancar(self.latencias[host])
+        corpo = json.loads(request.body)
+        comportamento = self.roteiro[host].pop(0) if self.roteiro[host] else "ok"
+        if comportamento == "timeout":
+            raise requests.ReadTimeout("timeout simulado", request=request)
+        if comportamento == "conexao":
+            raise requests.ConnectionError("conexão recusada", request=request)
+
+        status, erro = 200, None
+        if isinstance(comportamento, int):
+            status = comportamento
+        elif comportamento == "limite_rpc":
+            erro = {"code": -32005, "message": "daily request count exceeded, request rate limited"}
+        elif comportamento == "revert":
+            erro = {"code": 3, "message": "execution reverted"}
+
+        def responder(pedido):
+            if erro:
+                return {"jsonrpc": "2.0", "id": pedido["id"], "error": erro}
+            return {"jsonrpc": "2.0", "id": pedido["id"], "result": host}
+
+        resposta = requests.Response()
+        resposta.status_code = status
+        resposta.url = request.url
+        resposta.request = request
+        resposta._content = json.dumps(
+            [responder(p) for p in corpo] if isinstance(corpo, list) else responder(corpo)
+        ).encode()
+        return resposta
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def rede(monkeypatch):
+    """Provedor com três endpoints (primário mais rápido) sobre o transporte falso."""
+    relogio = Relogio()
+    transporte = TransporteFalso(relogio, {"primario": 0.01, "secundario": 0.05, "terciario": 0.08})
+    monkeypatch.setattr(provedores, "time", relogio)
+    monkeypatch.setattr(provedores, "HTTPAdapter", lambda **kwargs: transporte)
+    monkeypatch.setattr(provedores, "RPC_BACKOFF_BASE_S", 1.0)
+    monkeypatch.setattr(provedores, "RPC_BACKOFF_MAX_S", 2.0)
+    provedor = provedores.ProvedorFailover(["http://primario", "http://secundario", "http://terciario"])
+    # Aquecimento: cada endpoint sem medição passa na frente uma vez
+    for _ in provedor.endpoints:
+        provedor.make_request("eth_blockNumber", [])
+    transporte.chamadas.clear()
+    return provedor, transporte, relogio
+
+
+def _chamar(provedor):
+    return provedor.make_request("eth_blockNumber", [])["result"]
+
+
+def _erros(provedor, indice, tipo):
+    nome = provedor.endpoints[indice].nome
+    return provedores.erros_rpc._amostras().get((nome, tipo), 0)
+
+
+def test_usa_o_endpoint_mais_rapido(rede):
+    provedor, transporte, _ = rede
+    assert [_chamar(provedor) for _ in range(3)] == ["primario"] * 3
+    assert transporte.chamadas == ["primario"] * 3
+
+
+@pytest.mark.parametrize("falha, tipo", [
+    ("timeout", "timeout"), ("conexao", "conexao"), (503, "http"), (429, "limite"), ("limite_rpc", "limite"),
+])
+def test_falha_passa_para_o_proximo_e_suspende(rede, falha, tipo):
+    provedor, transporte, relogio = rede
+    antes = _erros(provedor, 0, tipo)
+    transporte.roteiro["primario"] = [falha]
+
+    assert _chamar(provedor) == "secundario"
+    assert transporte.chamadas == ["primario", "secundario"]
+    assert _erros(provedor, 0, tipo) == antes + 1
+    assert provedor.estado()[0]["falhas_seguidas"] == 1
+
+    # Suspenso: nem é tentado
+    assert _chamar(provedor) == "secundario"
+    assert transporte.chamadas[-1] == "secundario" and transporte.chamadas.count("primario") == 1
+
+    # Passado o backoff, volta ao primário (continua o mais rápido)
+    relogio.avancar(1.0)
+    assert _chamar(provedor) == "primario"
+    assert provedor.estado()[0]["falhas_seguidas"] == 0
+
+
+def test_backoff_dobra_a_cada_falha_seguida_ate_o_maximo(rede):
+    provedor, transporte, relogio = rede
+    transporte.roteiro["primario"] = ["timeout"] * 3
+    suspensoes = []
+    for _ in range(3):
+        _chamar(provedor)
+        endpoint = provedor.endpoints[0]
+        suspensoes.append(round(endpoint.suspenso_ate - relogio.agora, 2))
+        relogio.avancar(endpoint.suspenso_ate - relogio.agora)
+    # 1 s, 2 s, 2 s (máximo), medidos depois da chamada ao secundário (0,05 s)
+    assert suspensoes == [0.95, 1.95, 1.95]
+    assert transporte.chamadas == ["primario", "secundario"] * 3
+
+
+def test_erro_do_json_rpc_volta_sem_failover(rede):
+    provedor, transporte, _ = rede
+    antes = provedores.erros_rpc._amostras()
+    transporte.roteiro["primario"] = ["revert"]
+    resposta = provedor.make_request("eth_call", [])
+    assert resposta["error"]["message"] == "execution reverted"
+    assert transporte.chamadas == ["primario"]
+    assert provedores.erros_rpc._amostras() == antes
+    assert provedor.estado()[0]["falhas_seguidas"] == 0
+
+
+def test_todos_falhando_tenta_cada_um_e_propaga_o_ultimo_erro(rede):
+    provedor, transporte, _ = rede
+    transporte.roteiro.update(primario=["timeout"], secundario=[503], terciario=["conexao"])
+    with pytest.raises(requests.ConnectionError):
+        _chamar(provedor)
+    assert transporte.chamadas == ["primario", "secundario", "terciario"]
+
+    # Todos suspensos: tenta mesmo assim, começando pelo que volta primeiro
+    transporte.chamadas.clear()
+    assert _chamar(provedor) == "primario"
+    assert transporte.chamadas == ["primario"]
+
+
+def test_lote_faz_failover_inteiro(rede):
+    provedor, transporte, _ = rede
+    transporte.roteiro["primario"] = [429]
+    respostas = provedor.make_batch_request([("eth_blockNumber", []), ("eth_chainId", []), ("eth_gasPrice", [])])
+    assert [r["result"] for r in respostas] == ["secundario"] * 3
+    assert transporte.chamadas == ["primario", "secundario"]  # uma requisição HTTP por endpoint
+
+
+def test_lote_com_limite_em_um_item_faz_failover(rede):
+    provedor, transporte, _ = rede
+    transporte.roteiro["primario"] = ["limite_rpc"]
+    respostas = provedor.make_batch_request([("eth_blockNumber", []), ("eth_chainId", [])])
+    assert [r["result"] for r in respostas] == ["secundario"] * 2
+
+
+def test_metricas_de_latencia_por_endpoint(rede):
+    provedor, _, _ = rede
+    nome = provedor.endpoints[0].nome
+    antes = provedores.latencia_rpc._series[(nome,)][-1]
+    _chamar(provedor)
+    serie = provedores.latencia_rpc._series[(nome,)]
+    assert serie[-1] == antes + 1
+    assert provedor.estado()[0]["latencia_media_ms"] == 10.0
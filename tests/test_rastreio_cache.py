@@ -0,0 +1,31 @@
+import time
+
+import ancoragem
+import servicos
+
+
+def _max_age(resposta) -> int:
+    return int(resposta.headers["Cache-Control"].split("max-age=")[1])
+
+
+def test_cadeia_pendente_fica_pouco_tempo_em_cache(cadeia, db_limpo):
+    servicos.cache_rastreio.limpar()
+    with db_limpo() as db:
+        entrada = servicos.rastrear_produto_cacheado(db, cadeia["id_produto_custom"])
+    assert entrada["final"] is False
+    assert _max_age(servicos.resposta_rastreio(entrada, None)) <= servicos.CACHE_RASTREIO_TTL_PENDENTE_S
+
+    _, expira = servicos.cache_rastreio._itens[cadeia["id_produto_custom"]]
+    assert expira - time.monotonic() <= servicos.CACHE_RASTREIO_TTL_PENDENTE_S
+
+
+def test_cadeia_confirmada_usa_ttl_longo(cadeia, db_limpo):
+    servicos.cache_rastreio.limpar()
+    lotes = [("tora", cadeia["tora"]), ("serrado", cadeia["serrado"]), ("produto", cadeia["produto"])]
+    with db_limpo() as db:
+        ancoragem.refletir_nos_lotes(db, lotes, {"status_ancoragem": ancoragem.STATUS_CONFIRMADO, "tx_hash": "0xabc"})
+        db.commit()
+        entrada = servicos.rastrear_produto_cacheado(db, cadeia["id_produto_custom"])
+    assert entrada["final"] is True
+    assert entrada["dados"]["lote_tora"]["tx_hash"] == "0xabc"
+    assert _max_age(servicos.resposta_rastreio(entrada, None)) == servicos.RASTREIO_MAX_AGE_S